@@ -1,18 +1,31 @@
 from enum import Enum
 import click
-from datetime import timedelta
 from terminaltables import AsciiTable
 from thefuzz import fuzz
+from concurrent.futures import ProcessPoolExecutor
 import json
 import math
 from .utils import create_cloudwatch_link, format_timestamp, select_range
-from .aws import list_metrics, get_metric_data, create_cloudwatch_alarm, cw_client
-from .timeseries import zero_pad, get_breaches, longest_breach, ThresholdAdjustment
+from .aws import list_metrics, get_metric_data, fetch_statistics, create_cloudwatch_alarm, cw_client, STATISTICS
+from .timeseries import zero_pad, longest_breach, ThresholdAdjustment
+from .api import find_threshold
+from .incidents import score_candidates, rank
+from .plot import plot
+from .validation import load_history, validate
+from .budget import estimate_run, format_estimate
 
 # Define constants
 WEIGHTS = {'Namespace': 0.5, 'MetricName': 0.3, 'Dimensions': 0.3}
-MAX_ITERATIONS = 100
 NUM_SEARCH_RESULTS = 5
+COMPARE_STATISTICS = 'Compare'
+NUM_TOP_SCORES = 10
+
+def rank_metrics(metrics, search):
+    """Sorts the metrics by how well they match the search."""
+    return sorted(metrics, key=lambda metric: WEIGHTS['Namespace'] * fuzz.token_set_ratio(search, metric['Namespace']) +
+                  WEIGHTS['MetricName'] * fuzz.token_set_ratio(search, metric['MetricName']) +
+                  WEIGHTS['Dimensions'] * fuzz.token_set_ratio(search, json.dumps(metric['Dimensions'])), reverse=True)
+
 
 def prompt_metric_search(metrics):
     """Prompts the user for a metric search and returns a selected metric."""
@@ -21,9 +34,7 @@ def prompt_metric_search(metrics):
         search = click.prompt('Search', type=str)
         click.echo('Select a metric from the list below')
 
-        metrics = sorted(metrics, key=lambda metric: WEIGHTS['Namespace'] * fuzz.token_set_ratio(search, metric['Namespace']) +
-                         WEIGHTS['MetricName'] * fuzz.token_set_ratio(search, metric['MetricName']) +
-                         WEIGHTS['Dimensions'] * fuzz.token_set_ratio(search, json.dumps(metric['Dimensions'])), reverse=True)
+        metrics = rank_metrics(metrics, search)
 
         for i, metric in enumerate(metrics[:NUM_SEARCH_RESULTS]):
             click.echo(
@@ -44,73 +55,120 @@ def prompt_metric_search(metrics):
         return metrics[selected_metric - 1]
 
 
-def retrieve_and_pad_data(metric, period, statistic, client):
-    """Retrieves and pads metric data."""
+def output_run_estimate(period, statistics, catalogue_size, inventory=None):
+    """Prints the estimated API usage of a tuning run, including the metric catalogue already listed."""
+    start, end = select_range()
+    # A fresh inventory needs no alarm scan, without one every alarm is scanned for suggested actions
+    num_alarms = inventory.count() if inventory is not None and inventory.is_stale() else 0
+    estimate = estimate_run(period, start, end, statistics=statistics, catalogue_size=catalogue_size, num_alarms=num_alarms,
+                            alarms_created=1)
+    scan = '' if inventory is not None else ', plus a DescribeAlarms request per 100 alarms for suggested actions'
+    click.echo(f"Estimated usage: {format_estimate(estimate)}{scan}.")
+
+
+def retrieve_and_pad_data(metric, period, statistic, client, budget=None):
+    """Retrieves and pads metric data, returning the data, its range and period."""
     start, end = select_range()
 
     click.echo(f"Retrieving data from {format_timestamp(start)} to {format_timestamp(end)}.")
 
+    if budget is not None:
+        data, start, end, budget_period = budget.fetch(metric, statistic, period, client, start, end)
+        if budget_period != period:
+            click.echo(f"Using a {budget_period} minute period from {format_timestamp(start)} to stay within the budget.")
+        if len(data) == 0:
+            click.echo("No data found.")
+        return data, start, end, budget_period
+
     data = get_metric_data(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period, statistic, client)
     click.echo(f"Retrieved {len(data)} data points.")
 
     if len(data) == 0:
         click.echo("No data found.")
-        return []
+        return [], start, end, period
 
     data = zero_pad(data, period, start, end)
     click.echo(f"Padded data to {len(data)} data points.")
-    return data, start, end
+    return data, start, end, period
 
 
-def calculate_threshold_and_breaches(data, alarm_type, window_size, max_alerts):
-    """Calculates threshold and breaches for the given data."""
-    # Initial values
-    values = [value for timestamp, value in data]
-    sum_values = sum(values)
-    std_dev = sum([abs(value - sum_values / len(values))
-            for value in values]) / len(values)
+def retrieve_statistics(metric, period, statistics, client, budget=None):
+    """Retrieves and pads several statistics of a metric in one request, skipping those without data.
 
-    if alarm_type.is_gt():
-        threshold = math.ceil(sum_values / len(values) + 5 * std_dev)
-    elif alarm_type.is_lt():
-        threshold = max(math.ceil(sum_values / len(values) - 5 * std_dev), 1)
+    Returns the series by statistic, their range and period.
+    """
+    start, end = select_range()
 
-    breaches = get_breaches(data, threshold, alarm_type,
-                            window_size, math.ceil(window_size / 2))
+    click.echo(f"Retrieving {', '.join(statistics)} from {format_timestamp(start)} to {format_timestamp(end)}.")
 
+    if budget is not None:
+        series, start, end, budget_period = budget.fetch_statistics(metric, statistics, period, client, start, end)
+        if budget_period != period:
+            click.echo(f"Using a {budget_period} minute period from {format_timestamp(start)} to stay within the budget.")
+        return series, start, end, budget_period
 
-    # Threshold search when breaches are too many or too long
-    if len(breaches) > max_alerts or longest_breach(breaches) > timedelta(days=2):
-        click.echo('Starting binary search for threshold.')
+    series = fetch_statistics(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period, statistics, client)
+    return {statistic: zero_pad(data, period, start, end) for statistic, data in series.items() if data}, start, end, period
 
-        min_threshold = min(values)
-        max_threshold = max(values) * 2
 
-        for i in range(MAX_ITERATIONS):
-            click.echo(
-                f"Iteration {i + 1}. Evaluating threshold of {threshold}.")
-            threshold = math.ceil((min_threshold + max_threshold) / 2)
-            breaches = get_breaches(
-                data, threshold, alarm_type, window_size, math.ceil(window_size / 2))
+def compare_statistics(series, alarm_type, window_size, max_alerts, executor=None):
+    """Searches for a threshold for each statistic concurrently, returning a dict of statistic to (threshold, breaches)."""
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
 
-            if len(breaches) > max_alerts:
-                min_threshold = threshold
-            else:
-                if longest_breach(breaches) < timedelta(days=2):
-                    break
-                else:
-                    min_threshold = threshold
-                    max_threshold = max_threshold * 2
+    try:
+        futures = {statistic: executor.submit(find_threshold, data, alarm_type, window_size, max_alerts)
+                   for statistic, data in series.items()}
+        return {statistic: future.result() for statistic, future in futures.items()}
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def select_statistic(results):
+    """Returns the statistic with the fewest alerts, then the shortest longest breach.
+
+    A threshold that would never have fired tells nothing about the metric, so
+    statistics without any alerts only win when all of them are quiet.
+    """
+    def rank(statistic):
+        breaches = results[statistic][1]
+        return (len(breaches) == 0, len(breaches), longest_breach(breaches), STATISTICS.index(statistic))
 
-    return threshold, breaches
+    return min(results, key=rank)
 
 
-def output_rating_and_adjustment(metric, data, alarm_type, threshold, window_size, breaches, start, region, statistic, period):
+def output_statistics_comparison(results):
+    """Prints the threshold, alerts and longest breach of each statistic side by side, returning the winner."""
+    winner = select_statistic(results)
+    table_data = [['Statistic', 'Threshold', 'Alerts', 'Longest Breach']]
+    for statistic in STATISTICS:
+        if statistic in results:
+            threshold, breaches = results[statistic]
+            table_data.append([f"{statistic} *" if statistic == winner else statistic, threshold, len(breaches),
+                               longest_breach(breaches)])
+
+    click.echo(AsciiTable(table_data).table)
+    click.echo(f"Continuing with {winner}.")
+    click.echo()
+    return winner
+
+
+def calculate_threshold_and_breaches(data, alarm_type, window_size, max_alerts):
+    """Calculates threshold and breaches for the given data."""
+    return find_threshold(data, alarm_type, window_size, max_alerts, log=click.echo)
+
+
+def output_rating_and_adjustment(metric, data, alarm_type, threshold, window_size, breaches, start, region, statistic, period, show_plot=True):
     """Handles output rating and adjustment based on user feedback."""
 
     # Create an instance of ThresholdAdjustment
     adjustment = ThresholdAdjustment(threshold, breaches, data, alarm_type, window_size)
 
+    # Shortening a link is a network call, so links are only made once asked for and then kept
+    links = {'show': False, 'cache': {}}
+
     # Define option map
     option_map = {
         1: {
@@ -133,6 +191,10 @@ def output_rating_and_adjustment(metric, data, alarm_type, threshold, window_siz
             "description": "Just right",
             "action": None,  # No action for this option
         },
+        6: {
+            "description": "Show links to the alerts",
+            "action": lambda: links.update(show=True),
+        },
     }
 
     while True:
@@ -140,16 +202,24 @@ def output_rating_and_adjustment(metric, data, alarm_type, threshold, window_siz
             adjustment.threshold = math.ceil(adjustment.threshold)
 
         click.echo(f"X {'>' if alarm_type.is_gt() else '<'} {adjustment.threshold} for {int(adjustment.window_size/2)} in {adjustment.window_size} datapoints would have triggered {len(adjustment.breaches)} alerts.")
-        table_data = [['Start', 'End', 'Duration', 'Link']]
+        if show_plot:
+            plot(data, adjustment.threshold, adjustment.breaches)
+            click.echo()
+
+        table_data = [['Start', 'End', 'Duration', 'Link'] if links['show'] else ['Start', 'End', 'Duration']]
 
         for breach in adjustment.breaches:
             duration = breach['end'] - breach['start']
-            link = create_cloudwatch_link(
-                metric['Namespace'], metric['MetricName'], breach['start'],
-                breach['end'], metric['Dimensions'], adjustment.threshold, region, statistic, period
-            )
-            table_data.append([format_timestamp(breach['start']),
-                              format_timestamp(breach['end']), duration, link])
+            row = [format_timestamp(breach['start']), format_timestamp(breach['end']), duration]
+            if links['show']:
+                key = (breach['start'], breach['end'], adjustment.threshold)
+                if key not in links['cache']:
+                    links['cache'][key] = create_cloudwatch_link(
+                        metric['Namespace'], metric['MetricName'], breach['start'],
+                        breach['end'], metric['Dimensions'], adjustment.threshold, region, statistic, period
+                    )
+                row.append(links['cache'][key])
+            table_data.append(row)
 
         if len(table_data) > 1:
             table = AsciiTable(table_data) 
@@ -174,60 +244,178 @@ def output_rating_and_adjustment(metric, data, alarm_type, threshold, window_siz
     return adjustment.threshold, adjustment.window_size
 
 
-def ask_to_create_alarm(metric, threshold, alarm_type, client, statistic, period, window_size):
+def output_incident_scores(scores, limit=NUM_TOP_SCORES):
+    """Prints the best scoring configurations against the incidents, returning the best."""
+    ranked = sorted(scores, key=rank, reverse=True)
+    table_data = [['Threshold', 'Window', 'Alerts', 'Precision', 'Recall', 'Mean Time To Detect']]
+    for s in ranked[:limit]:
+        table_data.append([s.threshold, s.window_size, s.alerts, f"{s.precision:.0%}", f"{s.recall:.0%}",
+                           s.mean_time_to_detect if s.mean_time_to_detect is not None else '-'])
+
+    best = ranked[0]
+    click.echo(AsciiTable(table_data).table)
+    click.echo(f"Best configuration detects {best.detected} of {best.incidents} incidents with {best.alerts} alerts: "
+               f"threshold {best.threshold}, {best.datapoints_to_alarm} of {best.window_size} datapoints.")
+    click.echo()
+    return best
+
+
+def ask_to_create_alarm(metric, threshold, alarm_type, client, statistic, period, window_size, inventory=None):
     """Asks the user if they want to create a CloudWatch alarm and creates it if they do."""
     if click.confirm('Create/Update an alarm for this metric?', default=True):
         create_cloudwatch_alarm(
             metric['MetricName'], metric['Namespace'], metric['Dimensions'], threshold, alarm_type,
-            client, statistic=statistic, period=period, window_size=window_size
+            client, statistic=statistic, period=period, window_size=window_size, inventory=inventory
         )
 
 
-def run(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1', window_size=5, max_alerts=11, client=None):
-    """Select threshold for CloudWatch metrics."""
+def run(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1', window_size=5, max_alerts=11, client=None, budget=None, inventory=None, show_plot=True, incidents=None):
+    """Select threshold for CloudWatch metrics, scoring candidates against incidents when they are given."""
 
     if not client:
         client = cw_client(aws_profile, region)
 
+    if budget is not None:
+        client = budget.wrap(client)
+
     try:
         metrics = list_metrics(client)
     except Exception as e:
         click.echo(f"Failed to list metrics: {e}")
         return 1  # Non-zero status code to indicate an error
 
+    output_run_estimate(period, len(STATISTICS) if statistic == COMPARE_STATISTICS else 1, len(metrics), inventory)
+
     try:
         metric = prompt_metric_search(metrics)
     except Exception as e:
         click.echo(f"Failed to prompt for metric search: {e}")
         return 1
 
+    if statistic == COMPARE_STATISTICS:
+        try:
+            series, start, end, period = retrieve_statistics(metric, period, STATISTICS, client, budget)
+        except Exception as e:
+            click.echo(f"Failed to retrieve statistics: {e}")
+            return 1
+
+        if not series:
+            click.echo("No data found.")
+            return 0
+
+        try:
+            results = compare_statistics(series, alarm_type, window_size, max_alerts)
+        except Exception as e:
+            click.echo(f"Failed to compare statistics: {e}")
+            return 1
+
+        statistic = output_statistics_comparison(results)
+        data = series[statistic]
+        threshold, breaches = results[statistic]
+    else:
+        try:
+            data, start, end, period = retrieve_and_pad_data(metric, period, statistic, client, budget)
+        except Exception as e:
+            click.echo(f"Failed to retrieve and pad data: {e}")
+            return 1
+
+        if len(data) == 0:
+            return 0
+
+        try:
+            threshold, breaches = calculate_threshold_and_breaches(data, alarm_type, window_size, max_alerts)
+        except Exception as e:
+            click.echo(f"Failed to calculate threshold and breaches: {e}")
+            return 1
+
+    best = None
+    if incidents is not None:
+        try:
+            best = output_incident_scores(score_candidates(data, alarm_type, incidents))
+        except Exception as e:
+            click.echo(f"Failed to score against incidents: {e}")
+            return 1
+
+        if best.incidents == 0:
+            click.echo("No incidents during the data range, falling back to rating the output.")
+            best = None
+
+    if best is not None:
+        threshold, window_size = best.threshold, best.window_size
+        if show_plot:
+            plot(data, threshold, best.breaches)
+    else:
+        try:
+            threshold, window_size = output_rating_and_adjustment(
+                metric, data, alarm_type, threshold, window_size, breaches, start, region, statistic, period, show_plot
+            )
+        except Exception as e:
+            click.echo(f"Failed to adjust output based on rating: {e}")
+            return 1
+
     try:
-        data, start, end = retrieve_and_pad_data(metric, period, statistic, client)
+        ask_to_create_alarm(metric, threshold, alarm_type, client, statistic, period, window_size, inventory)
     except Exception as e:
-        click.echo(f"Failed to retrieve and pad data: {e}")
+        click.echo(f"Failed to create alarm: {e}")
         return 1
 
-    if len(data) == 0:
-        return 0
+    return 0
+
+
+def output_validation_report(report):
+    """Prints the folds and stability of a walk-forward validation."""
+    table_data = [['Train Start', 'Test Start', 'Test End', 'Threshold', 'Train Alerts', 'Test Alerts', 'Longest Test Breach']]
+    for result in report.results:
+        table_data.append([format_timestamp(result.fold.train_start), format_timestamp(result.fold.test_start),
+                           format_timestamp(result.fold.test_end), result.threshold, result.train_alerts,
+                           result.test_alerts, result.longest_test_breach])
+
+    click.echo(AsciiTable(table_data).table)
+    click.echo(f"Threshold {report.mean_threshold:g} ± {report.std_threshold:g} across {len(report.results)} folds "
+               f"({report.variation:.0%} variation).")
+    click.echo(f"Out-of-sample alerts per fold: {report.mean_test_alerts:g} on average, {report.max_test_alerts} at most.")
+    if report.stable:
+        click.echo("The threshold is stable across folds.")
+    else:
+        click.echo("The threshold is not stable across folds, consider a longer window or a seasonal threshold.")
+
+
+def run_validation(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1', window_size=5, max_alerts=11,
+                   days=None, client=None, cache_dir=None):
+    """Walk-forward validate the suggested threshold for a CloudWatch metric."""
+
+    if not client:
+        client = cw_client(aws_profile, region)
 
     try:
-        threshold, breaches = calculate_threshold_and_breaches(data, alarm_type, window_size, max_alerts)
+        metrics = list_metrics(client)
     except Exception as e:
-        click.echo(f"Failed to calculate threshold and breaches: {e}")
+        click.echo(f"Failed to list metrics: {e}")
         return 1
 
     try:
-        threshold, window_size = output_rating_and_adjustment(
-            metric, data, alarm_type, threshold, window_size, breaches, start, region, statistic, period
-        )
+        metric = prompt_metric_search(metrics)
     except Exception as e:
-        click.echo(f"Failed to adjust output based on rating: {e}")
+        click.echo(f"Failed to prompt for metric search: {e}")
         return 1
 
     try:
-        ask_to_create_alarm(metric, threshold, alarm_type, client, statistic, period, window_size)
+        data, start, end = load_history(metric, statistic, period, client, days, cache_dir)
     except Exception as e:
-        click.echo(f"Failed to create alarm: {e}")
+        click.echo(f"Failed to retrieve history: {e}")
         return 1
 
+    click.echo(f"Validating on {len(data)} data points from {format_timestamp(start)} to {format_timestamp(end)}.")
+
+    try:
+        report = validate(data, alarm_type, window_size, max_alerts)
+    except Exception as e:
+        click.echo(f"Failed to validate threshold: {e}")
+        return 1
+
+    if report is None:
+        click.echo("Not enough history for a single train and test fold.")
+        return 0
+
+    output_validation_report(report)
     return 0
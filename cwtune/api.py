@@ -0,0 +1,234 @@
+"""Non-interactive tuning API for embedding cwtune in other programs.
+
+Nothing in this module prompts or writes to the terminal, and it keeps no
+mutable state besides a lock protected client cache, so `tune` can be called
+concurrently from many threads.
+"""
+from collections import namedtuple
+from datetime import timedelta
+import math
+import threading
+from .aws import fetch_metric_data, session_client
+from .bitmask import popcount, rising_edges
+from .mofn import breach_mask, alarm_mask, effective_window
+from .sparse import SparseSeries, sparse_series
+from .timeseries import zero_pad, get_breaches, longest_breach
+from .utils import select_range
+
+MAX_ITERATIONS = 100
+MAX_BREACH_DURATION = timedelta(days=2)
+NUM_CURVE_POINTS = 50
+DEFAULT_PERIOD = 5
+
+TuningResult = namedtuple('TuningResult', [
+    'metric', 'statistic', 'period', 'alarm_type', 'threshold', 'window_size',
+    'datapoints_to_alarm', 'breaches', 'alerts_curve', 'start', 'end',
+])
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(aws_profile=None, region='us-east-1'):
+    """Return a shared CloudWatch client for the profile and region."""
+    key = (aws_profile, region)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = session_client(aws_profile, region)
+        return _clients[key]
+
+
+def to_alarm_type(alarm_type):
+    """Accept an AlarmType or its 'gt'/'lt' string value."""
+    if isinstance(alarm_type, str):
+        from .cli import AlarmType
+        return AlarmType.from_string(alarm_type)
+    return alarm_type
+
+
+def fetch_series(metric, statistic, period, client, start=None, end=None):
+    """Fetch and zero pad the series for a metric, returning (data, start, end)."""
+    if start is None or end is None:
+        start, end = select_range()
+
+    data = fetch_metric_data(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period, statistic, client)
+    if len(data) == 0:
+        return [], start, end
+
+    return zero_pad(data, period, start, end), start, end
+
+
+def value_counts(data):
+    """Return (value, count) pairs for a list of datapoints or a SparseSeries."""
+    if isinstance(data, SparseSeries):
+        return data.value_counts()
+    return [(value, 1) for timestamp, value in data]
+
+
+def evaluate(data, threshold, alarm_type, window_size, datapoints_to_alarm):
+    """Return the breaches of a list of datapoints or a SparseSeries."""
+    if isinstance(data, SparseSeries):
+        return data.breaches(threshold, alarm_type, window_size, datapoints_to_alarm)
+    return get_breaches(data, threshold, alarm_type, window_size, datapoints_to_alarm)
+
+
+def find_threshold(data, alarm_type, window_size, max_alerts, datapoints_to_alarm=None, log=None):
+    """Search for a threshold with at most max_alerts breaches, none longer than two days.
+
+    data is either a list of datapoints or a SparseSeries. Returns the
+    threshold and its breaches. Progress messages are passed to log when one
+    is given.
+    """
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+
+    # Initial values
+    counts = value_counts(data)
+    num_values = sum(count for value, count in counts)
+    sum_values = sum(value * count for value, count in counts)
+    std_dev = sum([abs(value - sum_values / num_values) * count
+            for value, count in counts]) / num_values
+
+    if alarm_type.is_gt():
+        threshold = math.ceil(sum_values / num_values + 5 * std_dev)
+    elif alarm_type.is_lt():
+        threshold = max(math.ceil(sum_values / num_values - 5 * std_dev), 1)
+
+    breaches = evaluate(data, threshold, alarm_type, window_size, datapoints_to_alarm)
+
+    # Threshold search when breaches are too many or too long
+    if len(breaches) > max_alerts or longest_breach(breaches) > MAX_BREACH_DURATION:
+        if log:
+            log('Starting binary search for threshold.')
+
+        min_threshold = min(value for value, count in counts)
+        max_threshold = max(value for value, count in counts) * 2
+
+        for i in range(MAX_ITERATIONS):
+            if log:
+                log(f"Iteration {i + 1}. Evaluating threshold of {threshold}.")
+            threshold = math.ceil((min_threshold + max_threshold) / 2)
+            breaches = evaluate(data, threshold, alarm_type, window_size, datapoints_to_alarm)
+
+            if len(breaches) > max_alerts:
+                min_threshold = threshold
+            else:
+                if longest_breach(breaches) < MAX_BREACH_DURATION:
+                    break
+                else:
+                    min_threshold = threshold
+                    max_threshold = max_threshold * 2
+
+    return threshold, breaches
+
+
+def infer_period(data):
+    """Return the period in minutes between the first two datapoints."""
+    if len(data) < 2:
+        return 1
+    return max(int((data[1][0] - data[0][0]).total_seconds() // 60), 1)
+
+
+def curve_thresholds(data, num_points=NUM_CURVE_POINTS):
+    """Pick up to num_points distinct thresholds spread over the quantiles of the data."""
+    values = sorted(set(value for value, count in value_counts(data)))
+    if len(values) <= num_points:
+        return values
+    step = (len(values) - 1) / (num_points - 1)
+    return sorted(set(values[round(i * step)] for i in range(num_points)))
+
+
+def alerts_curve(data, alarm_type, window_size, datapoints_to_alarm=None, period=None, thresholds=None, num_points=NUM_CURVE_POINTS):
+    """Return (threshold, alerts) pairs showing how the alert count changes with the threshold."""
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+    if thresholds is None:
+        thresholds = curve_thresholds(data, num_points)
+
+    if isinstance(data, SparseSeries):
+        return [(threshold, len(data.breaches(threshold, alarm_type, window_size, datapoints_to_alarm))) for threshold in thresholds]
+
+    if period is None:
+        period = infer_period(data)
+
+    length = len(data)
+    evaluation_periods = effective_window(window_size, period)
+
+    curve = []
+    for threshold in thresholds:
+        mask = alarm_mask(breach_mask(data, threshold, alarm_type), length, datapoints_to_alarm, evaluation_periods)
+        curve.append((threshold, popcount(rising_edges(mask))))
+
+    return curve
+
+
+def tune(metric=None, alarm_type='gt', statistic='Sum', period=None, window_size=5, max_alerts=11, datapoints_to_alarm=None,
+         data=None, start=None, end=None, client=None, aws_profile=None, region='us-east-1', budget=None,
+         treat_missing_data=None):
+    """Tune an alarm for a metric and return a TuningResult.
+
+    Either pass the metric identity ({'Namespace', 'MetricName', 'Dimensions'})
+    to fetch its data from CloudWatch, or an already fetched and padded
+    series or SparseSeries as data. The period in minutes defaults to 5 for
+    fetched metrics and to the spacing of the datapoints for data passed in.
+    Returns None when there is no data to tune on. With a
+    cwtune.budget.Budget a fetch that does not fit returns the previously
+    fetched data for the metric instead, as reflected in the result.
+
+    With treat_missing_data, one of CloudWatch's TreatMissingData modes, the
+    fetched series is kept sparse and missing datapoints are evaluated as
+    the alarm would evaluate them instead of as zeros.
+    """
+    alarm_type = to_alarm_type(alarm_type)
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+
+    if data is None:
+        if metric is None:
+            raise ValueError("Either metric or data is required")
+        if client is None:
+            client = get_client(aws_profile, region)
+        if period is None:
+            period = DEFAULT_PERIOD
+        if budget is not None:
+            if start is None or end is None:
+                start, end = select_range()
+            data, start, end, period = budget.fetch(metric, statistic, period, client, start, end)
+        elif treat_missing_data is not None:
+            if start is None or end is None:
+                start, end = select_range()
+            points = fetch_metric_data(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period,
+                                       statistic, client)
+            data = sparse_series(points, period, start, end, treat_missing_data) if points else []
+        else:
+            data, start, end = fetch_series(metric, statistic, period, client, start, end)
+
+    if len(data) == 0:
+        return None
+
+    if isinstance(data, SparseSeries):
+        # Datapoints outside the range leave a series that is all missing
+        if not data.value_counts():
+            return None
+        period, start, end = data.period, data.start, data.timestamp(len(data) - 1)
+    elif period is None:
+        period = infer_period(data)
+
+    threshold, breaches = find_threshold(data, alarm_type, window_size, max_alerts, datapoints_to_alarm)
+    # The curve includes the chosen threshold so it can be read off the curve
+    thresholds = sorted(set(curve_thresholds(data)) | {threshold})
+    curve = alerts_curve(data, alarm_type, window_size, datapoints_to_alarm, period, thresholds)
+
+    return TuningResult(
+        metric=metric,
+        statistic=statistic,
+        period=period,
+        alarm_type=alarm_type,
+        threshold=threshold,
+        window_size=window_size,
+        datapoints_to_alarm=datapoints_to_alarm,
+        breaches=breaches,
+        alerts_curve=curve,
+        start=start if start is not None else data[0][0],
+        end=end if end is not None else data[-1][0],
+    )
@@ -1,14 +1,41 @@
+from collections import Counter
 import boto3
+from botocore.config import Config
 import click
 import math
+import os
+from .throttle import ThrottledClient, rate_limiter, is_throttling
 from .utils import shorten_url
 
-def cw_client(aws_profile="default", region='us-east-1'):
-    """Create a CloudWatch client."""
+STATISTICS = ['Sum', 'Average', 'SampleCount', 'Min', 'Max', 'p50', 'p95', 'p99']
+
+# ThrottledClient paces and retries every call, so botocore must not retry behind its back
+CLIENT_CONFIG = Config(retries={'max_attempts': 0})
+
+def cw_client(aws_profile="default", region='us-east-1', backend=None):
+    """Create a CloudWatch client.
+
+    backend, or the CWTUNE_BACKEND environment variable, selects an offline
+    backend from cwtune.backend instead, eg "replay:recording.jsonl.gz".
+    """
+    backend = backend or os.environ.get('CWTUNE_BACKEND')
+    if backend:
+        from .backend import backend_client
+        return ThrottledClient(backend_client(backend, lambda: boto_client(aws_profile, region), region), rate_limiter(region))
+
+    return ThrottledClient(boto_client(aws_profile, region), rate_limiter(region))
+
+def boto_client(aws_profile="default", region='us-east-1'):
+    """Create a boto3 CloudWatch client on the default session."""
     if aws_profile:
         boto3.setup_default_session(profile_name=aws_profile, region_name=region)
     
-    return boto3.client('cloudwatch', region_name=region)
+    return boto3.client('cloudwatch', region_name=region, config=CLIENT_CONFIG)
+
+def session_client(aws_profile=None, region='us-east-1'):
+    """Create a CloudWatch client without touching the global default session."""
+    session = boto3.session.Session(profile_name=aws_profile, region_name=region)
+    return ThrottledClient(session.client('cloudwatch', region_name=region, config=CLIENT_CONFIG), rate_limiter(region))
 
 def list_metrics(client):
     """List all CloudWatch metrics."""
@@ -34,31 +61,39 @@ def list_metrics(client):
     metrics = sorted(metrics, key=lambda x: (x['Namespace'], x['MetricName']))
     return metrics
 
-def get_metric_data(start, end, metric_name, metric_namespace, dimensions, period, statistic, client):
-    """Get metric data from CloudWatch."""
-    try:
-        response = client.get_metric_data(
-            MetricDataQueries=[
-                {
-                    'Id': 'metric_1',
-                    'MetricStat': {
-                        'Metric': {
-                            'Namespace': metric_namespace,
-                            'MetricName': metric_name,
-                            'Dimensions': dimensions
-                        },
-                        'Period': period * 60,
-                        'Stat': statistic,
+def iter_metrics(client, namespace=None):
+    """Yield CloudWatch metrics page by page, without holding the whole catalogue in memory."""
+    params = {'Namespace': namespace} if namespace else {}
+    while True:
+        response = client.list_metrics(**params)
+        yield from response['Metrics']
+
+        if 'NextToken' in response:
+            params['NextToken'] = response['NextToken']
+        else:
+            break
+
+def fetch_metric_data(start, end, metric_name, metric_namespace, dimensions, period, statistic, client):
+    """Get metric data from CloudWatch, raising any error from the client."""
+    response = client.get_metric_data(
+        MetricDataQueries=[
+            {
+                'Id': 'metric_1',
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': metric_namespace,
+                        'MetricName': metric_name,
+                        'Dimensions': dimensions
                     },
-                    'ReturnData': True
+                    'Period': period * 60,
+                    'Stat': statistic,
                 },
-            ],
-            StartTime=start,
-            EndTime=end
-        )
-    except Exception as e:
-        print(f"Error while getting metric data from CloudWatch: {e}")
-        return []
+                'ReturnData': True
+            },
+        ],
+        StartTime=start,
+        EndTime=end
+    )
 
     # maps the results to time, value pairs
     results = []
@@ -67,20 +102,126 @@ def get_metric_data(start, end, metric_name, metric_namespace, dimensions, perio
 
     return results
 
+def fetch_statistics(start, end, metric_name, metric_namespace, dimensions, period, statistics, client):
+    """Get several statistics of a metric in one get_metric_data request, returning a dict of statistic to data."""
+    queries = [
+        {
+            'Id': f"stat_{i}",
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': metric_namespace,
+                    'MetricName': metric_name,
+                    'Dimensions': dimensions
+                },
+                'Period': period * 60,
+                'Stat': statistic,
+            },
+            'ReturnData': True
+        }
+        for i, statistic in enumerate(statistics)
+    ]
+    results = {statistic: [] for statistic in statistics}
+    next_token = None
+
+    # Larger responses are paginated across all the queries
+    while True:
+        params = {'MetricDataQueries': queries, 'StartTime': start, 'EndTime': end}
+        if next_token:
+            params['NextToken'] = next_token
+        response = client.get_metric_data(**params)
+
+        for result in response['MetricDataResults']:
+            statistic = statistics[int(result['Id'].split('_')[1])]
+            results[statistic].extend(zip(result['Timestamps'], result['Values']))
+
+        if 'NextToken' in response:
+            next_token = response['NextToken']
+        else:
+            break
+
+    # Pages are not guaranteed to be in timestamp order
+    return {statistic: sorted(data) for statistic, data in results.items()}
+
+def get_metric_data(start, end, metric_name, metric_namespace, dimensions, period, statistic, client):
+    """Get metric data from CloudWatch."""
+    try:
+        return fetch_metric_data(start, end, metric_name, metric_namespace, dimensions, period, statistic, client)
+    except Exception as e:
+        # Throttling that outlasted the retries must not look like a metric without data
+        if is_throttling(e):
+            raise
+        print(f"Error while getting metric data from CloudWatch: {e}")
+        return []
+
 def get_suggested_actions(client):
+    """Return the actions used by existing alarms, most used first."""
     alarms = list_alarms(client)
-    actions = set()
+    actions = Counter()
     for alarm in alarms:
         if len(alarm['AlarmActions']) > 0:
             for action in alarm['AlarmActions']:
-                actions.add(action)
-    return list(actions)
+                actions[action] += 1
+    return [action for action, count in actions.most_common()]
+
+def alarm_name_for(name, alarm_type, threshold):
+    """Return the name cwtune gives a new alarm."""
+    return f"{name} {'Greater Than' if alarm_type.is_gt() else 'Less Than'} {threshold}"
+
+
+def select_existing_alarm(metric, alarm_type, client, inventory, statistic='Sum', period=5, threshold=None):
+    """Offer to update an existing alarm on the metric, returning it if accepted.
+
+    Only alarms with the same comparison, statistic and period are offered,
+    so updating one does not change what it alarms on. The alarms are looked
+    up in the inventory, which is only synced with CloudWatch when stale.
+    """
+    inventory.refresh(client)
+    existing = inventory.alarms_for_metric(metric)
+    if not existing:
+        return None
 
-def create_cloudwatch_alarm(name, namespace, dimensions, threshold, alarm_type, client, statistic='Sum', period=5, window_size=3):
-    """Create a CloudWatch alarm for the given metric."""
+    click.echo("This metric already has alarms:")
+    for alarm in existing:
+        click.echo(f"- {alarm['AlarmName']} ({alarm['ComparisonOperator']} {alarm['Threshold']}, {alarm.get('Statistic')} over {alarm.get('Period')}s)")
+
+    matching = [alarm for alarm in existing if alarm['ComparisonOperator'] == alarm_type.to_cw_operator()
+                and alarm.get('Statistic') == statistic and alarm.get('Period') == period * 60]
+    if not matching:
+        return None
+
+    alarm = matching[0]
+    question = f"Update '{alarm['AlarmName']}' instead of creating a new alarm?"
+    if alarm['AlarmName'] == alarm_name_for(metric['MetricName'], alarm_type, alarm['Threshold']) and alarm['Threshold'] != threshold:
+        question = f"Update '{alarm['AlarmName']}' instead of creating a new alarm? Its name will still say {alarm['Threshold']}."
+    if not click.confirm(question, default=True):
+        return None
+
+    # The inventory does not keep the OK and insufficient data actions the update preserves
+    response = client.describe_alarms(AlarmNames=[alarm['AlarmName']])
+    if not response['MetricAlarms']:
+        click.echo(f"'{alarm['AlarmName']}' no longer exists, creating a new alarm.")
+        return None
+    return response['MetricAlarms'][0]
+
+def create_cloudwatch_alarm(name, namespace, dimensions, threshold, alarm_type, client, statistic='Sum', period=5, window_size=3, datapoints_to_alarm=None,
+                            inventory=None):
+    """Create a CloudWatch alarm for the given metric.
+
+    With an AlarmInventory, existing alarms on the metric can be updated and
+    actions are suggested from the inventory instead of a full alarm scan.
+    """
+
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
 
     # Get suggested actions
-    suggested_actions = get_suggested_actions(client)
+    existing = None
+    if inventory is not None:
+        existing = select_existing_alarm({'Namespace': namespace, 'MetricName': name, 'Dimensions': dimensions}, alarm_type, client, inventory,
+                                         statistic, period, threshold)
+        suggested_actions = inventory.suggested_actions()
+    else:
+        suggested_actions = get_suggested_actions(client)
     selected_actions = []
 
     click.echo("Select an action for the alarm:")
@@ -102,35 +243,18 @@ def create_cloudwatch_alarm(name, namespace, dimensions, threshold, alarm_type,
         selected_actions = [suggested_actions[action_choice-1]]
 
     try:
-        type_str = "Greater Than" if alarm_type.is_gt() else "Less Than"
-
-        response = client.put_metric_alarm(
-            AlarmName=f"{name} {type_str} {threshold}",
-            AlarmDescription=f"Created by availabl.ai/cwtune for {name} {type_str} {threshold}",
-            MetricName=name,
-            Namespace=namespace,
-            Dimensions=dimensions,
-            Statistic=statistic,
-            Period=period * 60,
-            DatapointsToAlarm=math.ceil(window_size / 2),
-            EvaluationPeriods=window_size,
-            Threshold=threshold,
-            ActionsEnabled=True,
-            AlarmActions=selected_actions,
-            ComparisonOperator=alarm_type.to_cw_operator(),
-            TreatMissingData='missing',
-            Tags=[
-                {
-                    'Key': 'cwtune',
-                    'Value': 'true'
-                },
-            ]
-        )
+        alarm_name = put_alarm(name, namespace, dimensions, threshold, alarm_type, client, statistic, period,
+                               window_size, datapoints_to_alarm, selected_actions, existing=existing)
+
+        if inventory is not None:
+            inventory.record({'AlarmName': alarm_name, 'Namespace': namespace, 'MetricName': name, 'Dimensions': dimensions,
+                              'Threshold': threshold, 'ComparisonOperator': alarm_type.to_cw_operator(), 'Statistic': statistic,
+                              'Period': period * 60, 'AlarmActions': selected_actions})
 
         click.echo(f"Successfully created/updated alarm")
 
         region = client.meta.region_name
-        link = f"https://{region}.console.aws.amazon.com/cloudwatch/home?region={region}#alarm:alarmFilter=ANY;name={name}%20{type_str}%20{threshold}"
+        link = f"https://{region}.console.aws.amazon.com/cloudwatch/home?region={region}#alarm:alarmFilter=ANY;name={alarm_name.replace(' ', '%20')}"
         click.echo(f"View alarm: {shorten_url(link)}")
 
     except Exception as e:
@@ -140,6 +264,47 @@ def create_cloudwatch_alarm(name, namespace, dimensions, threshold, alarm_type,
     return 0
 
 
+def put_alarm(name, namespace, dimensions, threshold, alarm_type, client, statistic='Sum', period=5, window_size=3,
+              datapoints_to_alarm=None, actions=None, existing=None, treat_missing_data='missing'):
+    """Create or update a CloudWatch alarm without prompting and return its name.
+
+    existing is an alarm from describe_alarms to update in place, keeping
+    its OK and insufficient data actions.
+    """
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+
+    type_str = "Greater Than" if alarm_type.is_gt() else "Less Than"
+    alarm_name = existing['AlarmName'] if existing else alarm_name_for(name, alarm_type, threshold)
+
+    client.put_metric_alarm(
+        AlarmName=alarm_name,
+        AlarmDescription=f"Created by availabl.ai/cwtune for {name} {type_str} {threshold}",
+        MetricName=name,
+        Namespace=namespace,
+        Dimensions=dimensions,
+        Statistic=statistic,
+        Period=period * 60,
+        DatapointsToAlarm=datapoints_to_alarm,
+        EvaluationPeriods=window_size,
+        Threshold=threshold,
+        ActionsEnabled=True,
+        AlarmActions=actions or [],
+        OKActions=existing.get('OKActions', []) if existing else [],
+        InsufficientDataActions=existing.get('InsufficientDataActions', []) if existing else [],
+        ComparisonOperator=alarm_type.to_cw_operator(),
+        TreatMissingData=treat_missing_data,
+        Tags=[
+            {
+                'Key': 'cwtune',
+                'Value': 'true'
+            },
+        ]
+    )
+
+    return alarm_name
+
+
 def list_alarms(client):
     """List all CloudWatch alarms."""
 
@@ -0,0 +1,314 @@
+"""Pluggable CloudWatch backends for offline load and regression testing.
+
+Every backend behaves like the boto3 CloudWatch client for the calls cwtune
+makes, so it can be used anywhere a `cw_client` is expected:
+
+    RecordingClient  wraps a real client and records each response to a gzip file
+    ReplayClient     replays a recording with configurable latency, throttling and page sizes
+    SyntheticClient  synthesizes an account with any number of metrics and alarms
+
+`backend_client` builds one from a spec string such as
+"replay:recording.jsonl.gz?latency=0.05&throttle=0.1&page_size=100", which
+`cw_client` reads from the CWTUNE_BACKEND environment variable.
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+import gzip
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+RECORDED_OPERATIONS = ('list_metrics', 'describe_alarms', 'describe_alarms_for_metric', 'get_metric_data', 'put_metric_alarm')
+PAGE_KEYS = {'list_metrics': 'Metrics', 'describe_alarms': 'MetricAlarms'}
+MAX_PAGE_SIZES = {'list_metrics': 500, 'describe_alarms': 100}
+
+NAMESPACES = ['AWS/EC2', 'AWS/ELB', 'AWS/Lambda', 'AWS/RDS', 'AWS/SQS', 'AWS/DynamoDB', 'AWS/ApiGateway', 'Custom/App']
+METRIC_NAMES = ['CPUUtilization', 'Latency', 'Errors', 'Invocations', 'RequestCount', 'ApproximateNumberOfMessagesVisible',
+                'ThrottledRequests', 'FreeStorageSpace', '5XXError', 'Duration']
+DIMENSION_NAMES = ['InstanceId', 'LoadBalancerName', 'FunctionName', 'DBInstanceIdentifier', 'QueueName', 'TableName', 'ApiName', 'Service']
+NUM_ACTIONS = 20
+
+
+def encode(value):
+    """Convert datetimes in a response to JSON friendly values."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    """Reverse encode."""
+    if isinstance(value, dict):
+        if '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def request_key(operation, params, ignore=()):
+    """Return a canonical key for an operation and its parameters."""
+    params = {key: value for key, value in params.items() if key not in ignore}
+    return operation + ':' + json.dumps(encode(params), sort_keys=True)
+
+
+def throttling_error(operation):
+    return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, operation)
+
+
+class RecordingClient:
+    """Wrap a CloudWatch client and record its responses to a gzip JSON lines file."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name not in RECORDED_OPERATIONS:
+            return attribute
+
+        def call(**params):
+            response = attribute(**params)
+            record = {'operation': name, 'params': params,
+                      'response': {key: value for key, value in response.items() if key != 'ResponseMetadata'}}
+            line = json.dumps(encode(record)) + '\n'
+            with self.lock:
+                with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                    f.write(line)
+            return response
+
+        return call
+
+
+class FakeClient:
+    """Shared behaviour of the offline backends: latency, throttling and paging."""
+
+    def __init__(self, region='us-east-1', latency=0, throttle_rate=0, page_size=None, seed=None):
+        self.meta = SimpleNamespace(region_name=region)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _call(self, operation):
+        """Account for a call, then apply latency and simulated throttling."""
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            throttled = self.random.random() < self.throttle_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise throttling_error(operation)
+
+    def _page(self, operation, items, next_token=None, max_records=None):
+        """Return a page of items with a NextToken when more remain."""
+        page_size = self.page_size or MAX_PAGE_SIZES[operation]
+        if max_records:
+            page_size = min(page_size, max_records)
+        start = int(next_token or 0)
+        total = len(items)
+        response = {PAGE_KEYS[operation]: [items[i] for i in range(start, min(start + page_size, total))]}
+        if start + page_size < total:
+            response['NextToken'] = str(start + page_size)
+        return response
+
+
+class ReplayClient(FakeClient):
+    """Replay responses recorded by RecordingClient."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = {}
+        self.loose_responses = {}
+        self.items = {operation: [] for operation in PAGE_KEYS}
+        self.alarms = []
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = decode(json.loads(line))
+                operation, params, response = record['operation'], record['params'], record['response']
+                self.responses[request_key(operation, params)] = response
+                if operation == 'get_metric_data':
+                    self.loose_responses[request_key(operation, params, ('StartTime', 'EndTime', 'NextToken'))] = response
+
+        # Pages recorded more than once are only counted once
+        for key, response in self.responses.items():
+            operation = key.partition(':')[0]
+            if operation in PAGE_KEYS:
+                self.items[operation] += response[PAGE_KEYS[operation]]
+
+    def _paged(self, operation, params):
+        self._call(operation)
+        if self.page_size:
+            return self._page(operation, self.items[operation], params.get('NextToken'), params.get('MaxRecords'))
+        response = self.responses.get(request_key(operation, params))
+        if response is None:
+            raise KeyError(f"No recorded response for {operation} {params}")
+        return response
+
+    def list_metrics(self, **params):
+        return self._paged('list_metrics', params)
+
+    def describe_alarms(self, **params):
+        return self._paged('describe_alarms', params)
+
+    def describe_alarms_for_metric(self, **params):
+        self._call('describe_alarms_for_metric')
+        return self.responses.get(request_key('describe_alarms_for_metric', params), {'MetricAlarms': []})
+
+    def get_metric_data(self, **params):
+        self._call('get_metric_data')
+        response = self.responses.get(request_key('get_metric_data', params))
+        if response is None:
+            # Recorded ranges were relative to the recording time, so fall back to the queries alone
+            response = self.loose_responses.get(request_key('get_metric_data', params, ('StartTime', 'EndTime', 'NextToken')))
+        if response is None:
+            response = {'MetricDataResults': [
+                {'Id': query['Id'], 'Timestamps': [], 'Values': [], 'StatusCode': 'Complete'} for query in params['MetricDataQueries']
+            ]}
+        return response
+
+    def put_metric_alarm(self, **params):
+        self._call('put_metric_alarm')
+        self.alarms.append(params)
+        return {}
+
+
+class SyntheticClient(FakeClient):
+    """Synthesize a deterministic account with num_metrics metrics and num_alarms alarms.
+
+    Metrics, alarms and datapoints are generated from their index on demand,
+    so even very large accounts take no time or memory to set up.
+    """
+
+    def __init__(self, num_metrics=100000, num_alarms=None, **kwargs):
+        super().__init__(**kwargs)
+        self.num_metrics = num_metrics
+        self.num_alarms = num_metrics // 10 if num_alarms is None else num_alarms
+        self.metrics = _Generated(num_metrics, self.metric)
+        self.alarms = _Generated(self.num_alarms, self.alarm)
+        self.created_alarms = []
+
+    def metric(self, index):
+        namespace = NAMESPACES[index % len(NAMESPACES)]
+        return {
+            'Namespace': namespace,
+            'MetricName': METRIC_NAMES[(index // len(NAMESPACES)) % len(METRIC_NAMES)],
+            'Dimensions': [{'Name': DIMENSION_NAMES[index % len(DIMENSION_NAMES)], 'Value': f"resource-{index}"}],
+        }
+
+    def alarm(self, index):
+        metric = self.metric(index * self.num_metrics // max(self.num_alarms, 1))
+        threshold = 10 * (1 + index % 100)
+        return {
+            'AlarmName': f"{metric['MetricName']} Greater Than {threshold} {index}",
+            'AlarmActions': [f"arn:aws:sns:{self.meta.region_name}:123456789012:alerts-{(index * index) % NUM_ACTIONS}"],
+            'Namespace': metric['Namespace'],
+            'MetricName': metric['MetricName'],
+            'Dimensions': metric['Dimensions'],
+            'Threshold': threshold,
+            'ComparisonOperator': 'GreaterThanThreshold',
+            'EvaluationPeriods': 5,
+            'DatapointsToAlarm': 3,
+            'AlarmConfigurationUpdatedTimestamp': datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index),
+        }
+
+    def list_metrics(self, **params):
+        self._call('list_metrics')
+        return self._page('list_metrics', self.metrics, params.get('NextToken'))
+
+    def describe_alarms(self, **params):
+        self._call('describe_alarms')
+        return self._page('describe_alarms', self.alarms, params.get('NextToken'), params.get('MaxRecords'))
+
+    def describe_alarms_for_metric(self, **params):
+        self._call('describe_alarms_for_metric')
+        return {'MetricAlarms': [alarm for alarm in self.created_alarms
+                                 if alarm['MetricName'] == params['MetricName'] and alarm['Namespace'] == params['Namespace']]}
+
+    def get_metric_data(self, **params):
+        self._call('get_metric_data')
+        return {'MetricDataResults': [self.series(query, params['StartTime'], params['EndTime']) for query in params['MetricDataQueries']]}
+
+    def series(self, query, start, end):
+        """Generate a daily cycle with noise and occasional spikes for a query."""
+        stat = query['MetricStat']
+        seed = int(hashlib.sha1(json.dumps(stat['Metric'], sort_keys=True).encode('utf-8')).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        base = rng.uniform(1, 1000)
+        period = timedelta(seconds=stat['Period'])
+
+        timestamps, values = [], []
+        current = start
+        while current <= end:
+            hour = current.hour + current.minute / 60
+            noise = rng.gauss(0, base * 0.05)
+            spike = base * 5 if rng.random() < 0.001 else 0
+            # Sparse metrics only report some datapoints, like real error counts
+            if seed % 4 != 0 or rng.random() < 0.05:
+                timestamps.append(current)
+                values.append(max(base * (1 + 0.5 * math.sin(2 * math.pi * hour / 24)) + noise + spike, 0))
+            current += period
+
+        return {'Id': query['Id'], 'Label': stat['Metric']['MetricName'], 'Timestamps': timestamps, 'Values': values, 'StatusCode': 'Complete'}
+
+    def put_metric_alarm(self, **params):
+        self._call('put_metric_alarm')
+        self.created_alarms.append(params)
+        return {}
+
+
+class _Generated:
+    """A lazy read only sequence of generated items."""
+
+    def __init__(self, length, generate):
+        self.length = length
+        self.generate = generate
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return self.generate(index)
+
+
+def backend_client(spec, client_factory=None, region='us-east-1'):
+    """Build a backend from a spec like "record:<path>", "replay:<path>?latency=0.1" or "synthetic:100000".
+
+    client_factory creates the real client wrapped by the record backend.
+    """
+    kind, _, rest = spec.partition(':')
+    url = urlsplit(rest)
+    options = {key: values[0] for key, values in parse_qs(url.query).items()}
+    fake_options = {
+        'region': region,
+        'latency': float(options.get('latency', 0)),
+        'throttle_rate': float(options.get('throttle', 0)),
+        'page_size': int(options['page_size']) if 'page_size' in options else None,
+        'seed': int(options['seed']) if 'seed' in options else None,
+    }
+
+    if kind == 'record':
+        return RecordingClient(client_factory(), url.path)
+    if kind == 'replay':
+        return ReplayClient(url.path, **fake_options)
+    if kind == 'synthetic':
+        num_alarms = int(options['alarms']) if 'alarms' in options else None
+        return SyntheticClient(int(url.path or 100000), num_alarms, **fake_options)
+    raise ValueError(f"Unknown CloudWatch backend '{kind}'")
@@ -0,0 +1,223 @@
+"""Tune every metric of an account in a resumable batch.
+
+Results are streamed to a JSON lines or CSV file as each metric finishes,
+and a SQLite checkpoint next to it records the finished metrics together
+with the size of the output at that point. An interrupted run resumes by
+truncating the output back to the last checkpoint and skipping the metrics
+it lists, so no metric is fetched, tuned or written twice. Metrics that
+failed are kept in the checkpoint database and written after the last
+checkpoint at the end of a run, so a resumed run replaces them with the
+result of trying again. Metrics are read
+from list_metrics page by page and only a bounded number are in flight, so
+memory does not grow with the size of the account.
+"""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import csv
+import io
+import json
+import os
+import sqlite3
+from .api import tune
+from .aws import iter_metrics
+from .budget import BudgetExceeded
+from .timeseries import longest_breach
+from .utils import metric_key
+
+FIELDS = ['namespace', 'metric_name', 'dimensions', 'statistic', 'period', 'alarm_type', 'status', 'threshold',
+          'window_size', 'datapoints_to_alarm', 'alerts', 'longest_breach_minutes', 'start', 'end', 'error']
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS finished (
+    metric TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS failed (
+    metric TEXT PRIMARY KEY,
+    record TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def metric_identity(metric):
+    """Return a canonical string identifying a metric."""
+    return json.dumps(metric_key(metric))
+
+
+class JSONLinesSink:
+    """Append records to a JSON lines file."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def encode(self, record):
+        return (json.dumps(record) + '\n').encode('utf-8')
+
+
+class CSVSink:
+    """Append records to a CSV file, writing the header to new files."""
+
+    def __init__(self, f):
+        self.f = f
+        if f.tell() == 0:
+            self.f.write(self.encode(dict(zip(FIELDS, FIELDS))))
+
+    def encode(self, record):
+        line = io.StringIO()
+        csv.DictWriter(line, FIELDS).writerow(record)
+        return line.getvalue().encode('utf-8')
+
+
+class ResultWriter:
+    """Stream batch results to a file, checkpointing the finished metrics and output size together."""
+
+    def __init__(self, path, checkpoint_path=None, parameters=None):
+        self.path = path
+        self.checkpoint_path = checkpoint_path or f"{path}.checkpoint"
+        self.connection = sqlite3.connect(self.checkpoint_path)
+        self.connection.executescript(CHECKPOINT_SCHEMA)
+
+        parameters = json.dumps(parameters or {}, sort_keys=True)
+        saved = self._meta('parameters')
+        if saved is not None and saved != parameters:
+            self.connection.close()
+            raise ValueError(f"Checkpoint {self.checkpoint_path} is for a run with different parameters: {saved}")
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('parameters', ?)", (parameters,))
+            # Metrics that failed in an earlier run are tried again
+            self.connection.execute("DELETE FROM failed")
+
+        self.f = open(path, 'ab')
+        offset = self._meta('offset')
+        if offset is not None:
+            # Drop anything written after the last checkpoint, it belongs to metrics that will be tuned again
+            self.f.truncate(int(offset))
+        self.f.seek(0, os.SEEK_END)
+
+        self.sink = CSVSink(self.f) if path.endswith('.csv') else JSONLinesSink(self.f)
+        self._checkpoint()
+
+    def _meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _checkpoint(self, metric=None):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        with self.connection:
+            if metric is not None:
+                self.connection.execute("INSERT OR IGNORE INTO finished (metric) VALUES (?)", (metric,))
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('offset', ?)", (str(self.f.tell()),))
+
+    def is_finished(self, metric):
+        return self.connection.execute("SELECT 1 FROM finished WHERE metric = ?", (metric,)).fetchone() is not None
+
+    def write(self, record, metric):
+        """Write a record and checkpoint the metric as finished."""
+        self.f.write(self.sink.encode(record))
+        self._checkpoint(metric)
+
+    def fail(self, record, metric):
+        """Keep the record of a failed metric until the writer is closed."""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO failed (metric, record) VALUES (?, ?)", (metric, json.dumps(record)))
+
+    def close(self):
+        """Write the failed metrics after the checkpoint, where a resumed run drops them, and close."""
+        for (record,) in self.connection.execute("SELECT record FROM failed ORDER BY rowid"):
+            self.f.write(self.sink.encode(json.loads(record)))
+        self.f.close()
+        self.connection.close()
+
+
+def tune_metric(metric, client, alarm_type, statistic, period, window_size, max_alerts, budget=None):
+    """Tune a single metric and return its result record, raising BudgetExceeded when the budget runs out."""
+    record = {
+        'namespace': metric['Namespace'],
+        'metric_name': metric['MetricName'],
+        'dimensions': json.dumps(metric['Dimensions']),
+        'statistic': statistic,
+        'period': period,
+        'alarm_type': alarm_type.value,
+    }
+
+    try:
+        result = tune(metric, alarm_type, statistic, period, window_size, max_alerts, client=client, budget=budget)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        return dict(record, status='error', error=str(e))
+
+    if result is None:
+        return dict(record, status='no_data')
+
+    return dict(
+        record,
+        status='ok',
+        period=result.period,
+        threshold=result.threshold,
+        window_size=result.window_size,
+        datapoints_to_alarm=result.datapoints_to_alarm,
+        alerts=len(result.breaches),
+        longest_breach_minutes=longest_breach(result.breaches).total_seconds() / 60,
+        start=result.start.isoformat(),
+        end=result.end.isoformat(),
+    )
+
+
+def run_batch(client, path, alarm_type, statistic='Sum', period=5, window_size=5, max_alerts=11, namespace=None,
+              checkpoint_path=None, workers=8, progress=None, budget=None):
+    """Tune every metric, or those of a namespace, streaming the results to path.
+
+    Metrics that failed are written with status 'error' at the end of the run
+    but not checkpointed, so a resumed run tries them again. progress is called with the number of
+    metrics processed by this run after each one. With a cwtune.budget.Budget
+    the run stops with BudgetExceeded once it is spent, and can be resumed.
+    Returns (finished, failed) for this run.
+    """
+    parameters = {'alarm_type': alarm_type.value, 'statistic': statistic, 'period': period, 'window_size': window_size,
+                  'max_alerts': max_alerts, 'namespace': namespace}
+    if budget is not None:
+        client = budget.wrap(client)
+    writer = ResultWriter(path, checkpoint_path, parameters)
+    finished = failed = 0
+
+    def collect(done):
+        nonlocal finished, failed
+        for future in done:
+            identity, record = pending.pop(future), future.result()
+            if record['status'] == 'error':
+                writer.fail(record, identity)
+                failed += 1
+            else:
+                writer.write(record, identity)
+                finished += 1
+            if progress:
+                progress(finished + failed)
+
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for metric in iter_metrics(client, namespace):
+                identity = metric_identity(metric)
+                if writer.is_finished(identity):
+                    continue
+
+                # Bound the metrics in flight so memory stays flat however large the account is
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                pending[executor.submit(tune_metric, metric, client, alarm_type, statistic, period, window_size,
+                                        max_alerts, budget)] = identity
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        writer.close()
+
+    return finished, failed
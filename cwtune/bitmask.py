@@ -0,0 +1,45 @@
+"""Helpers for working with per-datapoint flags packed into integers.
+
+Bit ``i`` of a mask corresponds to datapoint ``i`` of a series, which lets
+whole series be combined with a single ``&``, ``|`` or ``~`` operation.
+"""
+import re
+
+RUN_PATTERN = re.compile('1+')
+BITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def pack(flags):
+    """Pack an iterable of booleans into an integer mask."""
+    bits = bytes(map(bool, flags)).translate(BITS)
+    if not bits:
+        return 0
+    return int(bits[::-1], 2)
+
+
+def full(length):
+    """Return a mask with the first length bits set."""
+    return (1 << length) - 1
+
+
+def unpack(mask, length):
+    """Return the first length bits of the mask as a list of booleans."""
+    bits = bin(mask)[2:].zfill(length)[::-1]
+    return [bit == '1' for bit in bits[:length]]
+
+
+def popcount(mask):
+    """Return the number of set bits in the mask."""
+    return bin(mask).count('1')
+
+
+def rising_edges(mask):
+    """Return a mask of the bits that start a run of set bits."""
+    return mask & ~(mask << 1)
+
+
+def runs(mask):
+    """Yield (start, end) index pairs for each run of set bits, end exclusive."""
+    bits = bin(mask)[2:][::-1]
+    for match in RUN_PATTERN.finditer(bits):
+        yield match.start(), match.end()
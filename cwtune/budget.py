@@ -0,0 +1,220 @@
+"""Estimate, track and cap the CloudWatch API cost of a run.
+
+GetMetricData is billed per metric requested in each call and cwtune
+fetches a series with a single call, so a fetch costs the same whatever its
+period or range. Other API requests such as ListMetrics and DescribeAlarms
+are billed per request. Prices default to us-east-1.
+"""
+from collections import namedtuple
+import math
+import threading
+from .api import fetch_series
+from .aws import fetch_statistics
+from .timeseries import zero_pad
+from .utils import LRUCache, metric_key
+
+GET_METRIC_DATA_PRICE = 0.01 / 1000
+REQUEST_PRICE = 0.01 / 1000
+LIST_METRICS_PAGE_SIZE = 500
+DESCRIBE_ALARMS_PAGE_SIZE = 100
+MAX_CACHED_SERIES = 256
+
+Estimate = namedtuple('Estimate', ['datapoints', 'requests', 'metrics_requested', 'cost'])
+
+
+class BudgetExceeded(Exception):
+    """Raised when a call cannot be made within the budget."""
+
+
+def estimate_fetch(period, start, end, num_metrics=1, statistics=1):
+    """Estimate fetching num_metrics metrics with cwtune's one request per metric fetch."""
+    points = int((end - start).total_seconds() // (period * 60)) + 1
+    return Estimate(
+        datapoints=points * statistics * num_metrics,
+        requests=num_metrics,
+        metrics_requested=statistics * num_metrics,
+        cost=statistics * num_metrics * GET_METRIC_DATA_PRICE,
+    )
+
+
+def estimate_run(period, start, end, num_metrics=1, statistics=1, catalogue_size=0, num_alarms=0, alarms_created=0):
+    """Estimate a tuning, batch or audit run.
+
+    catalogue_size is the number of metrics listed to search, num_alarms the
+    number of existing alarms scanned and alarms_created the number of
+    put_metric_alarm calls.
+    """
+    fetch = estimate_fetch(period, start, end, num_metrics, statistics)
+    other_requests = (math.ceil(catalogue_size / LIST_METRICS_PAGE_SIZE) + math.ceil(num_alarms / DESCRIBE_ALARMS_PAGE_SIZE)
+                      + alarms_created)
+    return Estimate(
+        datapoints=fetch.datapoints,
+        requests=fetch.requests + other_requests,
+        metrics_requested=fetch.metrics_requested,
+        cost=fetch.cost + other_requests * REQUEST_PRICE,
+    )
+
+
+def format_estimate(estimate):
+    return f"{estimate.datapoints} datapoints in {estimate.requests} requests (~${estimate.cost:.4f})"
+
+
+class Usage:
+    """Thread safe counters of the API usage of a run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.metrics_requested = 0
+        self.datapoints = 0
+
+    def record(self, operation, metrics_requested=0, datapoints=0, requests=1):
+        with self.lock:
+            self._record(operation, metrics_requested, datapoints, requests)
+
+    def _record(self, operation, metrics_requested=0, datapoints=0, requests=1):
+        self.requests[operation] = self.requests.get(operation, 0) + requests
+        if not self.requests[operation]:
+            del self.requests[operation]
+        self.metrics_requested += metrics_requested
+        self.datapoints += datapoints
+
+    def _cost(self):
+        other_requests = sum(count for operation, count in self.requests.items() if operation != 'get_metric_data')
+        return self.metrics_requested * GET_METRIC_DATA_PRICE + other_requests * REQUEST_PRICE
+
+    @property
+    def cost(self):
+        with self.lock:
+            return self._cost()
+
+    def _total_requests(self):
+        return sum(self.requests.values())
+
+    @property
+    def total_requests(self):
+        with self.lock:
+            return self._total_requests()
+
+    def to_dict(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'metrics_requested': self.metrics_requested,
+                    'datapoints': self.datapoints, 'cost': self._cost()}
+
+
+class MeteredClient:
+    """Wrap a CloudWatch client to record its usage and refuse calls over budget."""
+
+    def __init__(self, client, budget):
+        self.client = client
+        self.budget = budget
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_') or name in ('get_paginator', 'get_waiter', 'can_paginate'):
+            return attribute
+
+        def call(**params):
+            queries = len(params.get('MetricDataQueries', []))
+            self.budget.reserve(name, queries)
+            try:
+                response = attribute(**params)
+            except Exception:
+                self.budget.usage.record(name, -queries, requests=-1)
+                raise
+
+            if name == 'get_metric_data':
+                datapoints = sum(len(result.get('Values', [])) for result in response['MetricDataResults'])
+                self.budget.usage.record(name, datapoints=datapoints, requests=0)
+            return response
+
+        return call
+
+
+class Budget:
+    """A cap on the cost and requests of a run.
+
+    Fetches through `fetch` are checked against what remains of the budget
+    and fall back to a previously fetched series for the metric when they do
+    not fit. A fetch is a single request whatever its period or range, so
+    there is nothing cheaper to degrade to.
+    """
+
+    def __init__(self, max_cost=None, max_requests=None):
+        self.max_cost = max_cost
+        self.max_requests = max_requests
+        self.usage = Usage()
+        self.series = LRUCache(MAX_CACHED_SERIES)
+        self.series_lock = threading.Lock()
+
+    @property
+    def remaining_cost(self):
+        return None if self.max_cost is None else self.max_cost - self.usage.cost
+
+    @property
+    def remaining_requests(self):
+        return None if self.max_requests is None else self.max_requests - self.usage.total_requests
+
+    def _fits(self, cost, requests, used_cost, used_requests):
+        return ((self.max_cost is None or used_cost + cost <= self.max_cost + 1e-12) and
+                (self.max_requests is None or used_requests + requests <= self.max_requests))
+
+    def fits(self, cost, requests):
+        with self.usage.lock:
+            return self._fits(cost, requests, self.usage._cost(), self.usage._total_requests())
+
+    def reserve(self, operation, metrics_requested=0):
+        """Record a request before it is made, raising BudgetExceeded when it does not fit.
+
+        Checking and recording under the same lock keeps concurrent callers
+        from all passing the check before any of them is recorded.
+        """
+        cost = metrics_requested * GET_METRIC_DATA_PRICE if operation == 'get_metric_data' else REQUEST_PRICE
+        with self.usage.lock:
+            used_cost, used_requests = self.usage._cost(), self.usage._total_requests()
+            if not self._fits(cost, 1, used_cost, used_requests):
+                raise BudgetExceeded(f"Budget exceeded: used {used_cost:.4f} of {self.max_cost} dollars "
+                                     f"and {used_requests} of {self.max_requests} requests")
+            self.usage._record(operation, metrics_requested)
+
+    def wrap(self, client):
+        """Return the client metered against this budget."""
+        return client if isinstance(client, MeteredClient) else MeteredClient(client, self)
+
+    def _planned(self, key, metric, period, start, end, statistics, fetch):
+        """Fetch with fetch(period, start, end) when it fits the budget, or return the cached result for key."""
+        estimate = estimate_fetch(period, start, end, statistics=statistics)
+
+        if self.fits(estimate.cost, estimate.requests):
+            try:
+                data, start, end = fetch(period, start, end)
+            except BudgetExceeded:
+                # Another worker spent what was left between the check and the request
+                pass
+            else:
+                with self.series_lock:
+                    self.series.put(key, (data, start, end, period))
+                return data, start, end, period
+
+        with self.series_lock:
+            cached = self.series.get(key)
+        if cached:
+            return cached
+        raise BudgetExceeded(f"Budget exceeded: no cached data for {metric['MetricName']}")
+
+    def fetch(self, metric, statistic, period, client, start, end):
+        """Fetch a series within the budget and return (data, start, end, period)."""
+        return self._planned((metric_key(metric), statistic), metric, period, start, end, 1,
+                             lambda period, start, end: fetch_series(metric, statistic, period, self.wrap(client), start, end))
+
+    def fetch_statistics(self, metric, statistics, period, client, start, end):
+        """Fetch and pad several statistics within the budget and return ({statistic: data}, start, end, period).
+
+        Statistics without data are left out.
+        """
+        def fetch(period, start, end):
+            series = fetch_statistics(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period,
+                                      statistics, self.wrap(client))
+            return {statistic: zero_pad(data, period, start, end) for statistic, data in series.items() if data}, start, end
+
+        return self._planned((metric_key(metric), tuple(statistics)), metric, period, start, end, len(statistics), fetch)
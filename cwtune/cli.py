@@ -1,9 +1,16 @@
 """Console script for CloudTune."""
+import os
 import sys
 import click
 import boto3
 from enum import Enum
-from .analyze import run
+from .analyze import run, run_validation, COMPARE_STATISTICS
+from .aws import cw_client, STATISTICS
+from .budget import Budget, BudgetExceeded, LIST_METRICS_PAGE_SIZE, estimate_run, format_estimate
+from .incidents import load_incidents
+from .inventory import AlarmInventory
+from .throttle import rate_limiter
+from .utils import cwtune_home, select_range
 
 class AlarmType(Enum):
     """An enum for the alarm type."""
@@ -57,14 +64,129 @@ class CLIProfile(click.Choice):
 
 
 
-@click.command()
+class DefaultGroup(click.Group):
+    """A click.Group that runs its default command when no subcommand is given."""
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if self.default_command and (not args or (args[0] not in self.commands and args[0] != '--help')):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default_command='tune')
+def main():
+    """CLI for AWS CloudWatch Alarm Tuning/Creation."""
+
+
+@main.command()
 @click.option('--alarm-type', prompt='Alarm Type', type=AlarmTypeChoice(), help='The type of alarm, greater than (gt) or less than (lt).')
 @click.option('--period', prompt='Period (Mins)', default="5", type=click.Choice(["1", "5", "60"]), help='The period of the CloudWatch metric in minutes.')
-@click.option('--statistic', prompt='Statistic', default='Sum', type=click.Choice(['Sum', 'Average', 'SampleCount', 'Min', 'Max', 'p50', 'p95', 'p99']), help='The statistic of the CloudWatch metric.')
+@click.option('--statistic', prompt='Statistic', default='Sum', type=click.Choice(STATISTICS + [COMPARE_STATISTICS]), help=f'The statistic of the CloudWatch metric, or {COMPARE_STATISTICS} to pick the quietest.')
 @click.option('--region', prompt='Region', type=AWSRegion(), default="us-east-1", help='The region of the CloudWatch metric.')
 @click.option('--aws-profile', prompt='AWS CLI Profile', type=CLIProfile(), default="default", help='(Optional) The profile configured in AWS CLI to use for making API calls.')
-def main(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1'):
-    run(AlarmType.from_string(alarm_type), aws_profile, int(period), statistic=statistic, region=region)
+@click.option('--budget', default=None, type=float, help='(Optional) The maximum CloudWatch API cost of the run in dollars.')
+@click.option('--inventory/--no-inventory', default=True, help='Use the local alarm inventory to suggest actions and find existing alarms.')
+@click.option('--plot/--no-plot', 'show_plot', default=True, help='Plot the series, threshold and breaches in the terminal.')
+@click.option('--incidents', 'incidents_path', default=None, type=click.Path(exists=True, dir_okay=False), help='(Optional) A CSV, JSON or JSON lines file of incidents with service, start and end, to pick the configuration that best detects them.')
+@click.option('--service', default=None, help='(Optional) Only score against the incidents of this service.')
+def tune(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1', budget=None, inventory=True, show_plot=True,
+         incidents_path=None, service=None):
+    """Interactively select a threshold and create an alarm (default)."""
+    try:
+        incidents = load_incidents(incidents_path, service) if incidents_path else None
+    except (OSError, ValueError, KeyError) as e:
+        raise click.BadParameter(f"Could not read incidents: {e}", param_hint='--incidents')
+
+    run_budget = Budget(max_cost=budget)
+    alarm_inventory = AlarmInventory(os.path.join(cwtune_home(), f"inventory-{aws_profile or 'default'}-{region}.db")) if inventory else None
+    run(AlarmType.from_string(alarm_type), aws_profile, int(period), statistic=statistic, region=region, budget=run_budget,
+        inventory=alarm_inventory, show_plot=show_plot, incidents=incidents)
+
+    usage = run_budget.usage.to_dict()
+    click.echo(f"API usage: {sum(usage['requests'].values())} requests, {usage['datapoints']} datapoints (~${usage['cost']:.4f}).")
+    throttling = rate_limiter(region).totals()
+    if throttling['retries'] or throttling['failures']:
+        click.echo(f"Throttled {throttling['throttles']} times, retried {throttling['retries']} requests and waited {throttling['waited']:.1f}s.")
+
+    return 0
+
+
+@main.command()
+@click.option('--alarm-type', prompt='Alarm Type', type=AlarmTypeChoice(), help='The type of alarm, greater than (gt) or less than (lt).')
+@click.option('--period', prompt='Period (Mins)', default="5", type=click.Choice(["1", "5", "60"]), help='The period of the CloudWatch metric in minutes.')
+@click.option('--statistic', prompt='Statistic', default='Sum', type=click.Choice(STATISTICS), help='The statistic of the CloudWatch metric.')
+@click.option('--region', prompt='Region', type=AWSRegion(), default="us-east-1", help='The region of the CloudWatch metric.')
+@click.option('--aws-profile', prompt='AWS CLI Profile', type=CLIProfile(), default="default", help='(Optional) The profile configured in AWS CLI to use for making API calls.')
+@click.option('--days', default=None, type=int, help='(Optional) Days of history to validate on. Defaults to all the history CloudWatch keeps at the period.')
+def validate(alarm_type, aws_profile=None, period=5, statistic='Sum', region='us-east-1', days=None):
+    """Walk-forward validate the suggested threshold on a longer history."""
+    run_validation(AlarmType.from_string(alarm_type), aws_profile, int(period), statistic=statistic, region=region, days=days,
+                   cache_dir=os.path.join(cwtune_home(), 'history'))
+
+    return 0
+
+
+@main.command()
+@click.option('--alarm-type', required=True, type=AlarmTypeChoice(), help='The type of alarm, greater than (gt) or less than (lt).')
+@click.option('--output', required=True, type=click.Path(dir_okay=False), help='The .jsonl or .csv file to stream results to.')
+@click.option('--checkpoint', default=None, type=click.Path(dir_okay=False), help='(Optional) The checkpoint file to resume from. Defaults to the output path with a .checkpoint suffix.')
+@click.option('--namespace', default=None, help='(Optional) Only tune the metrics of this namespace.')
+@click.option('--period', default="5", type=click.Choice(["1", "5", "60"]), help='The period of the CloudWatch metrics in minutes.')
+@click.option('--statistic', default='Sum', type=click.Choice(STATISTICS), help='The statistic of the CloudWatch metrics.')
+@click.option('--workers', default=8, type=int, help='The number of metrics to tune concurrently.')
+@click.option('--region', type=AWSRegion(), default="us-east-1", help='The region of the CloudWatch metrics.')
+@click.option('--aws-profile', type=CLIProfile(), default=None, help='(Optional) The profile configured in AWS CLI to use for making API calls.')
+@click.option('--budget', default=None, type=float, help='(Optional) The maximum CloudWatch API cost of the run in dollars.')
+def batch(alarm_type, output, checkpoint=None, namespace=None, period=5, statistic='Sum', workers=8, region='us-east-1', aws_profile=None,
+          budget=None):
+    """Tune every metric, streaming results to a file and resuming interrupted runs."""
+    from .batch import run_batch
+
+    start, end = select_range()
+    click.echo(f"Estimated usage per metric: {format_estimate(estimate_run(int(period), start, end))}, "
+               f"plus a ListMetrics request per {LIST_METRICS_PAGE_SIZE} metrics.")
+    run_budget = Budget(max_cost=budget)
+
+    def progress(count):
+        if count % 100 == 0:
+            click.echo(f"Tuned {count} metrics.")
+
+    try:
+        finished, failed = run_batch(cw_client(aws_profile, region), output, AlarmType.from_string(alarm_type), statistic,
+                                     int(period), namespace=namespace, checkpoint_path=checkpoint, workers=workers,
+                                     progress=progress, budget=run_budget)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    except BudgetExceeded as e:
+        click.echo(f"{e}. Run the same command again to resume.")
+        return 1
+
+    click.echo(f"Tuned {finished} metrics, {failed} failed. Results are in {output}.")
+    usage = run_budget.usage.to_dict()
+    click.echo(f"API usage: {sum(usage['requests'].values())} requests, {usage['datapoints']} datapoints (~${usage['cost']:.4f}).")
+    throttling = rate_limiter(region).totals()
+    if throttling['retries'] or throttling['failures']:
+        click.echo(f"Throttled {throttling['throttles']} times, retried {throttling['retries']} requests and waited {throttling['waited']:.1f}s.")
+
+    return 0
+
+
+@main.command()
+@click.option('--host', default='127.0.0.1', help='The interface to listen on.')
+@click.option('--port', default=8080, type=int, help='The port to listen on.')
+@click.option('--workers', default=None, type=int, help='The number of backtest worker processes. Defaults to the number of CPUs.')
+@click.option('--region', type=AWSRegion(), default="us-east-1", help='The region of the CloudWatch metrics.')
+@click.option('--aws-profile', type=CLIProfile(), default=None, help='(Optional) The profile configured in AWS CLI to use for making API calls.')
+def serve(host, port, workers, region, aws_profile=None):
+    """Run a local HTTP tuning service with warm caches."""
+    from .server import serve as run_server
+
+    click.echo(f"Serving on http://{host}:{port}")
+    run_server(cw_client(aws_profile, region), host, port, workers)
 
     return 0
 
@@ -0,0 +1,200 @@
+"""Backtest composite alarms built from several tuned child alarms.
+
+Child alarm states are evaluated with the bit-parallel M out of N engine in
+cwtune.mofn when a child's datapoints are evenly spaced, and children that
+share their timestamps are combined without building a common grid.
+"""
+from collections import namedtuple
+from datetime import timedelta
+import math
+import re
+from .bitmask import pack, full, runs, unpack
+from .mofn import alarm_mask, breach_mask, effective_window
+from .timeseries import alarm_states
+
+ChildAlarm = namedtuple('ChildAlarm', ['name', 'data', 'threshold', 'alarm_type', 'window_size', 'datapoints_to_alarm'])
+ChildAlarm.__new__.__defaults__ = (None,)
+
+TOKEN_PATTERN = re.compile(r'\s*(\(|\)|,|"[^"]*"|[A-Za-z_][\w./:-]*)')
+STATE_FUNCTIONS = ('ALARM', 'OK')
+
+
+def regular_period(timestamps):
+    """Return the spacing in whole minutes of evenly spaced timestamps, or None if they are not."""
+    if len(timestamps) < 2:
+        return None
+    step = timestamps[1] - timestamps[0]
+    if step <= timedelta(0) or step % timedelta(minutes=1):
+        return None
+    if any(b - a != step for a, b in zip(timestamps, timestamps[1:])):
+        return None
+    return step // timedelta(minutes=1)
+
+
+def child_mask(child, period):
+    """Return the mask of the datapoints where a child alarm is in breach.
+
+    period is the spacing of the child's datapoints in minutes, or None if
+    they are not evenly spaced.
+    """
+    datapoints_to_alarm = child.datapoints_to_alarm or math.ceil(child.window_size / 2)
+    if period is None:
+        return pack(alarm_states(child.data, child.threshold, child.alarm_type, child.window_size, datapoints_to_alarm))
+
+    mask = breach_mask(child.data, child.threshold, child.alarm_type)
+    return alarm_mask(mask, len(child.data), datapoints_to_alarm, effective_window(child.window_size, period))
+
+
+def align(children):
+    """Align the alarm state of each child on a common grid of timestamps.
+
+    Returns the grid and a mask per child name. A child keeps the state of
+    its latest datapoint until its next datapoint, like a CloudWatch alarm.
+    """
+    timestamps = [[timestamp for timestamp, _ in child.data] for child in children]
+
+    # Children that share their timestamps need no common grid or forward filling
+    if all(child_timestamps == timestamps[0] for child_timestamps in timestamps):
+        grid = timestamps[0] if timestamps else []
+        period = regular_period(grid)
+        return grid, {child.name: child_mask(child, period) for child in children}
+
+    grid = sorted({timestamp for child_timestamps in timestamps for timestamp in child_timestamps})
+    masks = {}
+
+    for child, child_timestamps in zip(children, timestamps):
+        mask = child_mask(child, regular_period(child_timestamps))
+        states = unpack(mask, len(child.data))
+
+        if len(child.data) == len(grid):
+            masks[child.name] = mask
+            continue
+
+        aligned = []
+        position = -1
+        for timestamp in grid:
+            while position + 1 < len(child.data) and child.data[position + 1][0] <= timestamp:
+                position += 1
+            aligned.append(position >= 0 and states[position])
+        masks[child.name] = pack(aligned)
+
+    return grid, masks
+
+
+def tokenize(rule):
+    """Split a composite alarm rule into tokens."""
+    tokens = []
+    position = 0
+    rule = rule.strip()
+    while position < len(rule):
+        match = TOKEN_PATTERN.match(rule, position)
+        if not match:
+            raise ValueError(f"Invalid alarm rule near '{rule[position:]}'")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+def parse_rule(rule):
+    """Parse a CloudWatch style alarm rule, eg 'ALARM("latency") AND NOT OK(errors)'.
+
+    Returns a nested tuple of ('and'|'or', left, right), ('not', operand),
+    ('alarm', name) or ('const', value).
+    """
+    tokens = tokenize(rule)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take(expected=None):
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError("Unexpected end of alarm rule")
+        token = tokens[position]
+        if expected and token.upper() != expected:
+            raise ValueError(f"Expected '{expected}' but found '{token}' in alarm rule")
+        position += 1
+        return token
+
+    def expression():
+        node = term()
+        while peek() == 'OR':
+            take()
+            node = ('or', node, term())
+        return node
+
+    def term():
+        node = factor()
+        while peek() == 'AND':
+            take()
+            node = ('and', node, factor())
+        return node
+
+    def factor():
+        token = peek()
+        if token == 'NOT':
+            take()
+            return ('not', factor())
+        if token == '(':
+            take()
+            node = expression()
+            take(')')
+            return node
+        if token in ('TRUE', 'FALSE'):
+            take()
+            return ('const', token == 'TRUE')
+        if token in STATE_FUNCTIONS:
+            take()
+            take('(')
+            name = take().strip('"')
+            take(')')
+            node = ('alarm', name)
+            return node if token == 'ALARM' else ('not', node)
+        raise ValueError(f"Unexpected token '{take()}' in alarm rule")
+
+    node = expression()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected token '{tokens[position]}' in alarm rule")
+    return node
+
+
+def evaluate_rule(node, masks, length):
+    """Evaluate a parsed rule over the child masks and return the composite mask."""
+    kind = node[0]
+    if kind == 'alarm':
+        if node[1] not in masks:
+            raise ValueError(f"Unknown child alarm '{node[1]}'")
+        return masks[node[1]]
+    if kind == 'const':
+        return full(length) if node[1] else 0
+    if kind == 'not':
+        return ~evaluate_rule(node[1], masks, length) & full(length)
+    if kind == 'and':
+        return evaluate_rule(node[1], masks, length) & evaluate_rule(node[2], masks, length)
+    if kind == 'or':
+        return evaluate_rule(node[1], masks, length) | evaluate_rule(node[2], masks, length)
+    raise ValueError(f"Invalid rule node {kind}")
+
+
+def backtest_composite(children, rule):
+    """Return the alerts the composite alarm would have fired over the children's data."""
+    if isinstance(rule, str):
+        rule = parse_rule(rule)
+
+    grid, masks = align(children)
+    if not grid:
+        return []
+
+    mask = evaluate_rule(rule, masks, len(grid))
+
+    breaches = []
+    for start, end in runs(mask):
+        breaches.append({
+            'start': grid[start],
+            'end': grid[min(end, len(grid) - 1)],
+            'status': 'closed',
+            'children': [name for name, child_mask in masks.items() if child_mask >> start & 1],
+        })
+
+    return breaches
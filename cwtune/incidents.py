@@ -0,0 +1,168 @@
+"""Score alarm configurations against known incidents.
+
+Given the intervals of past incidents, every candidate threshold and
+window is backtested and scored by precision (the share of its alerts that
+fired during an incident), recall (the share of incidents it alerted on)
+and time to detect (how long after an incident started it first alerted).
+An alert counts from when it fires, so an alarm stuck in breach does not
+score for every incident it happens to span. The incidents are kept in an
+interval tree, so an overlap query takes logarithmic time per incident it
+returns however long the incidents are, and candidates are backtested with
+the bit-parallel M out of N engine in cwtune.mofn.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+import csv
+from datetime import datetime, timedelta, timezone
+import json
+import math
+from .api import curve_thresholds, infer_period
+from .bitmask import runs
+from .mofn import alarm_mask, breach_mask, effective_window
+
+WINDOW_SIZES = [1, 3, 5, 10, 15, 30, 60]
+NUM_THRESHOLDS = 30
+
+Incident = namedtuple('Incident', ['service', 'start', 'end'])
+Score = namedtuple('Score', [
+    'threshold', 'window_size', 'datapoints_to_alarm', 'alerts', 'true_alerts', 'incidents', 'detected',
+    'precision', 'recall', 'f1', 'mean_time_to_detect', 'breaches',
+])
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp, assuming UTC when it has no timezone."""
+    timestamp = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def load_incidents(path, service=None):
+    """Load incidents from a CSV, JSON or JSON lines file with service, start and end fields.
+
+    Only the incidents of service are returned when one is given.
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        elif path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+
+    incidents = []
+    for row in rows:
+        if service is not None and row.get('service') != service:
+            continue
+        incidents.append(Incident(row.get('service'), parse_timestamp(row['start']), parse_timestamp(row['end'])))
+    return incidents
+
+
+class IntervalIndex:
+    """An interval tree: intervals sorted by start under a segment tree of their largest ends."""
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda interval: interval.start)
+        self.starts = [interval.start for interval in self.intervals]
+        self.max_ends = [None] * (4 * len(self.intervals))
+        if self.intervals:
+            self._build(1, 0, len(self.intervals) - 1)
+
+    def _build(self, node, low, high):
+        """Store the largest end of the intervals from low to high at node."""
+        if low == high:
+            self.max_ends[node] = self.intervals[low].end
+            return
+        middle = (low + high) // 2
+        self._build(2 * node, low, middle)
+        self._build(2 * node + 1, middle + 1, high)
+        self.max_ends[node] = max(self.max_ends[2 * node], self.max_ends[2 * node + 1])
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def overlapping(self, start, end):
+        """Return the positions of the intervals overlapping start to end, latest first."""
+        positions = []
+        last = bisect_right(self.starts, end) - 1
+        if last < 0:
+            return positions
+
+        # Only subtrees of intervals starting by end that reach start are visited
+        stack = [(1, 0, len(self.intervals) - 1)]
+        while stack:
+            node, low, high = stack.pop()
+            if low > last or self.max_ends[node] < start:
+                continue
+            if low == high:
+                positions.append(low)
+                continue
+            middle = (low + high) // 2
+            stack.append((2 * node, low, middle))
+            stack.append((2 * node + 1, middle + 1, high))
+        return positions
+
+
+def score(breaches, index, positions, threshold=None, window_size=None, datapoints_to_alarm=None):
+    """Score breaches against the incidents at positions in the index, those they could have detected."""
+    detected = {}
+    true_alerts = 0
+    for breach in breaches:
+        overlaps = index.overlapping(breach['start'], breach['start'])
+        if overlaps:
+            true_alerts += 1
+        for position in overlaps:
+            delay = breach['start'] - index.intervals[position].start
+            if position not in detected or delay < detected[position]:
+                detected[position] = delay
+
+    detected = {position: delay for position, delay in detected.items() if position in positions}
+    precision = true_alerts / len(breaches) if breaches else 0
+    recall = len(detected) / len(positions) if positions else 0
+    return Score(
+        threshold=threshold,
+        window_size=window_size,
+        datapoints_to_alarm=datapoints_to_alarm,
+        alerts=len(breaches),
+        true_alerts=true_alerts,
+        incidents=len(positions),
+        detected=len(detected),
+        precision=precision,
+        recall=recall,
+        f1=2 * precision * recall / (precision + recall) if precision + recall else 0,
+        mean_time_to_detect=sum(detected.values(), timedelta(0)) / len(detected) if detected else None,
+        breaches=breaches,
+    )
+
+
+def score_candidates(data, alarm_type, incidents, window_sizes=WINDOW_SIZES, num_thresholds=NUM_THRESHOLDS):
+    """Backtest and score every threshold and window candidate against the incidents during the data."""
+    index = IntervalIndex(incidents)
+    in_range = set(index.overlapping(data[0][0], data[-1][0]))
+    timestamps = [timestamp for timestamp, value in data]
+    period = infer_period(data)
+
+    scores = []
+    masks = {threshold: breach_mask(data, threshold, alarm_type) for threshold in curve_thresholds(data, num_thresholds)}
+    for window_size in window_sizes:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+        evaluation_periods = effective_window(window_size, period)
+        for threshold, mask in masks.items():
+            states = alarm_mask(mask, len(data), datapoints_to_alarm, evaluation_periods)
+            breaches = [{'start': timestamps[start], 'end': timestamps[min(end, len(data) - 1)], 'status': 'closed'}
+                        for start, end in runs(states)]
+            scores.append(score(breaches, index, in_range, threshold, window_size, datapoints_to_alarm))
+    return scores
+
+
+def rank(score):
+    """Return a sort key ordering scores by F1, then the fastest detection, then the fewest alerts."""
+    # A detection at the start of the incident takes timedelta(0), which is falsy but the fastest there is
+    mean_time_to_detect = timedelta.max if score.mean_time_to_detect is None else score.mean_time_to_detect
+    return (score.f1, -mean_time_to_detect.total_seconds(), -score.alerts)
+
+
+def best_score(scores):
+    """Return the best score by `rank`."""
+    return max(scores, key=rank)
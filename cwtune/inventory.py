@@ -0,0 +1,190 @@
+"""A locally persisted, indexed inventory of CloudWatch alarms.
+
+The inventory is a SQLite database indexed by metric identity (namespace,
+name and dimensions) and by action ARN, so suggesting actions and finding
+the existing alarms of a metric are lookups instead of full describe_alarms
+scans. A refresh still pages through every alarm with describe_alarms, but
+only rewrites the alarms whose configuration changed, and is skipped
+entirely while the inventory is fresh.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+REFRESH_TTL = 60 * 60
+# Columns added after the first release, with their types
+ADDED_COLUMNS = {'statistic': 'TEXT', 'period': 'INTEGER'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alarms (
+    name TEXT PRIMARY KEY,
+    namespace TEXT,
+    metric_name TEXT,
+    dimensions TEXT,
+    threshold REAL,
+    comparison TEXT,
+    statistic TEXT,
+    period INTEGER,
+    updated TEXT,
+    seen INTEGER
+);
+CREATE INDEX IF NOT EXISTS alarms_metric ON alarms (namespace, metric_name, dimensions);
+CREATE TABLE IF NOT EXISTS actions (
+    alarm_name TEXT,
+    arn TEXT
+);
+CREATE INDEX IF NOT EXISTS actions_alarm ON actions (alarm_name);
+CREATE INDEX IF NOT EXISTS actions_arn ON actions (arn);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def dimensions_key(dimensions):
+    """Return a canonical string for a list of dimensions."""
+    return json.dumps(sorted([d['Name'], d['Value']] for d in dimensions or []))
+
+
+class AlarmInventory:
+    """Alarms of an account persisted in a SQLite database at path."""
+
+    def __init__(self, path, ttl=REFRESH_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add columns missing from an older inventory and force its alarms to be rewritten on the next refresh."""
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(alarms)")}
+        missing = [name for name in ADDED_COLUMNS if name not in columns]
+        if missing:
+            with self.connection:
+                for name in missing:
+                    self.connection.execute(f"ALTER TABLE alarms ADD COLUMN {name} {ADDED_COLUMNS[name]}")
+                self.connection.execute("UPDATE alarms SET updated = NULL")
+                self._set_meta('last_refresh', 0)
+
+    def close(self):
+        self.connection.close()
+
+    def count(self):
+        """Return the number of alarms in the inventory."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM alarms").fetchone()[0]
+
+    def _meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def last_refresh(self):
+        return float(self._meta('last_refresh', 0))
+
+    def is_stale(self):
+        return time.time() - self.last_refresh > self.ttl
+
+    def _upsert(self, alarm, seen):
+        """Write an alarm unless it is unchanged, and mark it as seen."""
+        name = alarm['AlarmName']
+        updated = alarm.get('AlarmConfigurationUpdatedTimestamp')
+        updated = updated.isoformat() if hasattr(updated, 'isoformat') else updated
+
+        row = self.connection.execute("SELECT updated FROM alarms WHERE name = ?", (name,)).fetchone()
+        if row and updated is not None and row[0] == updated:
+            self.connection.execute("UPDATE alarms SET seen = ? WHERE name = ?", (seen, name))
+            return False
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO alarms (name, namespace, metric_name, dimensions, threshold, comparison, statistic, period, updated, seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, alarm.get('Namespace'), alarm.get('MetricName'), dimensions_key(alarm.get('Dimensions')),
+             alarm.get('Threshold'), alarm.get('ComparisonOperator'), alarm.get('Statistic'), alarm.get('Period'), updated, seen))
+        self.connection.execute("DELETE FROM actions WHERE alarm_name = ?", (name,))
+        self.connection.executemany("INSERT INTO actions (alarm_name, arn) VALUES (?, ?)",
+                                    [(name, arn) for arn in alarm.get('AlarmActions', [])])
+        return True
+
+    def refresh(self, client, force=False):
+        """Sync the inventory with a full describe_alarms scan when it is stale, returning the number of changed alarms."""
+        with self.lock:
+            if not force and not self.is_stale():
+                return 0
+
+            seen = int(self._meta('refresh_id', 0)) + 1
+            changed = 0
+            next_token = None
+
+            with self.connection:
+                while True:
+                    if next_token:
+                        response = client.describe_alarms(NextToken=next_token)
+                    else:
+                        response = client.describe_alarms()
+
+                    for alarm in response['MetricAlarms']:
+                        changed += self._upsert(alarm, seen)
+
+                    if 'NextToken' in response:
+                        next_token = response['NextToken']
+                    else:
+                        break
+
+                # Alarms that were not seen have been deleted
+                deleted = [row[0] for row in self.connection.execute("SELECT name FROM alarms WHERE seen != ?", (seen,))]
+                self.connection.executemany("DELETE FROM actions WHERE alarm_name = ?", [(name,) for name in deleted])
+                self.connection.execute("DELETE FROM alarms WHERE seen != ?", (seen,))
+
+                self._set_meta('refresh_id', seen)
+                self._set_meta('last_refresh', time.time())
+
+            return changed + len(deleted)
+
+    def refresh_metric(self, client, metric):
+        """Sync only the alarms of a single metric with describe_alarms_for_metric, returning them."""
+        response = client.describe_alarms_for_metric(
+            MetricName=metric['MetricName'], Namespace=metric['Namespace'], Dimensions=metric['Dimensions'])
+
+        with self.lock, self.connection:
+            seen = int(self._meta('refresh_id', 0))
+            names = [alarm['AlarmName'] for alarm in response['MetricAlarms']]
+            for alarm in response['MetricAlarms']:
+                self._upsert(alarm, seen)
+
+            stale = [row[0] for row in self.connection.execute(
+                "SELECT name FROM alarms WHERE namespace = ? AND metric_name = ? AND dimensions = ?",
+                (metric['Namespace'], metric['MetricName'], dimensions_key(metric['Dimensions']))) if row[0] not in names]
+            self.connection.executemany("DELETE FROM actions WHERE alarm_name = ?", [(name,) for name in stale])
+            self.connection.executemany("DELETE FROM alarms WHERE name = ?", [(name,) for name in stale])
+
+        return response['MetricAlarms']
+
+    def record(self, alarm):
+        """Add or update an alarm, eg one cwtune has just created."""
+        with self.lock, self.connection:
+            self._upsert(dict(alarm, AlarmConfigurationUpdatedTimestamp=None), int(self._meta('refresh_id', 0)))
+
+    def alarms_for_metric(self, metric):
+        """Return the alarms on a metric."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT name, threshold, comparison, statistic, period FROM alarms "
+                "WHERE namespace = ? AND metric_name = ? AND dimensions = ? ORDER BY name",
+                (metric['Namespace'], metric['MetricName'], dimensions_key(metric['Dimensions']))).fetchall()
+        return [{'AlarmName': name, 'Threshold': threshold, 'ComparisonOperator': comparison, 'Statistic': statistic, 'Period': period}
+                for name, threshold, comparison, statistic, period in rows]
+
+    def suggested_actions(self, limit=None):
+        """Return the action ARNs in use, most used first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT arn FROM actions GROUP BY arn ORDER BY COUNT(*) DESC, arn LIMIT ?", (limit or -1,)).fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,102 @@
+"""Evaluate every M out of N alarm configuration of a series in one pass.
+
+The per-datapoint breach flags are packed into a single integer and the
+sliding window counts for every position are kept as bit-sliced counters,
+one integer per bit of the count. Growing the window by one datapoint is a
+shifted ripple-carry add, and testing "at least M of the last N" is a
+bit-sliced comparison, so each (M, N) pair costs a handful of operations on
+machine words rather than a walk over the series.
+
+Windows are measured in datapoints, like CloudWatch evaluation periods,
+which matches `get_breaches` for 1 minute periods.
+"""
+from .bitmask import pack, full, popcount, rising_edges
+
+MAX_EVALUATION_PERIODS = 60
+
+
+def effective_window(window_size, period):
+    """Return the number of datapoints `get_breaches` counts in a window_size minute window."""
+    return max((window_size - 1) // period + 1, 1)
+
+
+def breach_mask(data, threshold, alarm_type):
+    """Return a mask of the datapoints that breach the threshold."""
+    if alarm_type.is_gt():
+        return pack([value > threshold for timestamp, value in data])
+    return pack([value < threshold for timestamp, value in data])
+
+
+def _add(planes, addend):
+    """Add a one bit per position addend to the bit-sliced counters in place."""
+    carry = addend
+    for i, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[i], carry = plane ^ carry, plane & carry
+    if carry:
+        planes.append(carry)
+
+
+def _at_least(planes, count, length):
+    """Return a mask of the positions where the bit-sliced counter is >= count."""
+    greater = 0
+    equal = full(length)
+    for i in reversed(range(max(len(planes), count.bit_length()))):
+        plane = planes[i] if i < len(planes) else 0
+        if count >> i & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+    return greater | equal
+
+
+def window_counters(mask, length, evaluation_periods):
+    """Yield (N, counters) for N from 1 to evaluation_periods.
+
+    The counters hold, for each position, the number of set bits in the mask
+    over the N positions ending there.
+    """
+    planes = []
+    for n in range(1, evaluation_periods + 1):
+        _add(planes, (mask << (n - 1)) & full(length))
+        yield n, planes
+
+
+def alarm_mask(mask, length, datapoints_to_alarm, evaluation_periods):
+    """Return a mask of the positions where the M out of N alarm is in breach."""
+    planes = []
+    for n in range(1, evaluation_periods + 1):
+        _add(planes, (mask << (n - 1)) & full(length))
+    return _at_least(planes, datapoints_to_alarm, length)
+
+
+def alert_count_table(data, threshold, alarm_type, max_evaluation_periods=MAX_EVALUATION_PERIODS):
+    """Return the number of alerts for every (datapoints_to_alarm, evaluation_periods) pair.
+
+    The result maps (M, N) to the number of alerts an alarm firing on M
+    breaching datapoints out of N would have triggered, for 1 <= M <= N <=
+    max_evaluation_periods.
+    """
+    length = len(data)
+    mask = breach_mask(data, threshold, alarm_type)
+
+    table = {}
+    for n, planes in window_counters(mask, length, max_evaluation_periods):
+        for m in range(1, n + 1):
+            table[(m, n)] = popcount(rising_edges(_at_least(planes, m, length)))
+
+    return table
+
+
+def select_configuration(table, max_alerts):
+    """Return the fastest (datapoints_to_alarm, evaluation_periods) with at most max_alerts alerts.
+
+    Configurations needing fewer breaching datapoints trigger sooner, so the
+    smallest M wins, then the smallest N. Returns None when nothing qualifies.
+    """
+    candidates = [config for config, alerts in table.items() if alerts <= max_alerts]
+    if not candidates:
+        return None
+    return min(candidates)
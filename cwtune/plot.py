@@ -0,0 +1,122 @@
+"""Plot a series, its threshold and breaches in the terminal.
+
+The series is downsampled to the terminal width with largest-triangle-
+three-buckets (LTTB), which keeps the spikes that matter when judging a
+threshold, and drawn as a bar chart with eighth-block characters.
+"""
+from bisect import bisect_left, bisect_right
+import shutil
+import click
+from .utils import format_timestamp
+
+BLOCKS = ' ▁▂▃▄▅▆▇█'
+THRESHOLD_CHAR = '─'
+DEFAULT_HEIGHT = 12
+MIN_WIDTH = 10
+
+
+def lttb(values, num_buckets):
+    """Return the indices of the values selected by largest-triangle-three-buckets."""
+    length = len(values)
+    if num_buckets >= length or num_buckets < 3:
+        return list(range(length))
+
+    every = (length - 2) / (num_buckets - 2)
+    selected = [0]
+    a = 0
+
+    for i in range(num_buckets - 2):
+        # Average of the next bucket is the third point of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, length)
+        next_values = values[next_start:next_end]
+        avg_x = (next_start + next_end - 1) / 2
+        avg_y = sum(next_values) / len(next_values)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        a_y = values[a]
+
+        best_area = -1
+        best = start
+        for j in range(start, end):
+            area = abs((a - avg_x) * (values[j] - a_y) - (a - j) * (avg_y - a_y))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        selected.append(best)
+        a = best
+
+    selected.append(length - 1)
+    return selected
+
+
+def breach_columns(timestamps, indices, breaches):
+    """Return for each column whether its span of the series overlaps a breach."""
+    spans = [(bisect_left(timestamps, breach['start']), bisect_right(timestamps, breach['end']) - 1) for breach in breaches]
+    columns = []
+    for i, index in enumerate(indices):
+        end = indices[i + 1] - 1 if i + 1 < len(indices) else index
+        columns.append(any(start <= end and stop >= index for start, stop in spans))
+    return columns
+
+
+def render(data, threshold, breaches, width=None, height=DEFAULT_HEIGHT, color=True):
+    """Return the lines of a chart of the data with the threshold and breaches marked."""
+    if not data:
+        return []
+
+    low = min(min(value for timestamp, value in data), threshold, 0)
+    high = max(max(value for timestamp, value in data), threshold)
+    label_width = max(len(f"{high:g}"), len(f"{low:g}"), len(f"{threshold:g}")) + 1
+
+    if width is None:
+        width = shutil.get_terminal_size().columns
+    width = max(width - label_width - 1, MIN_WIDTH)
+
+    timestamps = [timestamp for timestamp, value in data]
+    values = [value for timestamp, value in data]
+    indices = lttb(values, width)
+    in_breach = breach_columns(timestamps, indices, breaches)
+
+    scale = (high - low) or 1
+    levels = [(values[index] - low) / scale * height * 8 for index in indices]
+    threshold_row = min(int((threshold - low) / scale * height), height - 1)
+
+    lines = []
+    for row in reversed(range(height)):
+        if row == height - 1:
+            label = f"{high:g}"
+        elif row == threshold_row:
+            label = f"{threshold:g}"
+        elif row == 0:
+            label = f"{low:g}"
+        else:
+            label = ''
+
+        cells = []
+        for level, breached in zip(levels, in_breach):
+            eighths = min(max(int(round(level - row * 8)), 0), 8)
+            if eighths == 0 and row == threshold_row:
+                cell = click.style(THRESHOLD_CHAR, fg='yellow') if color else THRESHOLD_CHAR
+            elif breached and color and eighths:
+                cell = click.style(BLOCKS[eighths], fg='red')
+            else:
+                cell = BLOCKS[eighths]
+            cells.append(cell)
+
+        lines.append(f"{label:>{label_width}}│" + ''.join(cells))
+
+    axis_start = format_timestamp(timestamps[0])
+    axis_end = format_timestamp(timestamps[-1])
+    padding = max(len(indices) - len(axis_start) - len(axis_end), 1)
+    lines.append(' ' * label_width + '└' + '─' * len(indices))
+    lines.append(' ' * (label_width + 1) + axis_start + ' ' * padding + axis_end)
+    return lines
+
+
+def plot(data, threshold, breaches, width=None, height=DEFAULT_HEIGHT):
+    """Echo a chart of the data with the threshold and breaches marked."""
+    for line in render(data, threshold, breaches, width, height):
+        click.echo(line)
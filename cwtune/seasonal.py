@@ -0,0 +1,183 @@
+"""Seasonal, time-of-week thresholds.
+
+Traffic with daily and weekly cycles needs a threshold that follows the
+cycle. A profile holds the median and the spread of the series for each of
+the 168 hours of the week, and a band threshold is the median plus a number
+of spreads. Dividing every datapoint's distance from its hour's median by
+the hour's spread turns the band into a single static threshold on these
+scores, so bands are searched and backtested with the same M out of N
+bitmask evaluation as static thresholds.
+"""
+from collections import namedtuple
+from datetime import timedelta
+import math
+import statistics
+import threading
+from .api import infer_period, MAX_BREACH_DURATION
+from .bitmask import pack, popcount, rising_edges, runs
+from .mofn import alarm_mask, effective_window
+from .utils import LRUCache, metric_key
+
+HOURS_PER_WEEK = 7 * 24
+DEFAULT_QUANTILE = 0.99
+MIN_SAMPLES = 4
+MAX_PROFILES = 4096
+
+Profile = namedtuple('Profile', ['median', 'lower', 'upper'])
+Comparison = namedtuple('Comparison', [
+    'static_threshold', 'static_alerts', 'static_headroom',
+    'scale', 'band', 'seasonal_alerts', 'seasonal_headroom',
+])
+
+_profiles = LRUCache(MAX_PROFILES)
+_profiles_lock = threading.Lock()
+
+
+def hour_of_week(timestamp):
+    """Return the hour of the week of a timestamp, 0 being Monday 00:00."""
+    return timestamp.weekday() * 24 + timestamp.hour
+
+
+def quantile(values, q):
+    """Return the nearest rank q quantile of sorted values."""
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def build_profile(data, q=DEFAULT_QUANTILE):
+    """Return the median and the 1 - q and q quantiles of the data for each hour of the week.
+
+    Hours with fewer than MIN_SAMPLES datapoints use the quantiles of the
+    whole series.
+    """
+    buckets = [[] for _ in range(HOURS_PER_WEEK)]
+    for timestamp, value in data:
+        buckets[hour_of_week(timestamp)].append(value)
+
+    values = sorted(value for timestamp, value in data)
+    overall = (quantile(values, 0.5), quantile(values, 1 - q), quantile(values, q))
+
+    median, lower, upper = [], [], []
+    for bucket in buckets:
+        if len(bucket) < MIN_SAMPLES:
+            stats = overall
+        else:
+            bucket.sort()
+            stats = (quantile(bucket, 0.5), quantile(bucket, 1 - q), quantile(bucket, q))
+        median.append(stats[0])
+        lower.append(stats[1])
+        upper.append(stats[2])
+
+    return Profile(median, lower, upper)
+
+
+def cached_profile(metric, statistic, period, data, q=DEFAULT_QUANTILE):
+    """Return the profile of a metric's series, building it only when the series has changed."""
+    key = (metric_key(metric), statistic, period, data[0][0], data[-1][0], q)
+    with _profiles_lock:
+        profile = _profiles.get(key)
+    if profile is None:
+        profile = build_profile(data, q)
+        with _profiles_lock:
+            _profiles.put(key, profile)
+    return profile
+
+
+def spreads(profile, alarm_type):
+    """Return the distance from the median to the quantile on the alarm's side for each hour.
+
+    Flat hours fall back to the median spread of the other hours, or 1.
+    """
+    bound = profile.upper if alarm_type.is_gt() else profile.lower
+    spread = [abs(b - m) for b, m in zip(bound, profile.median)]
+    positive = [s for s in spread if s > 0]
+    floor = statistics.median(positive) if positive else 1
+    return [s if s > 0 else floor for s in spread]
+
+
+def scores(data, profile, alarm_type):
+    """Return how many spreads each datapoint is above (gt) or below (lt) its hour's median."""
+    spread = spreads(profile, alarm_type)
+    sign = 1 if alarm_type.is_gt() else -1
+    result = []
+    for timestamp, value in data:
+        hour = hour_of_week(timestamp)
+        result.append(sign * (value - profile.median[hour]) / spread[hour])
+    return result
+
+
+def band(profile, scale, alarm_type):
+    """Return the threshold for each hour of the week at scale spreads from the median."""
+    sign = 1 if alarm_type.is_gt() else -1
+    return [m + sign * scale * s for m, s in zip(profile.median, spreads(profile, alarm_type))]
+
+
+def backtest(values, threshold, datapoints_to_alarm, evaluation_periods):
+    """Return (alerts, longest) for an alarm on values exceeding the threshold, longest in datapoints."""
+    mask = pack(value > threshold for value in values)
+    alarms = alarm_mask(mask, len(values), datapoints_to_alarm, evaluation_periods)
+    longest = max((end - start for start, end in runs(alarms)), default=0)
+    return popcount(rising_edges(alarms)), longest
+
+
+def search_threshold(values, max_alerts, datapoints_to_alarm, evaluation_periods, max_length=None):
+    """Return the lowest (threshold, alerts) with at most max_alerts alerts on values, none longer than max_length.
+
+    Candidates are the distinct values, searched by bisection.
+    """
+    candidates = sorted(set(values))
+    low, high = 0, len(candidates) - 1
+    best = (candidates[high], 0)
+    while low <= high:
+        middle = (low + high) // 2
+        alerts, longest = backtest(values, candidates[middle], datapoints_to_alarm, evaluation_periods)
+        if alerts <= max_alerts and (max_length is None or longest <= max_length):
+            best = (candidates[middle], alerts)
+            high = middle - 1
+        else:
+            low = middle + 1
+    return best
+
+
+def headroom(values, thresholds):
+    """Return the median distance between the values and their thresholds."""
+    return statistics.median(abs(threshold - value) for value, threshold in zip(values, thresholds))
+
+
+def compare(data, alarm_type, window_size=5, max_alerts=11, datapoints_to_alarm=None, period=None, profile=None,
+            q=DEFAULT_QUANTILE):
+    """Compare the most sensitive static threshold and seasonal band with at most max_alerts alerts.
+
+    Like `find_threshold`, no alarm may last longer than two days. Headroom
+    is the median distance between a datapoint and its threshold, lower
+    meaning a more sensitive alarm. Pass a cached profile to skip building it.
+    """
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+    if period is None:
+        period = infer_period(data)
+    if profile is None:
+        profile = build_profile(data, q)
+
+    evaluation_periods = effective_window(window_size, period)
+    max_length = MAX_BREACH_DURATION // timedelta(minutes=period)
+    sign = 1 if alarm_type.is_gt() else -1
+    values = [value for timestamp, value in data]
+
+    # Static thresholds are searched on the sign adjusted values so both alarm types search for a lowest threshold
+    static, static_alerts = search_threshold([sign * value for value in values], max_alerts, datapoints_to_alarm,
+                                             evaluation_periods, max_length)
+    static_threshold = sign * static
+
+    scale, seasonal_alerts = search_threshold(scores(data, profile, alarm_type), max_alerts, datapoints_to_alarm,
+                                              evaluation_periods, max_length)
+    hourly = band(profile, scale, alarm_type)
+
+    return Comparison(
+        static_threshold=static_threshold,
+        static_alerts=static_alerts,
+        static_headroom=headroom(values, [static_threshold] * len(values)),
+        scale=scale,
+        band=hourly,
+        seasonal_alerts=seasonal_alerts,
+        seasonal_headroom=headroom(values, [hourly[hour_of_week(timestamp)] for timestamp, value in data]),
+    )
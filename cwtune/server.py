@@ -0,0 +1,325 @@
+"""A long running local HTTP service for tuning with warm caches.
+
+The metric catalogue, fetched series and backtest results are kept in memory
+between requests. Requests are served with asyncio, blocking CloudWatch
+calls run on a thread pool and backtests run on a process pool.
+
+Endpoints, all returning JSON:
+
+    GET  /health
+    GET  /metrics?q=<search>&limit=<n>
+    POST /backtest  {metric, alarm_type, statistic, period, window_size, max_alerts, threshold?, datapoints_to_alarm?}
+    POST /curve     {metric, alarm_type, statistic, period, window_size, datapoints_to_alarm?, num_points?}
+    POST /seasonal  {metric, alarm_type, statistic, period, window_size, max_alerts, datapoints_to_alarm?}
+    POST /alarms    {metric, alarm_type, statistic, period, window_size, threshold, datapoints_to_alarm?, actions?}
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+import math
+import time
+from urllib.parse import urlsplit, parse_qs
+from .analyze import rank_metrics
+from .api import fetch_series, find_threshold, alerts_curve, to_alarm_type, NUM_CURVE_POINTS
+from .aws import list_metrics, put_alarm
+from .seasonal import compare, cached_profile
+from .throttle import ThrottledClient
+from .timeseries import get_breaches
+from .utils import LRUCache, metric_key
+
+CATALOGUE_TTL = 15 * 60
+MAX_SERIES = 256
+MAX_BACKTESTS = 4096
+MAX_BODY_SIZE = 1024 * 1024
+NUM_SEARCH_RESULTS = 5
+
+
+class HTTPError(Exception):
+    """An error returned to the client with a status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_number(value, name, convert=int):
+    """Convert a request parameter, raising a 400 HTTPError when it is not a number."""
+    try:
+        if isinstance(value, bool):
+            raise ValueError(value)
+        return convert(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Invalid request: '{name}' must be a number")
+
+
+def as_number(value):
+    """Return an int or float as is and parse anything else as a float."""
+    return value if isinstance(value, (int, float)) else float(value)
+
+
+def run_backtest(data, alarm_type, window_size, max_alerts, threshold=None, datapoints_to_alarm=None):
+    """Backtest a threshold, or search for one when none is given."""
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+    if threshold is None:
+        threshold, breaches = find_threshold(data, alarm_type, window_size, max_alerts, datapoints_to_alarm)
+    else:
+        breaches = get_breaches(data, threshold, alarm_type, window_size, datapoints_to_alarm)
+
+    return {
+        'threshold': threshold,
+        'window_size': window_size,
+        'datapoints_to_alarm': datapoints_to_alarm,
+        'alerts': len(breaches),
+        'breaches': [{'start': breach['start'], 'end': breach['end']} for breach in breaches],
+    }
+
+
+def run_curve(data, alarm_type, window_size, datapoints_to_alarm, period, num_points):
+    """Return the alerts curve as a list of dicts."""
+    curve = alerts_curve(data, alarm_type, window_size, datapoints_to_alarm, period, num_points=num_points)
+    return [{'threshold': threshold, 'alerts': alerts} for threshold, alerts in curve]
+
+
+def run_seasonal(data, alarm_type, window_size, max_alerts, datapoints_to_alarm, period, profile=None):
+    """Compare the best static threshold with a seasonal band."""
+    return compare(data, alarm_type, window_size, max_alerts, datapoints_to_alarm, period, profile)._asdict()
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class TuningService:
+    """The cached state and request handlers behind `cwtune serve`."""
+
+    def __init__(self, client, executor=None, catalogue_ttl=CATALOGUE_TTL):
+        self.client = client
+        self.executor = executor
+        self.catalogue_ttl = catalogue_ttl
+        self.metrics = None
+        self.metrics_loaded_at = 0
+        self.series = LRUCache(MAX_SERIES)
+        self.backtests = LRUCache(MAX_BACKTESTS)
+        self.pending = {}
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/metrics'): self.search,
+            ('POST', '/backtest'): self.backtest,
+            ('POST', '/curve'): self.curve,
+            ('POST', '/seasonal'): self.seasonal,
+            ('POST', '/alarms'): self.create_alarm,
+        }
+
+    async def _once(self, key, function, *args):
+        """Run a blocking call on the thread pool, sharing it between concurrent callers."""
+        if key not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[key] = asyncio.ensure_future(loop.run_in_executor(None, function, *args))
+            self.pending[key].add_done_callback(lambda future: self.pending.pop(key, None))
+        return await asyncio.shield(self.pending[key])
+
+    async def _compute(self, function, *args):
+        """Run a CPU heavy call on the process pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def catalogue(self):
+        if self.metrics is None or time.monotonic() - self.metrics_loaded_at > self.catalogue_ttl:
+            self.metrics = await self._once('metrics', list_metrics, self.client)
+            self.metrics_loaded_at = time.monotonic()
+        return self.metrics
+
+    async def fetch(self, metric, statistic, period):
+        """Return the cached (data, start, end) for a metric, fetching it when stale."""
+        key = (metric_key(metric), statistic, period)
+        cached = self.series.get(key)
+        if cached and time.monotonic() - cached[0] < period * 60:
+            return cached[1]
+
+        series = await self._once(key, fetch_series, metric, statistic, period, self.client)
+        self.series.put(key, (time.monotonic(), series))
+        return series
+
+    async def health(self, query, body):
+        health = {'status': 'ok', 'metrics': len(self.metrics or []), 'series': len(self.series), 'backtests': len(self.backtests)}
+        if isinstance(self.client, ThrottledClient):
+            health['throttling'] = self.client.limiter.stats()
+        return health
+
+    async def search(self, query, body):
+        search = query.get('q', [''])[0]
+        limit = parse_number(query.get('limit', [NUM_SEARCH_RESULTS])[0], 'limit')
+        metrics = await self.catalogue()
+        if not search:
+            return {'metrics': metrics[:limit]}
+        ranked = await self._compute(rank_metrics, metrics, search)
+        return {'metrics': ranked[:limit]}
+
+    def _parameters(self, body):
+        try:
+            metric = body['metric']
+            metric_key(metric)
+            alarm_type = to_alarm_type(body.get('alarm_type', 'gt'))
+            return metric, alarm_type, body.get('statistic', 'Sum'), int(body.get('period', 5)), int(body.get('window_size', 5))
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPError(400, f"Invalid request: {e}")
+
+    def _optional(self, body, name, convert=int):
+        """Return an optional numeric parameter of the body, or None when it is not given."""
+        value = body.get(name)
+        return None if value is None else parse_number(value, name, convert)
+
+    async def backtest(self, query, body):
+        metric, alarm_type, statistic, period, window_size = self._parameters(body)
+        max_alerts = parse_number(body.get('max_alerts', 11), 'max_alerts')
+        threshold = self._optional(body, 'threshold', as_number)
+        datapoints_to_alarm = self._optional(body, 'datapoints_to_alarm')
+
+        data, start, end = await self.fetch(metric, statistic, period)
+        if len(data) == 0:
+            raise HTTPError(404, "No data found.")
+
+        key = (metric_key(metric), statistic, period, start, alarm_type, window_size, max_alerts, threshold, datapoints_to_alarm)
+        result = self.backtests.get(key)
+        if result is None:
+            result = await self._compute(run_backtest, data, alarm_type, window_size, max_alerts, threshold, datapoints_to_alarm)
+            self.backtests.put(key, result)
+
+        return dict(result, start=start, end=end)
+
+    async def curve(self, query, body):
+        metric, alarm_type, statistic, period, window_size = self._parameters(body)
+        datapoints_to_alarm = self._optional(body, 'datapoints_to_alarm')
+        num_points = parse_number(body.get('num_points', NUM_CURVE_POINTS), 'num_points')
+
+        data, start, end = await self.fetch(metric, statistic, period)
+        if len(data) == 0:
+            raise HTTPError(404, "No data found.")
+
+        key = ('curve', metric_key(metric), statistic, period, start, alarm_type, window_size, datapoints_to_alarm, num_points)
+        result = self.backtests.get(key)
+        if result is None:
+            result = await self._compute(run_curve, data, alarm_type, window_size, datapoints_to_alarm, period, num_points)
+            self.backtests.put(key, result)
+
+        return {'curve': result, 'start': start, 'end': end}
+
+    async def seasonal(self, query, body):
+        metric, alarm_type, statistic, period, window_size = self._parameters(body)
+        max_alerts = parse_number(body.get('max_alerts', 11), 'max_alerts')
+        datapoints_to_alarm = self._optional(body, 'datapoints_to_alarm')
+
+        data, start, end = await self.fetch(metric, statistic, period)
+        if len(data) == 0:
+            raise HTTPError(404, "No data found.")
+
+        key = ('seasonal', metric_key(metric), statistic, period, start, alarm_type, window_size, max_alerts, datapoints_to_alarm)
+        result = self.backtests.get(key)
+        if result is None:
+            # The profile only depends on the series, so it is shared by requests with other alarm parameters
+            loop = asyncio.get_running_loop()
+            profile = await loop.run_in_executor(None, cached_profile, metric, statistic, period, data)
+            result = await self._compute(run_seasonal, data, alarm_type, window_size, max_alerts, datapoints_to_alarm, period,
+                                         profile)
+            self.backtests.put(key, result)
+
+        return dict(result, start=start, end=end)
+
+    async def create_alarm(self, query, body):
+        metric, alarm_type, statistic, period, window_size = self._parameters(body)
+        if 'threshold' not in body:
+            raise HTTPError(400, "Invalid request: 'threshold'")
+        threshold = parse_number(body['threshold'], 'threshold', as_number)
+        datapoints_to_alarm = self._optional(body, 'datapoints_to_alarm')
+
+        loop = asyncio.get_running_loop()
+        alarm_name = await loop.run_in_executor(
+            None, put_alarm, metric['MetricName'], metric['Namespace'], metric['Dimensions'], threshold, alarm_type,
+            self.client, statistic, period, window_size, datapoints_to_alarm, body.get('actions', []))
+        return {'alarm_name': alarm_name}
+
+    async def dispatch(self, method, target, body):
+        """Route a request and return (status, payload)."""
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            return 404, {'error': f"No route for {method} {url.path}"}
+
+        try:
+            payload = json.loads(body) if body else {}
+            return 200, await handler(parse_qs(url.query), payload)
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except json.JSONDecodeError as e:
+            return 400, {'error': f"Invalid JSON: {e}"}
+        except Exception as e:
+            return 500, {'error': str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on a connection until it is closed."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    status, payload = 413, {'error': 'Request body too large'}
+                    body = b''
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.dispatch(method.upper(), target, body)
+
+                content = json.dumps(payload, default=to_json).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close' and version.strip() == 'HTTP/1.1' and status != 413
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + content)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening and return the asyncio server."""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+def serve(client, host='127.0.0.1', port=8080, workers=None):
+    """Run the tuning service until interrupted."""
+
+    async def main():
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            service = TuningService(client, executor)
+            server = await service.start(host, port)
+            async with server:
+                await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
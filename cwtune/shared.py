@@ -0,0 +1,180 @@
+"""A shared memory store of series for process pool backtests.
+
+Sending a series of (datetime, value) tuples to a worker process pickles it
+for every task, which for large sweeps costs more than the backtest. The
+store packs many series into two shared memory buffers, epochs as 64 bit
+integers and values as doubles, described by a manifest of buffer names and
+series offsets. Workers attach to the buffers once when they start and
+evaluate candidates in place, so a task is only a series index and a few
+numbers, and its result is two integers.
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+ITEM_SIZE = 8
+
+# The store attached in a worker process
+_store = None
+
+
+class SeriesStore:
+    """Series packed into shared epoch and value buffers, with offsets[i]:offsets[i + 1] holding series i."""
+
+    def __init__(self, epochs_memory, values_memory, offsets, owner=False):
+        self.epochs_memory = epochs_memory
+        self.values_memory = values_memory
+        self.offsets = offsets
+        self.owner = owner
+        self.epochs = epochs_memory.buf.cast('q')
+        self.values = values_memory.buf.cast('d')
+
+    @property
+    def manifest(self):
+        """Return what a process needs to attach to the store."""
+        return self.epochs_memory.name, self.values_memory.name, self.offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def series(self, index):
+        """Return the epochs and values of a series as zero-copy memoryviews."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.epochs[start:end], self.values[start:end]
+
+    def data(self, index, start=0, end=None):
+        """Return positions start to end of a series as (timestamp, value) pairs, copied out of the store."""
+        offset, length = self.offsets[index], self.offsets[index + 1] - self.offsets[index]
+        end = length if end is None else end
+        epochs, values = self.epochs[offset + start:offset + end].tolist(), self.values[offset + start:offset + end].tolist()
+        return [(datetime.fromtimestamp(epoch, timezone.utc), value) for epoch, value in zip(epochs, values)]
+
+    def backtest(self, index, threshold, is_gt, window_size, time_threshold):
+        """Return (alerts, longest breach in seconds) for a series, as `get_breaches` would find them."""
+        epochs, values = self.series(index)
+        return count_breaches(epochs, values, threshold, is_gt, window_size, time_threshold)
+
+    def executor(self, max_workers=None):
+        """Return a process pool whose workers are attached to the store."""
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_attach, initargs=self.manifest)
+
+    def close(self):
+        self.epochs.release()
+        self.values.release()
+        self.epochs_memory.close()
+        self.values_memory.close()
+        if self.owner:
+            self.epochs_memory.unlink()
+            self.values_memory.unlink()
+
+
+def create_store(series):
+    """Copy a list of [(timestamp, value), ...] series into a new SeriesStore."""
+    offsets = [0]
+    for data in series:
+        offsets.append(offsets[-1] + len(data))
+
+    # Zero sized shared memory is not allowed, so empty stores get one unused item
+    size = max(offsets[-1], 1) * ITEM_SIZE
+    epochs_memory = shared_memory.SharedMemory(create=True, size=size)
+    values_memory = shared_memory.SharedMemory(create=True, size=size)
+    store = SeriesStore(epochs_memory, values_memory, tuple(offsets), owner=True)
+
+    for data, start in zip(series, offsets):
+        end = start + len(data)
+        store.epochs[start:end] = array('q', [int(timestamp.timestamp()) for timestamp, value in data])
+        store.values[start:end] = array('d', [value for timestamp, value in data])
+
+    return store
+
+
+def attach_store(epochs_name, values_name, offsets):
+    """Attach to a store created by another process."""
+    # Pool workers share the resource tracker of the process that created the buffers, which unlinks them once
+    return SeriesStore(shared_memory.SharedMemory(name=epochs_name), shared_memory.SharedMemory(name=values_name), offsets)
+
+
+def _attach(epochs_name, values_name, offsets):
+    global _store
+    _store = attach_store(epochs_name, values_name, offsets)
+
+
+def attached():
+    """Return the store the current worker process is attached to."""
+    return _store
+
+
+def count_breaches(epochs, values, threshold, is_gt, window_size, time_threshold):
+    """Return (alerts, longest breach in seconds) of an alarm on epochs and values.
+
+    Breaches match `get_breaches`: the window spans window_size minutes and
+    a breach ends at the first datapoint that is no longer in alarm.
+    """
+    span = (window_size - 1) * 60
+    num_breaches = 0
+    window_start = 0
+    alerts = 0
+    longest = 0
+    breach_start = None
+
+    for i in range(len(values)):
+        epoch = epochs[i]
+        if values[i] > threshold if is_gt else values[i] < threshold:
+            num_breaches += 1
+
+        # remove values that are outside of the window
+        cutoff = epoch - span
+        while epochs[window_start] < cutoff:
+            old = values[window_start]
+            if old > threshold if is_gt else old < threshold:
+                num_breaches -= 1
+            window_start += 1
+
+        if num_breaches >= time_threshold:
+            if breach_start is None:
+                breach_start = epoch
+                alerts += 1
+        elif breach_start is not None:
+            longest = max(longest, epoch - breach_start)
+            breach_start = None
+
+    if breach_start is not None:
+        longest = max(longest, epochs[len(epochs) - 1] - breach_start)
+
+    return alerts, longest
+
+
+def backtest_task(index, candidates):
+    """Evaluate (threshold, is_gt, window_size, time_threshold) candidates on a series of the attached store."""
+    epochs, values = _store.series(index)
+    # Lists index faster than memoryviews, which pays off as soon as a series has a few candidates
+    if len(candidates) > 1:
+        epochs, values = epochs.tolist(), values.tolist()
+    return [count_breaches(epochs, values, *candidate) for candidate in candidates]
+
+
+def sweep(store, candidates, executor=None):
+    """Evaluate candidates, a dict of series index to a list of (threshold, is_gt, window_size, time_threshold).
+
+    Returns a dict of series index to a list of (alerts, longest breach in
+    seconds), in the order of its candidates. Without an executor a process
+    pool attached to the store is created for the sweep.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = store.executor()
+
+    try:
+        futures = {index: executor.submit(backtest_task, index, series_candidates)
+                   for index, series_candidates in candidates.items()}
+        return {index: future.result() for index, future in futures.items()}
+    finally:
+        if own_executor:
+            executor.shutdown()
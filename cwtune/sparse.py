@@ -0,0 +1,133 @@
+"""Run-length encoded series for sparse, gap-heavy metrics.
+
+Error counts and other sparse metrics only report a handful of datapoints
+over two weeks. Instead of zero padding every missing period, a sparse
+series stores runs of identical values, with None for runs of missing
+datapoints, and evaluates alarms run by run. Only the first evaluation
+window of each run can differ from its neighbours, so a run costs at most
+one window of work however long it is.
+
+Missing datapoints are evaluated per CloudWatch's TreatMissingData:
+
+    missing       not counted; a window without any datapoints has
+                  insufficient data, which is not an alarm
+    notBreaching  counted as within the threshold
+    breaching     counted as breaching the threshold
+    ignore        not counted, and the alarm keeps its current state
+"""
+from collections import deque
+from datetime import timedelta, timezone
+import operator
+from .mofn import effective_window
+
+TREAT_MISSING_DATA = ('missing', 'notBreaching', 'breaching', 'ignore')
+
+# Whether a missing datapoint breaches for each mode, None meaning the alarm state is held
+MISSING_BREACHES = {'missing': False, 'notBreaching': False, 'breaching': True, 'ignore': None}
+
+
+class SparseSeries:
+    """A series on a regular grid of length periods from start, stored as [offset, length, value] runs."""
+
+    def __init__(self, start, period, length, runs, treat_missing_data='missing'):
+        if treat_missing_data not in TREAT_MISSING_DATA:
+            raise ValueError(f"Unknown TreatMissingData {treat_missing_data}, expected one of {', '.join(TREAT_MISSING_DATA)}")
+        self.start = start
+        self.period = period
+        self.length = length
+        self.runs = runs
+        self.treat_missing_data = treat_missing_data
+
+    def __len__(self):
+        return self.length
+
+    def timestamp(self, index):
+        return self.start + timedelta(minutes=self.period * index)
+
+    def value_counts(self):
+        """Return (value, count) pairs for the runs with data."""
+        return [(value, length) for offset, length, value in self.runs if value is not None]
+
+    def to_dense(self, fill=0):
+        """Return the series as (timestamp, value) pairs, missing datapoints replaced by fill as by `zero_pad`."""
+        data = []
+        for offset, length, value in self.runs:
+            for index in range(offset, offset + length):
+                data.append((self.timestamp(index), fill if value is None else value))
+        return data
+
+    def breaches(self, threshold, alarm_type, window_size, time_threshold):
+        """Identify the start and end of each continuous breach of the threshold, like `get_breaches`.
+
+        Missing datapoints inside a breach extend it without adding to its values.
+        """
+        compare = operator.gt if alarm_type.is_gt() else operator.lt
+        width = effective_window(window_size, self.period)
+        breaches = []
+        recent = deque()
+        in_alarm = False
+
+        def transition(index, alarm, value, count=1):
+            if alarm:
+                if not in_alarm:
+                    breaches.append({'start': self.timestamp(index), 'end': self.timestamp(index), 'status': 'open', 'values': []})
+                breaches[-1]['end'] = self.timestamp(index + count - 1)
+                if value is not None:
+                    breaches[-1]['values'].extend([value] * count)
+            elif in_alarm:
+                breaches[-1]['end'] = self.timestamp(index)
+                breaches[-1]['status'] = 'closed'
+            return alarm
+
+        for offset, length, value in self.runs:
+            breached = MISSING_BREACHES[self.treat_missing_data] if value is None else compare(value, threshold)
+
+            # The first window of the run still sees the runs before it
+            head = min(length, width)
+            for index in range(offset, offset + head):
+                if breached:
+                    recent.append(index)
+                while recent and recent[0] <= index - width:
+                    recent.popleft()
+                in_alarm = transition(index, in_alarm if breached is None else len(recent) >= time_threshold, value)
+
+            # After that the window only holds this run, so the state is the same until the run ends
+            if length > head:
+                alarm = in_alarm if breached is None else bool(breached) and width >= time_threshold
+                in_alarm = transition(offset + head, alarm, value, length - head)
+                end = offset + length
+                recent = deque(range(end - width, end)) if breached else deque()
+
+        if in_alarm:
+            breaches[-1]['end'] = self.timestamp(self.length - 1)
+            breaches[-1]['status'] = 'closed'
+
+        return breaches
+
+
+def sparse_series(data, period, start, end, treat_missing_data='missing'):
+    """Build a SparseSeries from (timestamp, value) datapoints on the period grid between start and end."""
+    step = timedelta(minutes=period)
+    length = (end - start) // step + 1
+
+    points = {}
+    for timestamp, value in data:
+        index = round((timestamp.replace(tzinfo=timezone.utc) - start) / step)
+        if 0 <= index < length:
+            points[index] = value
+
+    runs = []
+    position = 0
+    for index in sorted(points):
+        if index > position:
+            runs.append([position, index - position, None])
+        value = points[index]
+        if runs and runs[-1][2] == value and runs[-1][2] is not None:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1, value])
+        position = index + 1
+    if position < length:
+        runs.append([position, length - position, None])
+
+    return SparseSeries(start, period, length, runs, treat_missing_data)
@@ -0,0 +1,222 @@
+"""Incremental re-tuning with persisted per-metric breach state.
+
+A MetricState records where the last run stopped: the last processed
+timestamp, the open sliding window, any open breach, the breaches of the
+retention period and per-day running statistics. Each run only fetches and
+feeds the datapoints that arrived since then, so a nightly re-evaluation
+costs O(new data) instead of rescanning the whole range.
+
+Drift is measured on the statistics alone: the bound of mean and standard
+deviation when the threshold was fitted is kept as the baseline, and the
+threshold is suggested to move by as much as that bound has moved since.
+"""
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import math
+import os
+from .api import find_threshold, to_alarm_type
+from .aws import fetch_metric_data
+from .timeseries import BreachTracker, zero_pad
+from .utils import metric_key, select_range
+
+RETENTION = timedelta(days=14)
+STD_DEVS = 5
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def state_key(metric, statistic, period, alarm_type):
+    """Return a stable key for a metric, statistic, period and alarm type."""
+    identity = json.dumps([*metric_key(metric), statistic, period, alarm_type.value], sort_keys=True)
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+class MetricState:
+    """Persisted breach detection state for a single tuned metric."""
+
+    def __init__(self, metric, statistic, period, alarm_type, threshold, window_size, datapoints_to_alarm=None,
+                 last_timestamp=None, window=None, open_breach=None, breaches=None, daily_stats=None, baseline=None):
+        self.metric = metric
+        self.statistic = statistic
+        self.period = period
+        self.alarm_type = to_alarm_type(alarm_type)
+        self.threshold = threshold
+        self.window_size = window_size
+        self.datapoints_to_alarm = datapoints_to_alarm or math.ceil(window_size / 2)
+        self.last_timestamp = last_timestamp
+        self.breaches = breaches or []
+        self.daily_stats = daily_stats or {}
+        self.baseline = baseline
+        self.tracker = BreachTracker(threshold, self.alarm_type, window_size, self.datapoints_to_alarm, window, open_breach)
+
+    @property
+    def key(self):
+        return state_key(self.metric, self.statistic, self.period, self.alarm_type)
+
+    def advance(self, data):
+        """Feed the datapoints newer than the last processed timestamp."""
+        for timestamp, value in data:
+            if self.last_timestamp and timestamp <= self.last_timestamp:
+                continue
+
+            breach = self.tracker.update(timestamp, value)
+            if breach:
+                self.breaches.append({'start': breach['start'], 'end': breach['end']})
+
+            day = timestamp.date().isoformat()
+            count, total, squares = self.daily_stats.get(day, (0, 0, 0))
+            self.daily_stats[day] = (count + 1, total + value, squares + value * value)
+            self.last_timestamp = timestamp
+
+        self._prune()
+
+    def _prune(self):
+        """Drop breaches and statistics older than the retention period."""
+        if not self.last_timestamp:
+            return
+        cutoff = self.last_timestamp - RETENTION
+        self.breaches = [breach for breach in self.breaches if breach['end'] >= cutoff]
+        first_day = cutoff.date().isoformat()
+        self.daily_stats = {day: stats for day, stats in self.daily_stats.items() if day >= first_day}
+
+    def statistics(self):
+        """Return the count, mean and standard deviation over the retention period."""
+        count = sum(stats[0] for stats in self.daily_stats.values())
+        if count == 0:
+            return 0, 0, 0
+        total = sum(stats[1] for stats in self.daily_stats.values())
+        squares = sum(stats[2] for stats in self.daily_stats.values())
+        mean = total / count
+        return count, mean, math.sqrt(max(squares / count - mean * mean, 0))
+
+    def bound(self):
+        """Return the mean plus, or for less than alarms minus, STD_DEVS standard deviations."""
+        count, mean, std_dev = self.statistics()
+        return mean + STD_DEVS * std_dev if self.alarm_type.is_gt() else mean - STD_DEVS * std_dev
+
+    def suggested_threshold(self, drift):
+        """Return the threshold moved by drift, kept at least 1 for less than alarms and 0 otherwise."""
+        return max(self.threshold + drift, 0 if self.alarm_type.is_gt() else 1)
+
+    def report(self):
+        """Return the rolling alert count and how far the threshold has drifted since it was fitted."""
+        count, mean, std_dev = self.statistics()
+        drift = self.bound() - self.baseline if self.baseline is not None else None
+
+        open_breach = self.tracker.open_breach
+        return {
+            'key': self.key,
+            'metric': self.metric,
+            'last_timestamp': self.last_timestamp,
+            'alerts': len(self.breaches) + (1 if open_breach else 0),
+            'open_breach': {'start': open_breach['start'], 'end': open_breach['end']} if open_breach else None,
+            'datapoints': count,
+            'mean': mean,
+            'std_dev': std_dev,
+            'threshold': self.threshold,
+            'suggested_threshold': self.suggested_threshold(drift) if drift is not None else None,
+            'baseline': self.baseline,
+            'drift': drift,
+            'drift_ratio': drift / self.threshold if drift is not None and self.threshold else None,
+        }
+
+    def to_dict(self):
+        open_breach = self.tracker.open_breach
+        return {
+            'metric': self.metric,
+            'statistic': self.statistic,
+            'period': self.period,
+            'alarm_type': self.alarm_type.value,
+            'threshold': self.threshold,
+            'window_size': self.window_size,
+            'datapoints_to_alarm': self.datapoints_to_alarm,
+            'last_timestamp': _isoformat(self.last_timestamp),
+            'window': [[_isoformat(timestamp), breached] for timestamp, breached in self.tracker.window],
+            'open_breach': dict(open_breach, start=_isoformat(open_breach['start']), end=_isoformat(open_breach['end'])) if open_breach else None,
+            'breaches': [[_isoformat(breach['start']), _isoformat(breach['end'])] for breach in self.breaches],
+            'daily_stats': self.daily_stats,
+            'baseline': self.baseline,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        open_breach = state['open_breach']
+        if open_breach:
+            open_breach = dict(open_breach, start=_timestamp(open_breach['start']), end=_timestamp(open_breach['end']))
+        return cls(
+            state['metric'], state['statistic'], state['period'], state['alarm_type'], state['threshold'],
+            state['window_size'], state['datapoints_to_alarm'],
+            last_timestamp=_timestamp(state['last_timestamp']),
+            window=[(_timestamp(timestamp), breached) for timestamp, breached in state['window']],
+            open_breach=open_breach,
+            breaches=[{'start': _timestamp(start), 'end': _timestamp(end)} for start, end in state['breaches']],
+            daily_stats={day: tuple(stats) for day, stats in state['daily_stats'].items()},
+            baseline=state.get('baseline'),
+        )
+
+    def save(self, directory):
+        """Write the state to its file in directory."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.key}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(path + '.tmp', path)
+        return path
+
+    @classmethod
+    def load(cls, directory, metric, statistic, period, alarm_type):
+        """Load the state for a metric from directory, or None if there is none."""
+        path = os.path.join(directory, f"{state_key(metric, statistic, period, to_alarm_type(alarm_type))}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def retune(metric, directory, client, alarm_type='gt', statistic='Sum', period=5, window_size=5, max_alerts=11, threshold=None, end=None):
+    """Advance the persisted state of a metric with its new datapoints and return its report.
+
+    The first run fetches the whole retention period and, unless a threshold
+    is given, picks one with the same search as the CLI. Later runs only
+    fetch datapoints after the last processed timestamp. Missing datapoints
+    are only padded up to the last one CloudWatch returned, so points that
+    are published late are picked up by the next run instead of being
+    processed as zeros.
+    """
+    alarm_type = to_alarm_type(alarm_type)
+    state = MetricState.load(directory, metric, statistic, period, alarm_type)
+
+    if end is None:
+        end = select_range()[1]
+
+    if state and state.last_timestamp:
+        start = state.last_timestamp + timedelta(minutes=period)
+    else:
+        start = end - RETENTION
+
+    data = []
+    if start <= end:
+        data = fetch_metric_data(start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period, statistic, client)
+    if data:
+        last = max(timestamp for timestamp, value in data).replace(tzinfo=timezone.utc)
+        data = zero_pad(data, period, start, last)
+
+    if state is None:
+        if len(data) == 0:
+            return None
+        if threshold is None:
+            threshold, breaches = find_threshold(data, alarm_type, window_size, max_alerts)
+        state = MetricState(metric, statistic, period, alarm_type, threshold, window_size)
+
+    state.advance(data)
+    if state.baseline is None and state.daily_stats:
+        state.baseline = state.bound()
+    state.save(directory)
+    return state.report()
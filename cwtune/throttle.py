@@ -0,0 +1,173 @@
+"""A shared rate limit and retry layer for CloudWatch calls.
+
+Every client of a region draws from the same per-API token buckets, sized
+to CloudWatch's default TPS quotas, so concurrent workers together stay at
+the quota instead of each assuming it has the account to itself. Throttled
+calls halve their bucket's rate and are retried with jittered exponential
+backoff, and the rate recovers as calls succeed again.
+"""
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+# Default CloudWatch quotas in transactions per second
+TPS_LIMITS = {
+    'get_metric_data': 50,
+    'get_metric_statistics': 400,
+    'list_metrics': 25,
+    'describe_alarms': 9,
+    'describe_alarms_for_metric': 9,
+    'put_metric_alarm': 3,
+    'delete_alarms': 3,
+}
+DEFAULT_TPS = 10
+MIN_RATE_FRACTION = 0.1
+RECOVERY_FRACTION = 0.05
+
+MAX_RETRIES = 8
+BASE_DELAY = 0.1
+MAX_DELAY = 20
+
+THROTTLING_CODES = {'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException'}
+TRANSIENT_CODES = {'InternalFailure', 'InternalServiceError', 'ServiceUnavailable'}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code') if isinstance(error, ClientError) else None
+
+
+def is_throttling(error):
+    """Return whether an error is CloudWatch refusing a call for exceeding its rate."""
+    return error_code(error) in THROTTLING_CODES
+
+
+class TokenBucket:
+    """A token bucket whose rate backs off when throttled and recovers on success."""
+
+    def __init__(self, rate, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = rate
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, returning how long to wait before using it."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate)
+            self.updated = now
+            # Tokens are reserved ahead, so concurrent callers queue up behind each other
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.max_rate * MIN_RATE_FRACTION)
+            self.tokens = min(self.tokens, self.rate)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.rate + self.max_rate * RECOVERY_FRACTION, self.max_rate)
+
+
+class RateLimiter:
+    """Per-API token buckets and retry counters shared by every client of a region."""
+
+    def __init__(self, limits=None, clock=time.monotonic):
+        self.limits = dict(TPS_LIMITS, **(limits or {}))
+        self.clock = clock
+        self.buckets = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, operation):
+        with self.lock:
+            if operation not in self.buckets:
+                self.buckets[operation] = TokenBucket(self.limits.get(operation, DEFAULT_TPS), self.clock)
+                self.counters[operation] = {'requests': 0, 'retries': 0, 'throttles': 0, 'failures': 0, 'waited': 0.0}
+            return self.buckets[operation]
+
+    def count(self, operation, name, amount=1):
+        with self.lock:
+            self.counters[operation][name] += amount
+
+    def stats(self):
+        """Return the counters of each operation."""
+        with self.lock:
+            return {operation: dict(counters) for operation, counters in self.counters.items()}
+
+    def totals(self):
+        """Return the counters summed over all operations."""
+        totals = {'requests': 0, 'retries': 0, 'throttles': 0, 'failures': 0, 'waited': 0.0}
+        for counters in self.stats().values():
+            for name, value in counters.items():
+                totals[name] += value
+        return totals
+
+
+def rate_limiter(region):
+    """Return the rate limiter shared by the clients of a region."""
+    with _limiters_lock:
+        if region not in _limiters:
+            _limiters[region] = RateLimiter()
+        return _limiters[region]
+
+
+class ThrottledClient:
+    """Wrap a CloudWatch client to rate limit its calls and retry throttled ones."""
+
+    def __init__(self, client, limiter, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 sleep=time.sleep, seed=None):
+        self.client = client
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.random = random.Random(seed)
+
+    def backoff(self, attempt):
+        """Return a full jitter exponential backoff delay for a retry attempt."""
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_') or name in ('get_paginator', 'get_waiter', 'can_paginate'):
+            return attribute
+
+        def call(**params):
+            bucket = self.limiter.bucket(name)
+            for attempt in range(self.max_retries + 1):
+                wait = bucket.acquire()
+                if wait:
+                    self.limiter.count(name, 'waited', wait)
+                    self.sleep(wait)
+
+                self.limiter.count(name, 'requests')
+                try:
+                    response = attribute(**params)
+                except ClientError as e:
+                    code = error_code(e)
+                    if code not in THROTTLING_CODES and code not in TRANSIENT_CODES:
+                        raise
+                    if code in THROTTLING_CODES:
+                        self.limiter.count(name, 'throttles')
+                        bucket.throttled()
+                    if attempt == self.max_retries:
+                        self.limiter.count(name, 'failures')
+                        raise
+                    self.limiter.count(name, 'retries')
+                    delay = self.backoff(attempt)
+                    self.limiter.count(name, 'waited', delay)
+                    self.sleep(delay)
+                else:
+                    bucket.succeeded()
+                    return response
+
+        return call
@@ -1,7 +1,10 @@
 from collections import deque
 from datetime import datetime, timedelta, timezone
 import math
+import operator
 import click
+
+
 def zero_pad(data, period, start, end):
     """Pad the data with zeros for missing values."""
     data_dict = {}
@@ -27,28 +30,38 @@ def eval(value, threshold, alarm_type):
     elif alarm_type.is_lt():
         return value < threshold
 
-from collections import deque
-import logging
 
-def get_breaches(data, threshold, alarm_type, window_size, time_threshold):
-    """Identify the start and end of each continuous breach of the threshold."""
-    # iterate over the data using a sliding window
-    breaches = []
+def alarm_states(data, threshold, alarm_type, window_size, time_threshold):
+    """Return whether the alarm is in breach at each datapoint of the data."""
+    states = []
     window = deque()
+    num_breaches = 0
+    span = timedelta(minutes=window_size - 1)
+    compare = operator.gt if alarm_type.is_gt() else operator.lt
 
     for timestamp, value in data:
-        window.append((timestamp, value))
+        breached = compare(value, threshold)
+        window.append((timestamp, breached))
+        num_breaches += breached
 
         # remove values that are outside of the window
-        while window and window[0][0] < timestamp - timedelta(minutes=window_size - 1):
-            window.popleft()
-        # check if the window contains more than time_threshold breaches
-        num_breaches = sum(eval(w[1], threshold, alarm_type) for w in window)
-
-        if num_breaches >= time_threshold:
-            logging.debug(f"num_breaches: {num_breaches}")
-            logging.debug(f"time_threshold: {time_threshold}")
-            logging.debug(f"window: {[w[1] for w in window]}")
+        cutoff = timestamp - span
+        while window and window[0][0] < cutoff:
+            num_breaches -= window.popleft()[1]
+
+        states.append(num_breaches >= time_threshold)
+
+    return states
+
+
+def get_breaches(data, threshold, alarm_type, window_size, time_threshold):
+    """Identify the start and end of each continuous breach of the threshold."""
+    # iterate over the data using a sliding window
+    breaches = []
+    states = alarm_states(data, threshold, alarm_type, window_size, time_threshold)
+
+    for (timestamp, value), in_breach in zip(data, states):
+        if in_breach:
             # check if we are already in a breach
             if breaches and breaches[-1]['status'] == 'open':
                 breaches[-1]['end'] = timestamp
@@ -69,6 +82,61 @@ def get_breaches(data, threshold, alarm_type, window_size, time_threshold):
     return breaches
 
 
+class BreachTracker:
+    """A resumable version of get_breaches that consumes datapoints as they arrive.
+
+    The sliding window and any open breach are kept between calls to update,
+    so a series can be processed in chunks and give the same breaches as a
+    single get_breaches pass over the whole series.
+    """
+
+    def __init__(self, threshold, alarm_type, window_size, time_threshold, window=None, open_breach=None):
+        self.threshold = threshold
+        self.alarm_type = alarm_type
+        self.window_size = window_size
+        self.time_threshold = time_threshold
+        self.window = deque(window or [])
+        self.num_breaches = sum(breached for timestamp, breached in self.window)
+        self.open_breach = open_breach
+        self.last_timestamp = None
+
+    def update(self, timestamp, value):
+        """Add a datapoint and return the breach it closed, if any."""
+        breached = eval(value, self.threshold, self.alarm_type)
+        self.window.append((timestamp, breached))
+        self.num_breaches += breached
+        self.last_timestamp = timestamp
+
+        # remove values that are outside of the window
+        cutoff = timestamp - timedelta(minutes=self.window_size - 1)
+        while self.window and self.window[0][0] < cutoff:
+            self.num_breaches -= self.window.popleft()[1]
+
+        if self.num_breaches >= self.time_threshold:
+            if self.open_breach:
+                self.open_breach['end'] = timestamp
+                self.open_breach['values'].append(value)
+            else:
+                self.open_breach = {'start': timestamp, 'end': timestamp, 'status': 'open', 'values': [value]}
+        elif self.open_breach:
+            breach = self.open_breach
+            breach['end'] = timestamp
+            breach['status'] = 'closed'
+            self.open_breach = None
+            return breach
+
+        return None
+
+    def close(self):
+        """Close and return the open breach at the last datapoint, if any."""
+        breach = self.open_breach
+        if breach:
+            breach['end'] = self.last_timestamp or breach['end']
+            breach['status'] = 'closed'
+            self.open_breach = None
+        return breach
+
+
 def longest_breach(breaches):
     """Return the length of the longest breach."""
     longest_breach = timedelta(seconds=0)
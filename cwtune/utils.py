@@ -1,3 +1,5 @@
+from collections import OrderedDict
+import os
 import requests
 from datetime import datetime, timedelta, timezone
 
@@ -48,6 +50,18 @@ def create_cloudwatch_link(namespace: str, metric_name: str, start: datetime, en
         return full_url
 
 
+def cwtune_home():
+    """Return the directory cwtune keeps its local state in, creating it if needed."""
+    home = os.environ.get('CWTUNE_HOME', os.path.join(os.path.expanduser('~'), '.cwtune'))
+    os.makedirs(home, exist_ok=True)
+    return home
+
+
+def metric_key(metric):
+    """Return a hashable identity for a metric."""
+    return (metric['Namespace'], metric['MetricName'], tuple(sorted((d['Name'], d['Value']) for d in metric['Dimensions'])))
+
+
 def format_timestamp(timestamp):
     """Format the timestamp."""
     return timestamp.strftime('%Y-%m-%d %H:%M:%S')
@@ -65,3 +79,26 @@ def select_range():
     start = start.replace(tzinfo=timezone.utc)
     end = end.replace(tzinfo=timezone.utc)
     return start, end
+
+
+class LRUCache:
+    """A small least recently used cache."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,183 @@
+"""Walk-forward validation of suggested thresholds.
+
+A threshold fitted and scored on the same range always looks good. Here a
+longer history is split into rolling folds, a threshold is fitted on each
+training range and scored on the range that follows it, and the spread of
+the fitted thresholds shows how stable the suggestion is. Histories too short
+for the default ranges, such as the 15 days kept at a 1 minute period, are
+validated on proportionally shorter ranges.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import timedelta, timezone
+import gzip
+import hashlib
+import json
+import math
+import os
+import statistics
+from .api import fetch_series, find_threshold
+from .aws import fetch_metric_data
+from .backend import encode, decode
+from .shared import attached, create_store
+from .timeseries import get_breaches, longest_breach, zero_pad
+from .utils import metric_key, select_range
+
+TRAIN_RANGE = timedelta(days=14)
+TEST_RANGE = timedelta(days=7)
+# Shorter training ranges would not cover a weekly cycle
+MIN_TRAIN_RANGE = timedelta(days=7)
+STABLE_VARIATION = 0.1
+
+# How long CloudWatch keeps data at each period, in days
+RETENTION_DAYS = {1: 15, 5: 63, 60: 455}
+
+Fold = namedtuple('Fold', ['train_start', 'test_start', 'test_end'])
+FoldResult = namedtuple('FoldResult', ['fold', 'threshold', 'train_alerts', 'test_alerts', 'longest_test_breach'])
+ValidationReport = namedtuple('ValidationReport', ['results', 'mean_threshold', 'std_threshold', 'variation',
+                                                   'mean_test_alerts', 'max_test_alerts', 'stable'])
+
+
+def load_history(metric, statistic, period, client, days=None, cache_dir=None):
+    """Return (data, start, end) for the longest history CloudWatch keeps at the period.
+
+    With a cache_dir, the history is stored there and later calls only fetch
+    the datapoints after the cached range. Missing datapoints are only cached
+    up to the last one CloudWatch returned, so datapoints published late are
+    picked up by the next call.
+    """
+    start, end = select_range()
+    start = end - timedelta(days=days or RETENTION_DAYS.get(period, 15))
+
+    if not cache_dir:
+        return fetch_series(metric, statistic, period, client, start, end)
+
+    identity = json.dumps([*metric_key(metric), statistic, period])
+    path = os.path.join(cache_dir, f"history-{hashlib.sha1(identity.encode('utf-8')).hexdigest()}.json.gz")
+
+    data = []
+    fetch_start = start
+    if os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            cached = decode(json.load(f))
+        if cached['start'] <= start:
+            data = [tuple(point) for point in cached['data'] if point[0] >= start]
+            fetch_start = cached['end'] + timedelta(minutes=period)
+
+    covered_end = fetch_start - timedelta(minutes=period)
+    if fetch_start <= end:
+        points = fetch_metric_data(fetch_start, end, metric['MetricName'], metric['Namespace'], metric['Dimensions'], period,
+                                   statistic, client)
+        if points:
+            covered_end = max(timestamp for timestamp, value in points).replace(tzinfo=timezone.utc)
+            data += zero_pad(points, period, fetch_start, covered_end)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(encode({'data': data, 'start': start, 'end': covered_end}), f)
+
+    if not data:
+        return [], start, end
+    return data + zero_pad([], period, covered_end + timedelta(minutes=period), end), start, end
+
+
+def walk_forward_folds(start, end, train=TRAIN_RANGE, test=TEST_RANGE, step=None):
+    """Return the folds that fit between start and end, each training on train and testing on the following test range."""
+    step = step or test
+    folds = []
+    train_start = start
+    while train_start + train + test <= end:
+        folds.append(Fold(train_start, train_start + train, train_start + train + test))
+        train_start += step
+    return folds
+
+
+def fold_ranges(span, train=TRAIN_RANGE, test=TEST_RANGE):
+    """Return the (train, test) ranges for a history of span, or None if it is too short.
+
+    When the default ranges do not fit, both are shrunk in proportion so that
+    two folds fit, as long as training still covers MIN_TRAIN_RANGE.
+    """
+    if train + test <= span:
+        return train, test
+
+    scale = span / (train + 2 * test)
+    if train * scale < MIN_TRAIN_RANGE:
+        return None
+    return train * scale, test * scale
+
+
+def evaluate_fold(fold, train_data, test_data, alarm_type, window_size, max_alerts, datapoints_to_alarm):
+    """Fit a threshold on the training data and score it on the test data."""
+    threshold, train_breaches = find_threshold(train_data, alarm_type, window_size, max_alerts, datapoints_to_alarm)
+    test_breaches = get_breaches(test_data, threshold, alarm_type, window_size, datapoints_to_alarm)
+    return FoldResult(fold, threshold, len(train_breaches), len(test_breaches), longest_breach(test_breaches))
+
+
+def evaluate_shared_fold(fold, bounds, alarm_type, window_size, max_alerts, datapoints_to_alarm):
+    """Evaluate a fold on the series of the attached store, bounds being its train start, test start and test end positions."""
+    store = attached()
+    train_start, test_start, test_end = bounds
+    return evaluate_fold(fold, store.data(0, train_start, test_start), store.data(0, test_start, test_end), alarm_type,
+                         window_size, max_alerts, datapoints_to_alarm)
+
+
+def summarize(results):
+    """Summarize how stable the thresholds and out-of-sample alerts are across folds."""
+    thresholds = [result.threshold for result in results]
+    mean_threshold = statistics.mean(thresholds)
+    std_threshold = statistics.pstdev(thresholds)
+    variation = std_threshold / abs(mean_threshold) if mean_threshold else (math.inf if std_threshold else 0)
+    test_alerts = [result.test_alerts for result in results]
+    return ValidationReport(
+        results=results,
+        mean_threshold=mean_threshold,
+        std_threshold=std_threshold,
+        variation=variation,
+        mean_test_alerts=statistics.mean(test_alerts),
+        max_test_alerts=max(test_alerts),
+        stable=variation <= STABLE_VARIATION,
+    )
+
+
+def validate(data, alarm_type, window_size=5, max_alerts=11, datapoints_to_alarm=None, train=None, test=None,
+             step=None, executor=None, max_workers=None):
+    """Run walk-forward validation over the data and return a ValidationReport, or None if no fold fits.
+
+    Without train and test ranges they are picked by `fold_ranges` from the
+    length of the data. Folds are evaluated in parallel on the given
+    executor, or on a process pool that reads the series from shared memory
+    instead of receiving a copy of each fold.
+    """
+    if not data:
+        return None
+    if datapoints_to_alarm is None:
+        datapoints_to_alarm = math.ceil(window_size / 2)
+
+    timestamps = [timestamp for timestamp, value in data]
+    if train is None or test is None:
+        ranges = fold_ranges(timestamps[-1] - timestamps[0])
+        if ranges is None:
+            return None
+        train, test = ranges
+    folds = walk_forward_folds(timestamps[0], timestamps[-1], train, test, step)
+    if not folds:
+        return None
+
+    def bounds(fold):
+        return (bisect_left(timestamps, fold.train_start), bisect_left(timestamps, fold.test_start),
+                bisect_left(timestamps, fold.test_end))
+
+    if executor is not None:
+        futures = []
+        for fold in folds:
+            train_start, test_start, test_end = bounds(fold)
+            futures.append(executor.submit(evaluate_fold, fold, data[train_start:test_start], data[test_start:test_end],
+                                           alarm_type, window_size, max_alerts, datapoints_to_alarm))
+        return summarize([future.result() for future in futures])
+
+    with create_store([data]) as store:
+        with store.executor(max_workers) as executor:
+            futures = [executor.submit(evaluate_shared_fold, fold, bounds(fold), alarm_type, window_size, max_alerts,
+                                       datapoints_to_alarm) for fold in folds]
+            return summarize([future.result() for future in futures])
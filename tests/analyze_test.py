@@ -1,4 +1,6 @@
-from cwtune.analyze import run
+from cwtune.analyze import run, compare_statistics, select_statistic
+from cwtune.aws import fetch_statistics
+from concurrent.futures import ThreadPoolExecutor
 from cwtune.cli import AlarmType
 from datetime import datetime, timezone, timedelta
 from unittest import mock
@@ -105,4 +107,31 @@ class AnalyzeTest(unittest.TestCase):
         # assert that the correct metric was passed to get_metric_data
         args, kwargs = mock_client.get_metric_data.call_args
         assert kwargs['MetricDataQueries'][0]['MetricStat']['Metric']['MetricName'] == 'CPUUtilization'
-        assert kwargs['MetricDataQueries'][0]['MetricStat']['Metric']['Namespace'] == 'AWS/EC2'
\ No newline at end of file
+        assert kwargs['MetricDataQueries'][0]['MetricStat']['Metric']['Namespace'] == 'AWS/EC2'
+
+    def test_compare_statistics(self):
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        timestamps = [start + timedelta(minutes=i) for i in range(600)]
+
+        def get_metric_data(MetricDataQueries, StartTime, EndTime, NextToken=None):
+            # Both statistics spike at the same times, but the Sum spikes are too common to get a threshold below them
+            results = []
+            for query in MetricDataQueries:
+                length = 20 if query['MetricStat']['Stat'] == 'Sum' else 5
+                values = [100 if i % 100 < length else 10 for i in range(600)]
+                half = slice(300, None) if NextToken else slice(None, 300)
+                results.append({'Id': query['Id'], 'Timestamps': timestamps[half], 'Values': values[half]})
+            return {'MetricDataResults': results} if NextToken else {'MetricDataResults': results, 'NextToken': 'page-2'}
+
+        mock_client = mock.Mock()
+        mock_client.get_metric_data.side_effect = get_metric_data
+
+        series = fetch_statistics(start, timestamps[-1], 'Latency', 'AWS/ApplicationELB', [], 1, ['Sum', 'p99'], mock_client)
+        with ThreadPoolExecutor() as executor:
+            results = compare_statistics(series, AlarmType.GREATER_THAN, 5, 11, executor)
+
+        self.assertEqual(mock_client.get_metric_data.call_count, 2)
+        self.assertEqual([len(data) for data in series.values()], [600, 600])
+        self.assertEqual(len(results['Sum'][1]), 0)
+        self.assertEqual(len(results['p99'][1]), 6)
+        self.assertEqual(select_statistic(results), 'p99')
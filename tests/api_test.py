@@ -0,0 +1,67 @@
+from cwtune.api import tune, alerts_curve, find_threshold
+from cwtune.timeseries import get_breaches
+from cwtune.cli import AlarmType
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import random
+import unittest
+
+class ApiTest(unittest.TestCase):
+
+    def example_timeseries(seed=3, period=1):
+        rng = random.Random(seed)
+        start = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        return [(start + timedelta(minutes=i * period), rng.random() * 100) for i in range(1000)]
+
+    @mock.patch('click.echo')
+    def test_tune_with_data(self, echo):
+        data = ApiTest.example_timeseries()
+        result = tune(data=data, alarm_type='gt', period=1, window_size=5, max_alerts=11)
+
+        threshold, breaches = find_threshold(data, AlarmType.GREATER_THAN, 5, 11)
+        self.assertEqual(result.threshold, threshold)
+        self.assertEqual(result.breaches, breaches)
+        self.assertEqual(result.datapoints_to_alarm, 3)
+        self.assertLessEqual(len(result.breaches), 11)
+        self.assertEqual(result.start, data[0][0])
+        echo.assert_not_called()
+
+    def test_tune_infers_period(self):
+        data = ApiTest.example_timeseries()
+        result = tune(data=data, alarm_type='gt', window_size=5, max_alerts=11)
+
+        self.assertEqual(result.period, 1)
+        self.assertEqual(dict(result.alerts_curve)[result.threshold], len(result.breaches))
+
+    def test_tune_fetches_metric(self):
+        data = ApiTest.example_timeseries()
+        client = mock.Mock()
+        client.get_metric_data.return_value = {
+            'MetricDataResults': [{'Timestamps': [t for t, v in data], 'Values': [v for t, v in data]}]
+        }
+        metric = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': []}
+
+        result = tune(metric, AlarmType.GREATER_THAN, period=1, client=client, start=data[0][0], end=data[-1][0])
+
+        self.assertEqual(result.metric, metric)
+        self.assertEqual(client.get_metric_data.call_count, 1)
+
+    def test_tune_without_data(self):
+        self.assertIsNone(tune(data=[], alarm_type='lt'))
+        with self.assertRaises(ValueError):
+            tune(alarm_type='gt')
+
+    def test_alerts_curve_matches_get_breaches(self):
+        for period in (1, 5):
+            data = ApiTest.example_timeseries(period=period)
+            for threshold, alerts in alerts_curve(data, AlarmType.GREATER_THAN, 10, 3, num_points=10):
+                self.assertEqual(alerts, len(get_breaches(data, threshold, AlarmType.GREATER_THAN, 10, 3)))
+
+    def test_thread_safe(self):
+        series = [ApiTest.example_timeseries(seed) for seed in range(8)]
+        expected = [tune(data=data, alarm_type='gt', period=1) for data in series]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda data: tune(data=data, alarm_type='gt', period=1), series))
+        self.assertEqual(results, expected)
@@ -0,0 +1,79 @@
+from cwtune.backend import RecordingClient, ReplayClient, SyntheticClient, backend_client
+from cwtune.aws import list_metrics, list_alarms, fetch_metric_data, cw_client
+from cwtune.throttle import ThrottledClient
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import os
+import tempfile
+import unittest
+
+class BackendTest(unittest.TestCase):
+
+    START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    END = datetime(2020, 1, 1, 1, tzinfo=timezone.utc)
+
+    def real_client(self):
+        metrics = [{'Namespace': 'AWS/EC2', 'MetricName': f"Metric{i}", 'Dimensions': []} for i in range(5)]
+        client = mock.Mock()
+        client.list_metrics.side_effect = lambda **params: (
+            {'Metrics': metrics[3:]} if params.get('NextToken') else {'Metrics': metrics[:3], 'NextToken': 'page-2'})
+        client.get_metric_data.return_value = {
+            'MetricDataResults': [{'Id': 'metric_1', 'Timestamps': [BackendTest.START], 'Values': [42.0]}],
+            'ResponseMetadata': {'RequestId': '1'},
+        }
+        return client
+
+    def record(self, directory):
+        path = os.path.join(directory, 'recording.jsonl.gz')
+        client = RecordingClient(self.real_client(), path)
+        metrics = list_metrics(client)
+        data = fetch_metric_data(BackendTest.START, BackendTest.END, 'Metric0', 'AWS/EC2', [], 1, 'Sum', client)
+        return path, metrics, data
+
+    def test_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, metrics, data = self.record(directory)
+            replay = ReplayClient(path)
+
+            self.assertEqual(list_metrics(replay), metrics)
+            self.assertEqual(fetch_metric_data(BackendTest.START, BackendTest.END, 'Metric0', 'AWS/EC2', [], 1, 'Sum', replay), data)
+            # A different range, like a later run of select_range, still replays the same metric
+            later = BackendTest.END + timedelta(days=1)
+            self.assertEqual(fetch_metric_data(BackendTest.START, later, 'Metric0', 'AWS/EC2', [], 1, 'Sum', replay), data)
+            self.assertEqual(fetch_metric_data(BackendTest.START, later, 'Other', 'AWS/EC2', [], 1, 'Sum', replay), [])
+
+    def test_replay_page_size_and_throttling(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, metrics, data = self.record(directory)
+
+            replay = backend_client(f"replay:{path}?page_size=1")
+            self.assertEqual(list_metrics(replay), metrics)
+            self.assertEqual(replay.calls['list_metrics'], 5)
+
+            replay = backend_client(f"replay:{path}?throttle=1")
+            with self.assertRaises(ClientError) as context:
+                list_metrics(replay)
+            self.assertEqual(context.exception.response['Error']['Code'], 'Throttling')
+
+    def test_synthetic_account(self):
+        client = SyntheticClient(100000, 20000)
+        metrics = list_metrics(client)
+        self.assertEqual(len(metrics), 100000)
+        self.assertEqual(client.calls['list_metrics'], 200)
+        self.assertEqual(len(list_alarms(client)), 20000)
+
+        metric = metrics[0]
+        data = fetch_metric_data(BackendTest.START, BackendTest.END, metric['MetricName'], metric['Namespace'], metric['Dimensions'], 1, 'Sum', client)
+        again = fetch_metric_data(BackendTest.START, BackendTest.END, metric['MetricName'], metric['Namespace'], metric['Dimensions'], 1, 'Sum', client)
+        self.assertEqual(data, again)
+        self.assertTrue(all(BackendTest.START <= timestamp <= BackendTest.END for timestamp, value in data))
+
+    @mock.patch.dict(os.environ, {'CWTUNE_BACKEND': 'synthetic:10?alarms=2'})
+    def test_cw_client_backend(self):
+        client = cw_client('default', 'eu-west-1')
+        self.assertIsInstance(client, ThrottledClient)
+        self.assertIsInstance(client.client, SyntheticClient)
+        self.assertEqual(client.meta.region_name, 'eu-west-1')
+        self.assertEqual(len(list_metrics(client)), 10)
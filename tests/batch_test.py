@@ -0,0 +1,113 @@
+from cwtune.batch import run_batch
+from cwtune.backend import SyntheticClient
+from cwtune.budget import Budget, BudgetExceeded
+from cwtune.cli import AlarmType
+from contextlib import closing
+
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+class Interrupted(Exception):
+    pass
+
+class BatchTest(unittest.TestCase):
+
+    def interrupt_after(count):
+        def progress(done):
+            if done == count:
+                raise Interrupted()
+        return progress
+
+    def test_resume_after_interruption(self):
+        client = SyntheticClient(num_metrics=30, num_alarms=0, page_size=7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.jsonl')
+            with self.assertRaises(Interrupted):
+                run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=2, progress=BatchTest.interrupt_after(10))
+
+            # A write cut short by the crash is dropped on resume
+            with open(path, 'a') as f:
+                f.write('{"namespace": "AWS/')
+
+            fetched = client.calls['get_metric_data']
+            finished, failed = run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=2)
+            refetched = client.calls['get_metric_data'] - fetched
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual((finished, failed), (20, 0))
+        self.assertEqual(refetched, 20)
+        self.assertEqual(len(records), 30)
+        self.assertEqual(len({(r['namespace'], r['metric_name'], r['dimensions']) for r in records}), 30)
+        self.assertTrue(all(r['status'] in ('ok', 'no_data') for r in records))
+
+    def test_csv_and_changed_parameters(self):
+        client = SyntheticClient(num_metrics=5, num_alarms=0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.csv')
+            run_batch(client, path, AlarmType.LESS_THAN, period=60, workers=2)
+            self.assertEqual(run_batch(client, path, AlarmType.LESS_THAN, period=60, workers=2), (0, 0))
+
+            with self.assertRaises(ValueError):
+                run_batch(client, path, AlarmType.GREATER_THAN, period=60)
+
+            with open(path, newline='') as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['alarm_type'], 'lt')
+
+    def test_failed_metrics_are_replaced_on_resume(self):
+        client = SyntheticClient(num_metrics=5, num_alarms=0)
+        failing = client.metric(2)
+        get_metric_data = client.get_metric_data
+
+        def flaky(**params):
+            if params['MetricDataQueries'][0]['MetricStat']['Metric'] == failing:
+                raise RuntimeError('flaky')
+            return get_metric_data(**params)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.jsonl')
+            client.get_metric_data = flaky
+            self.assertEqual(run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=2), (4, 1))
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['status'] for line in f][-1], 'error')
+            # Failures are kept in the checkpoint rather than in memory
+            with closing(sqlite3.connect(f"{path}.checkpoint")) as connection:
+                self.assertEqual(connection.execute("SELECT COUNT(*) FROM failed").fetchone()[0], 1)
+
+            client.get_metric_data = get_metric_data
+            self.assertEqual(run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=2), (1, 0))
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(len(records), 5)
+        self.assertTrue(all(r['status'] != 'error' for r in records))
+
+    def test_stops_when_budget_is_spent(self):
+        client = SyntheticClient(num_metrics=10, num_alarms=0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.jsonl')
+            with self.assertRaises(BudgetExceeded):
+                run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=1, budget=Budget(max_requests=5))
+            finished, failed = run_batch(client, path, AlarmType.GREATER_THAN, period=60, workers=1)
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+
+        # Metrics in flight when the budget ran out are tuned again by the resumed run
+        self.assertLess(finished + failed, 10)
+        self.assertEqual(len({(r['namespace'], r['metric_name'], r['dimensions']) for r in records}), 10)
+        self.assertEqual(len(records), 10)
+
+if __name__ == '__main__':
+    unittest.main()
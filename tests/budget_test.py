@@ -0,0 +1,111 @@
+from cwtune.budget import Budget, BudgetExceeded, estimate_fetch, estimate_run
+from cwtune.api import tune
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import threading
+import unittest
+
+class BudgetTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': []}
+    END = datetime(2020, 1, 15, tzinfo=timezone.utc)
+    START = END - timedelta(days=14)
+
+    def client(self):
+        client = mock.Mock()
+        client.get_metric_data.side_effect = lambda **params: {'MetricDataResults': [
+            {'Timestamps': [params['StartTime']], 'Values': [1.0]}
+        ]}
+        return client
+
+    def test_estimates(self):
+        estimate = estimate_fetch(1, BudgetTest.START, BudgetTest.END)
+        self.assertEqual(estimate.datapoints, 20161)
+        self.assertEqual(estimate.requests, 1)
+        self.assertAlmostEqual(estimate.cost, 0.00001)
+
+        # A fetch is one request per metric whatever its range and period
+        estimate = estimate_fetch(1, BudgetTest.END - timedelta(days=100), BudgetTest.END, num_metrics=10, statistics=2)
+        self.assertEqual((estimate.requests, estimate.metrics_requested), (10, 20))
+
+        run = estimate_run(5, BudgetTest.START, BudgetTest.END, catalogue_size=1001, num_alarms=250, alarms_created=1)
+        self.assertEqual(run.requests, 1 + 3 + 3 + 1)
+
+    def test_tracks_usage(self):
+        budget = Budget()
+        client = budget.wrap(self.client())
+        client.list_metrics()
+        data, start, end, period = budget.fetch(BudgetTest.METRIC, 'Sum', 5, client, BudgetTest.START, BudgetTest.END)
+
+        usage = budget.usage.to_dict()
+        self.assertEqual(usage['requests'], {'list_metrics': 1, 'get_metric_data': 1})
+        self.assertEqual(usage['metrics_requested'], 1)
+        self.assertEqual(usage['datapoints'], 1)
+        self.assertAlmostEqual(usage['cost'], 0.00002)
+        self.assertEqual(period, 5)
+
+    def test_concurrent_calls_stay_within_budget(self):
+        budget = Budget(max_requests=5)
+        client = budget.wrap(mock.Mock())
+        started = threading.Barrier(20)
+
+        def call():
+            started.wait()
+            try:
+                client.list_metrics()
+                return True
+            except BudgetExceeded:
+                return False
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(lambda i: call(), range(20)))
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(budget.usage.total_requests, 5)
+
+    def test_failed_calls_are_not_counted(self):
+        client = mock.Mock()
+        client.list_metrics.side_effect = ConnectionError()
+        budget = Budget(max_requests=1)
+        with self.assertRaises(ConnectionError):
+            budget.wrap(client).list_metrics()
+        self.assertEqual(budget.usage.to_dict()['requests'], {})
+
+    def test_falls_back_to_cached_data(self):
+        budget = Budget(max_cost=0.00001)
+        client = self.client()
+        first = budget.fetch(BudgetTest.METRIC, 'Sum', 60, client, BudgetTest.START, BudgetTest.END)
+        second = budget.fetch(BudgetTest.METRIC, 'Sum', 60, client, BudgetTest.START, BudgetTest.END)
+
+        self.assertEqual(first, second)
+        self.assertEqual(client.get_metric_data.call_count, 1)
+
+        with self.assertRaises(BudgetExceeded):
+            budget.fetch(dict(BudgetTest.METRIC, MetricName='NetworkIn'), 'Sum', 60, client, BudgetTest.START, BudgetTest.END)
+        with self.assertRaises(BudgetExceeded):
+            budget.wrap(client).list_metrics()
+
+    def test_fetch_statistics_within_budget(self):
+        client = mock.Mock()
+        client.get_metric_data.side_effect = lambda **params: {'MetricDataResults': [
+            {'Id': query['Id'], 'Timestamps': [params['StartTime']], 'Values': [1.0]} for query in params['MetricDataQueries']
+        ]}
+        # Two statistics in one call are two metrics requested
+        budget = Budget(max_cost=0.00002)
+        series, _, _, period = budget.fetch_statistics(BudgetTest.METRIC, ['Sum', 'p99'], 1, client, BudgetTest.START, BudgetTest.END)
+
+        self.assertEqual(period, 1)
+        self.assertEqual(sorted(series), ['Sum', 'p99'])
+        self.assertAlmostEqual(budget.usage.cost, 0.00002)
+
+        # Once the budget is spent the cached series are returned
+        self.assertEqual(budget.fetch_statistics(BudgetTest.METRIC, ['Sum', 'p99'], 1, client, BudgetTest.START, BudgetTest.END)[0], series)
+        self.assertEqual(client.get_metric_data.call_count, 1)
+
+    def test_tune_with_budget(self):
+        budget = Budget(max_requests=1)
+        result = tune(BudgetTest.METRIC, 'gt', period=60, client=self.client(), start=BudgetTest.START, end=BudgetTest.END, budget=budget)
+        self.assertEqual(result.period, 60)
+        self.assertEqual(budget.usage.to_dict()['requests'], {'get_metric_data': 1})
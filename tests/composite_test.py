@@ -0,0 +1,84 @@
+from cwtune.composite import ChildAlarm, align, backtest_composite, parse_rule
+from cwtune.timeseries import alarm_states, get_breaches
+from cwtune.bitmask import pack
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+
+import random
+import time
+import unittest
+
+class CompositeTest(unittest.TestCase):
+
+    def example_timeseries(impact_start, impact_end, step=1):
+        start = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        end = datetime(2020, 1, 1, 0, 20, 0, tzinfo=timezone.utc)
+
+        data = []
+        current_time = start
+        while current_time <= end:
+            minute = (current_time - start).seconds // 60
+            data.append((current_time, 100 if impact_start <= minute <= impact_end else 0))
+            current_time += timedelta(minutes=step)
+
+        return data
+
+    def children(self):
+        latency = ChildAlarm('latency', CompositeTest.example_timeseries(2, 10), 10, AlarmType.GREATER_THAN, 1)
+        errors = ChildAlarm('errors', CompositeTest.example_timeseries(6, 14), 10, AlarmType.GREATER_THAN, 1)
+        return [latency, errors]
+
+    def test_and(self):
+        breaches = backtest_composite(self.children(), 'ALARM("latency") AND ALARM("errors")')
+        self.assertEqual(breaches, [
+            {
+                'start': datetime(2020, 1, 1, 0, 6, tzinfo=timezone.utc),
+                'end': datetime(2020, 1, 1, 0, 11, tzinfo=timezone.utc),
+                'status': 'closed',
+                'children': ['latency', 'errors'],
+            }
+        ])
+
+    def test_or_matches_child_breaches(self):
+        latency, errors = self.children()
+        breaches = backtest_composite([latency, errors], 'ALARM(latency) OR ALARM(errors)')
+        self.assertEqual(len(breaches), 1)
+        self.assertEqual(breaches[0]['start'], get_breaches(latency.data, 10, AlarmType.GREATER_THAN, 1, 1)[0]['start'])
+        self.assertEqual(breaches[0]['end'], get_breaches(errors.data, 10, AlarmType.GREATER_THAN, 1, 1)[0]['end'])
+
+    def test_not(self):
+        breaches = backtest_composite(self.children(), 'ALARM(latency) AND NOT ALARM(errors)')
+        self.assertEqual([(b['start'].minute, b['end'].minute) for b in breaches], [(2, 6)])
+
+    def test_forward_fills_coarser_children(self):
+        latency, _ = self.children()
+        errors = ChildAlarm('errors', CompositeTest.example_timeseries(5, 9, step=5), 10, AlarmType.GREATER_THAN, 1)
+        breaches = backtest_composite([latency, errors], 'ALARM(latency) AND ALARM(errors)')
+        self.assertEqual([(b['start'].minute, b['end'].minute) for b in breaches], [(5, 10)])
+
+    def test_states_match_alarm_states(self):
+        rng = random.Random(5)
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for step, window_size in ((1, 5), (5, 15), (5, 3)):
+            data = [(start + timedelta(minutes=i * step), rng.uniform(0, 20)) for i in range(500)]
+            child = ChildAlarm('child', data, 15, AlarmType.GREATER_THAN, window_size, 2)
+            _, masks = align([child])
+            self.assertEqual(masks['child'], pack(alarm_states(data, 15, AlarmType.GREATER_THAN, window_size, 2)))
+
+    def test_many_children_over_weeks(self):
+        rng = random.Random(1)
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        timestamps = [start + timedelta(minutes=i) for i in range(21 * 24 * 60)]
+        children = [ChildAlarm(f'c{j}', [(t, rng.uniform(0, 100)) for t in timestamps], 99, AlarmType.GREATER_THAN, 5)
+                    for j in range(36)]
+        rule = ' OR '.join(f'ALARM(c{j})' for j in range(0, 36, 2)) + ' AND ALARM(c1)'
+
+        began = time.perf_counter()
+        backtest_composite(children, rule)
+        self.assertLess(time.perf_counter() - began, 1)
+
+    def test_invalid_rule(self):
+        with self.assertRaises(ValueError):
+            parse_rule('ALARM(latency) AND')
+        with self.assertRaises(ValueError):
+            backtest_composite(self.children(), 'ALARM(unknown)')
@@ -0,0 +1,111 @@
+from cwtune.incidents import Incident, IntervalIndex, Score, load_incidents, score, score_candidates, best_score
+from cwtune.timeseries import get_breaches
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+class IncidentsTest(unittest.TestCase):
+
+    def test_overlapping_matches_brute_force(self):
+        rng = random.Random(7)
+        incidents = []
+        for _ in range(300):
+            start = START + timedelta(minutes=rng.randint(0, 100000))
+            incidents.append(Incident('svc', start, start + timedelta(minutes=rng.choice([1, 30, 600, 5000]))))
+        # One long early incident
+        incidents.append(Incident('svc', START, START + timedelta(minutes=90000)))
+        index = IntervalIndex(incidents)
+
+        for _ in range(200):
+            start = START + timedelta(minutes=rng.randint(-1000, 110000))
+            end = start + timedelta(minutes=rng.randint(0, 2000))
+            found = {index.intervals[i] for i in index.overlapping(start, end)}
+            self.assertEqual(found, {i for i in incidents if i.start <= end and i.end >= start})
+
+    def test_overlapping_after_long_incident(self):
+        incidents = [Incident('svc', START, START + timedelta(days=365))]
+        incidents += [Incident('svc', START + timedelta(minutes=i), START + timedelta(minutes=i)) for i in range(1, 50000)]
+        index = IntervalIndex(incidents)
+
+        began = time.perf_counter()
+        for i in range(0, 50000, 50):
+            self.assertEqual(len(index.overlapping(START + timedelta(minutes=i, seconds=30), START + timedelta(minutes=i, seconds=30))), 1)
+        self.assertLess(time.perf_counter() - began, 1)
+
+    def test_score(self):
+        incidents = [Incident('svc', START + timedelta(hours=h), START + timedelta(hours=h, minutes=30)) for h in (1, 5, 9)]
+        breaches = [
+            {'start': START + timedelta(hours=1, minutes=10), 'end': START + timedelta(hours=1, minutes=20)},
+            {'start': START + timedelta(hours=3), 'end': START + timedelta(hours=3, minutes=5)},
+            # Already in breach when the incident started, so it does not count
+            {'start': START + timedelta(hours=4, minutes=50), 'end': START + timedelta(hours=6)},
+            {'start': START + timedelta(hours=9, minutes=20), 'end': START + timedelta(hours=9, minutes=25)},
+        ]
+        index = IntervalIndex(incidents)
+
+        result = score(breaches, index, set(range(len(index))))
+        self.assertEqual((result.alerts, result.true_alerts, result.detected), (4, 2, 2))
+        self.assertEqual((result.precision, result.recall), (0.5, 2 / 3))
+        self.assertEqual(result.mean_time_to_detect, timedelta(minutes=15))
+
+    def test_load_incidents(self):
+        rows = [{'service': 'a', 'start': '2020-01-01T00:00:00Z', 'end': '2020-01-01T01:00:00+00:00'},
+                {'service': 'b', 'start': '2020-01-02T00:00:00', 'end': '2020-01-02T01:00:00'}]
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'incidents.csv')
+            with open(csv_path, 'w') as f:
+                f.write('service,start,end\n')
+                f.writelines(f"{r['service']},{r['start']},{r['end']}\n" for r in rows)
+            jsonl_path = os.path.join(directory, 'incidents.jsonl')
+            with open(jsonl_path, 'w') as f:
+                f.writelines(json.dumps(r) + '\n' for r in rows)
+
+            self.assertEqual(load_incidents(csv_path), load_incidents(jsonl_path))
+            self.assertEqual(load_incidents(csv_path, 'b'),
+                             [Incident('b', datetime(2020, 1, 2, tzinfo=timezone.utc), datetime(2020, 1, 2, 1, tzinfo=timezone.utc))])
+
+    def test_immediate_detection_ranks_first(self):
+        def scored(mean_time_to_detect):
+            return Score(None, None, None, 1, 1, 1, 1, 1, 1, 1, mean_time_to_detect, [])
+
+        immediate, slow, never = scored(timedelta(0)), scored(timedelta(minutes=20)), scored(None)
+        self.assertIs(best_score([never, slow, immediate]), immediate)
+        self.assertIs(best_score([never, slow]), slow)
+
+    def test_candidates_match_get_breaches(self):
+        rng = random.Random(9)
+        for period in (1, 5):
+            data = [(START + timedelta(minutes=i * period), rng.uniform(0, 20)) for i in range(500)]
+            for candidate in score_candidates(data, AlarmType.GREATER_THAN, [], window_sizes=[1, 5, 15], num_thresholds=5):
+                expected = get_breaches(data, candidate.threshold, AlarmType.GREATER_THAN, candidate.window_size,
+                                        candidate.datapoints_to_alarm)
+                self.assertEqual([(b['start'], b['end']) for b in candidate.breaches], [(b['start'], b['end']) for b in expected])
+
+    def test_best_score_detects_incidents(self):
+        rng = random.Random(3)
+        data = [(START + timedelta(minutes=i), rng.uniform(5, 15)) for i in range(3 * 24 * 60)]
+        incidents = []
+        for hour in (6, 30, 50):
+            incidents.append(Incident('svc', START + timedelta(hours=hour), START + timedelta(hours=hour, minutes=30)))
+            for i in range(hour * 60, hour * 60 + 30):
+                data[i] = (data[i][0], 100)
+        # Short spikes that are not incidents
+        for minute in (600, 2400, 3900):
+            data[minute] = (data[minute][0], 60)
+
+        best = best_score(score_candidates(data, AlarmType.GREATER_THAN, incidents))
+        self.assertEqual((best.precision, best.recall), (1, 1))
+        self.assertEqual(best.alerts, 3)
+        self.assertLess(best.mean_time_to_detect, timedelta(minutes=5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from cwtune.inventory import AlarmInventory
+from cwtune.aws import create_cloudwatch_alarm
+from cwtune.cli import AlarmType
+from unittest import mock
+
+import os
+import tempfile
+import unittest
+
+class InventoryTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': [{'Name': 'InstanceId', 'Value': 'i-1'}]}
+
+    def alarm(self, name, actions, updated='2020-01-01', metric=METRIC):
+        return dict(metric, AlarmName=name, AlarmActions=actions, Threshold=90.0, Statistic='Sum', Period=300,
+                    ComparisonOperator='GreaterThanThreshold', AlarmConfigurationUpdatedTimestamp=updated)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inventory = AlarmInventory(os.path.join(self.directory.name, 'inventory.db'))
+        self.client = mock.Mock()
+        other = {'Namespace': 'AWS/EC2', 'MetricName': 'NetworkIn', 'Dimensions': []}
+        self.client.describe_alarms.side_effect = [
+            {'MetricAlarms': [self.alarm('cpu', ['arn:a', 'arn:b'])], 'NextToken': '2'},
+            {'MetricAlarms': [self.alarm('network', ['arn:b'], metric=other), self.alarm('disk', ['arn:c'], metric=other)]},
+        ]
+        self.client.describe_alarms_for_metric.return_value = {'MetricAlarms': [self.alarm('cpu', ['arn:a', 'arn:b'])]}
+        self.inventory.refresh(self.client)
+
+    def tearDown(self):
+        self.inventory.close()
+        self.directory.cleanup()
+
+    def test_lookups(self):
+        self.assertEqual(self.inventory.suggested_actions(), ['arn:b', 'arn:a', 'arn:c'])
+        self.assertEqual(self.inventory.suggested_actions(limit=1), ['arn:b'])
+        self.assertEqual([alarm['AlarmName'] for alarm in self.inventory.alarms_for_metric(InventoryTest.METRIC)], ['cpu'])
+        # Dimension order does not matter
+        self.assertEqual(self.inventory.alarms_for_metric(dict(InventoryTest.METRIC, Dimensions=[{'Value': 'i-1', 'Name': 'InstanceId'}]))[0]['AlarmName'], 'cpu')
+
+    def test_incremental_refresh(self):
+        self.assertEqual(self.inventory.refresh(self.client), 0)
+        self.assertEqual(self.client.describe_alarms.call_count, 2)
+
+        self.client.describe_alarms.side_effect = [{'MetricAlarms': [self.alarm('cpu', ['arn:a', 'arn:b']), self.alarm('disk', ['arn:d'], '2020-02-01')]}]
+        self.assertEqual(self.inventory.refresh(self.client, force=True), 2)
+        self.assertEqual(self.inventory.suggested_actions(), ['arn:a', 'arn:b', 'arn:d'])
+
+    @mock.patch('cwtune.aws.shorten_url', side_effect=lambda url: url)
+    @mock.patch('click.prompt', side_effect=[1])
+    @mock.patch('click.confirm', side_effect=[True])
+    def test_updates_existing_alarm(self, confirm, prompt, shorten_url):
+        self.client.meta.region_name = 'us-east-1'
+        self.client.describe_alarms.side_effect = None
+        self.client.describe_alarms.return_value = {'MetricAlarms': [self.alarm('cpu', ['arn:a', 'arn:b'])]}
+        metric = InventoryTest.METRIC
+        create_cloudwatch_alarm(metric['MetricName'], metric['Namespace'], metric['Dimensions'], 80, AlarmType.GREATER_THAN,
+                                self.client, inventory=self.inventory)
+
+        args, kwargs = self.client.put_metric_alarm.call_args
+        self.assertEqual(kwargs['AlarmName'], 'cpu')
+        self.assertEqual(kwargs['AlarmActions'], ['arn:b'])
+        # The fresh inventory is used, and only the chosen alarm is described
+        self.assertEqual(self.client.describe_alarms.call_count, 3)
+        self.assertEqual(self.client.describe_alarms.call_args, mock.call(AlarmNames=['cpu']))
+        self.client.describe_alarms_for_metric.assert_not_called()
+        self.assertEqual(self.inventory.alarms_for_metric(metric)[0]['Threshold'], 80)
+
+    @mock.patch('cwtune.aws.shorten_url', side_effect=lambda url: url)
+    @mock.patch('click.prompt', side_effect=[1])
+    @mock.patch('click.confirm', side_effect=[True])
+    def test_creates_alarm_when_chosen_alarm_was_deleted(self, confirm, prompt, shorten_url):
+        self.client.meta.region_name = 'us-east-1'
+        self.client.describe_alarms.side_effect = None
+        self.client.describe_alarms.return_value = {'MetricAlarms': []}
+        metric = InventoryTest.METRIC
+        create_cloudwatch_alarm(metric['MetricName'], metric['Namespace'], metric['Dimensions'], 80, AlarmType.GREATER_THAN,
+                                self.client, inventory=self.inventory)
+
+        args, kwargs = self.client.put_metric_alarm.call_args
+        self.assertEqual(kwargs['AlarmName'], 'CPUUtilization Greater Than 80')
+
+    @mock.patch('cwtune.aws.shorten_url', side_effect=lambda url: url)
+    @mock.patch('click.prompt', side_effect=[1])
+    @mock.patch('click.confirm')
+    def test_only_offers_alarms_on_the_same_terms(self, confirm, prompt, shorten_url):
+        self.client.meta.region_name = 'us-east-1'
+        ok_alarm = dict(self.alarm('cpu', ['arn:a']), OKActions=['arn:ok'])
+        self.inventory.record(dict(ok_alarm, ComparisonOperator='LessThanThreshold'))
+        self.inventory.record(dict(ok_alarm, AlarmName='cpu p99', Statistic='p99'))
+        metric = InventoryTest.METRIC
+        create_cloudwatch_alarm(metric['MetricName'], metric['Namespace'], metric['Dimensions'], 80, AlarmType.GREATER_THAN,
+                                self.client, inventory=self.inventory)
+
+        confirm.assert_not_called()
+        args, kwargs = self.client.put_metric_alarm.call_args
+        self.assertEqual(kwargs['AlarmName'], 'CPUUtilization Greater Than 80')
+        self.assertEqual(kwargs['OKActions'], [])
+
+        self.inventory.record(ok_alarm)
+        self.client.describe_alarms.side_effect = None
+        self.client.describe_alarms.return_value = {'MetricAlarms': [ok_alarm]}
+        confirm.return_value = True
+        prompt.side_effect = [1]
+        create_cloudwatch_alarm(metric['MetricName'], metric['Namespace'], metric['Dimensions'], 80, AlarmType.GREATER_THAN,
+                                self.client, inventory=self.inventory)
+
+        args, kwargs = self.client.put_metric_alarm.call_args
+        self.assertEqual(kwargs['AlarmName'], 'cpu')
+        self.assertEqual(kwargs['OKActions'], ['arn:ok'])
@@ -0,0 +1,35 @@
+from cwtune.mofn import alert_count_table, select_configuration
+from cwtune.timeseries import get_breaches
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+
+import random
+import unittest
+
+class MofNTest(unittest.TestCase):
+
+    def example_timeseries():
+        rng = random.Random(7)
+        start = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        return [(start + timedelta(minutes=i), rng.random() * 100) for i in range(500)]
+
+    def test_matches_get_breaches(self):
+        data = MofNTest.example_timeseries()
+        table = alert_count_table(data, 70, AlarmType.GREATER_THAN, 12)
+        for (m, n), alerts in table.items():
+            self.assertEqual(alerts, len(get_breaches(data, 70, AlarmType.GREATER_THAN, n, m)), (m, n))
+
+    def test_lt(self):
+        data = MofNTest.example_timeseries()
+        table = alert_count_table(data, 30, AlarmType.LESS_THAN, 5)
+        self.assertEqual(table[(3, 5)], len(get_breaches(data, 30, AlarmType.LESS_THAN, 5, 3)))
+
+    def test_table_covers_all_configurations(self):
+        table = alert_count_table(MofNTest.example_timeseries(), 70, AlarmType.GREATER_THAN)
+        self.assertEqual(len(table), 60 * 61 // 2)
+        self.assertNotIn((2, 1), table)
+
+    def test_select_configuration(self):
+        table = {(1, 1): 20, (1, 2): 15, (2, 2): 4, (2, 3): 3, (3, 3): 1}
+        self.assertEqual(select_configuration(table, 5), (2, 2))
+        self.assertIsNone(select_configuration(table, 0))
@@ -0,0 +1,40 @@
+from cwtune.plot import lttb, render, breach_columns
+from datetime import datetime, timezone, timedelta
+
+import unittest
+
+class PlotTest(unittest.TestCase):
+
+    def example_timeseries(count=1000, spike=500):
+        start = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        return [(start + timedelta(minutes=i), 100 if i == spike else i % 7) for i in range(count)]
+
+    def test_lttb(self):
+        values = [value for timestamp, value in PlotTest.example_timeseries()]
+        indices = lttb(values, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        self.assertIn(500, indices)
+        self.assertEqual(indices, sorted(indices))
+        self.assertEqual(lttb(values[:10], 50), list(range(10)))
+
+    def test_breach_columns(self):
+        data = PlotTest.example_timeseries()
+        timestamps = [timestamp for timestamp, value in data]
+        breach = {'start': timestamps[500], 'end': timestamps[502]}
+        columns = breach_columns(timestamps, [0, 250, 499, 750, 999], [breach])
+        self.assertEqual(columns, [False, False, True, False, False])
+
+    def test_render(self):
+        data = PlotTest.example_timeseries()
+        timestamps = [timestamp for timestamp, value in data]
+        lines = render(data, 50, [{'start': timestamps[500], 'end': timestamps[501]}], width=80, height=8, color=False)
+
+        self.assertEqual(len(lines), 10)
+        self.assertTrue(all(len(line) == 80 for line in lines[:9]))
+        self.assertTrue(lines[0].startswith(' 100│'))
+        self.assertTrue(lines[3].startswith('  50│─'))
+        self.assertIn('█', lines[0])
+        self.assertTrue(lines[-1].strip().startswith('2020-01-01 00:00:00'))
+        self.assertEqual(render([], 50, []), [])
@@ -0,0 +1,61 @@
+from cwtune.seasonal import build_profile, cached_profile, compare, hour_of_week, scores, band, HOURS_PER_WEEK
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+
+import math
+import random
+import unittest
+
+class SeasonalTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/ApplicationELB', 'MetricName': 'RequestCount', 'Dimensions': []}
+
+    def daily_cycle(days, spike_rate=0.001):
+        rng = random.Random(days)
+        start = datetime(2020, 1, 6, tzinfo=timezone.utc)
+        data = []
+        for i in range(days * 24 * 60):
+            timestamp = start + timedelta(minutes=i)
+            value = 100 + 80 * math.sin(2 * math.pi * timestamp.hour / 24) + rng.gauss(0, 5)
+            data.append((timestamp, value + (100 if rng.random() < spike_rate else 0)))
+        return data
+
+    def test_profile_follows_the_cycle(self):
+        data = SeasonalTest.daily_cycle(14)
+        profile = build_profile(data)
+
+        self.assertEqual(len(profile.median), HOURS_PER_WEEK)
+        self.assertEqual(hour_of_week(datetime(2020, 1, 7, 6, tzinfo=timezone.utc)), 30)
+        self.assertAlmostEqual(profile.median[6], 180, delta=5)
+        self.assertAlmostEqual(profile.median[18], 20, delta=5)
+        for median, lower, upper in zip(*profile):
+            self.assertLessEqual(lower, median)
+            self.assertLessEqual(median, upper)
+
+    def test_scores_match_band(self):
+        data = SeasonalTest.daily_cycle(7)
+        profile = build_profile(data)
+        for alarm_type in (AlarmType.GREATER_THAN, AlarmType.LESS_THAN):
+            thresholds = band(profile, 2, alarm_type)
+            for (timestamp, value), score in zip(data[:500], scores(data[:500], profile, alarm_type)):
+                breached = value > thresholds[hour_of_week(timestamp)] if alarm_type.is_gt() else value < thresholds[hour_of_week(timestamp)]
+                self.assertEqual(score > 2, breached)
+
+    def test_seasonal_band_is_tighter_than_static(self):
+        data = SeasonalTest.daily_cycle(14)
+        for alarm_type in (AlarmType.GREATER_THAN, AlarmType.LESS_THAN):
+            comparison = compare(data, alarm_type, window_size=5, max_alerts=11, period=1)
+
+            self.assertLessEqual(comparison.static_alerts, 11)
+            self.assertLessEqual(comparison.seasonal_alerts, 11)
+            self.assertLess(comparison.seasonal_headroom, comparison.static_headroom / 2)
+
+    def test_profile_is_cached(self):
+        data = SeasonalTest.daily_cycle(7)
+        profile = cached_profile(SeasonalTest.METRIC, 'Sum', 1, data)
+
+        self.assertIs(cached_profile(SeasonalTest.METRIC, 'Sum', 1, data), profile)
+        self.assertIsNot(cached_profile(SeasonalTest.METRIC, 'Sum', 1, data[:-1]), profile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from cwtune.server import TuningService
+from cwtune.seasonal import build_profile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import asyncio
+import http.client
+import json
+import threading
+import unittest
+
+class ServerTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': [{'Name': 'InstanceId', 'Value': 'i-1234567890abcdef0'}]}
+
+    def setUp(self):
+        end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        timestamps = [end - timedelta(minutes=5 * i) for i in range(200)]
+
+        self.client = mock.Mock()
+        self.client.list_metrics.return_value = {'Metrics': [
+            ServerTest.METRIC,
+            {'Namespace': 'AWS/EC2', 'MetricName': 'NetworkIn', 'Dimensions': []},
+        ]}
+        self.client.get_metric_data.return_value = {'MetricDataResults': [
+            {'Timestamps': timestamps, 'Values': [100 if i % 50 == 0 else 10 for i in range(200)]}
+        ]}
+        self.client.put_metric_alarm.return_value = {}
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.service = TuningService(self.client, self.executor)
+        self.server = self.loop.run_until_complete(self.service.start('127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown()
+
+    async def shutdown(self):
+        # Let the handlers of the closed connections finish before the loop stops
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+
+    def connect(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.connections.append(connection)
+        return connection
+
+    def request(self, method, path, body=None, connection=None):
+        connection = connection or self.connect()
+        connection.request(method, path, body=json.dumps(body) if body is not None else None)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_search(self):
+        status, payload = self.request('GET', '/metrics?q=NetworkIn&limit=1')
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['metrics'][0]['MetricName'], 'NetworkIn')
+
+        self.request('GET', '/metrics?q=CPU')
+        self.assertEqual(self.client.list_metrics.call_count, 1)
+
+    def test_backtest_is_cached(self):
+        connection = self.connect()
+        body = {'metric': ServerTest.METRIC, 'alarm_type': 'gt', 'period': 5, 'window_size': 1, 'threshold': 50}
+        status, payload = self.request('POST', '/backtest', body, connection)
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['alerts'], 4)
+        self.assertEqual(payload['threshold'], 50)
+
+        status, again = self.request('POST', '/backtest', body, connection)
+        self.assertEqual(again, payload)
+        self.assertEqual(self.client.get_metric_data.call_count, 1)
+
+        status, curve = self.request('POST', '/curve', dict(body, num_points=5), connection)
+        self.assertEqual(status, 200)
+        self.assertEqual(curve['curve'][-1], {'threshold': 100, 'alerts': 0})
+        self.assertEqual(self.client.get_metric_data.call_count, 1)
+
+    @mock.patch('cwtune.seasonal.build_profile', wraps=build_profile)
+    def test_seasonal_reuses_profile(self, profile):
+        body = {'metric': ServerTest.METRIC, 'alarm_type': 'gt', 'period': 5, 'window_size': 1, 'max_alerts': 5}
+        status, payload = self.request('POST', '/seasonal', body)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(payload['band']), 168)
+
+        self.request('POST', '/seasonal', dict(body, max_alerts=3))
+        self.assertEqual(profile.call_count, 1)
+
+    def test_create_alarm(self):
+        status, payload = self.request('POST', '/alarms', {
+            'metric': ServerTest.METRIC, 'alarm_type': 'gt', 'period': 5, 'window_size': 5, 'threshold': 50, 'actions': ['arn:sns'],
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['alarm_name'], 'CPUUtilization Greater Than 50')
+        args, kwargs = self.client.put_metric_alarm.call_args
+        self.assertEqual(kwargs['AlarmActions'], ['arn:sns'])
+        self.assertEqual(kwargs['DatapointsToAlarm'], 3)
+
+    def test_errors(self):
+        self.assertEqual(self.request('GET', '/unknown')[0], 404)
+        self.assertEqual(self.request('POST', '/backtest', {'alarm_type': 'gt'})[0], 400)
+        self.assertEqual(self.request('POST', '/alarms', {'metric': ServerTest.METRIC})[0], 400)
+        self.assertEqual(self.request('GET', '/metrics?limit=ten')[0], 400)
+        self.assertEqual(self.request('POST', '/backtest', {'metric': ServerTest.METRIC, 'threshold': 'high'})[0], 400)
+        self.assertEqual(self.request('POST', '/alarms', {'metric': ServerTest.METRIC, 'threshold': [50]})[0], 400)
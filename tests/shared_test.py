@@ -0,0 +1,45 @@
+from cwtune.shared import create_store, attach_store, sweep
+from cwtune.timeseries import get_breaches, longest_breach
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+
+import random
+import unittest
+
+class SharedTest(unittest.TestCase):
+
+    def example_series(count, length):
+        rng = random.Random(count)
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        return [[(start + timedelta(minutes=5 * i), rng.choice([0, 10, 50])) for i in range(rng.randint(0, length))]
+                for _ in range(count)]
+
+    def test_attach_is_zero_copy(self):
+        series = SharedTest.example_series(3, 50)
+        with create_store(series) as store:
+            attached = attach_store(*store.manifest)
+            store.values[store.offsets[1]] = 1234.5
+
+            epochs, values = attached.series(1)
+            self.assertEqual(values[0], 1234.5)
+            self.assertEqual(epochs[0], int(series[1][0][0].timestamp()))
+            self.assertEqual(len(attached), 3)
+            del epochs, values
+            attached.close()
+
+    def test_sweep_matches_get_breaches(self):
+        series = SharedTest.example_series(20, 500)
+        candidates = [(20, True, 15, 2), (5, False, 10, 1), (40, True, 30, 3)]
+
+        with create_store(series) as store:
+            with store.executor(max_workers=2) as executor:
+                results = sweep(store, {i: candidates for i in range(len(series))}, executor)
+
+        for i, data in enumerate(series):
+            for (threshold, is_gt, window_size, time_threshold), result in zip(candidates, results[i]):
+                breaches = get_breaches(data, threshold, AlarmType.GREATER_THAN if is_gt else AlarmType.LESS_THAN,
+                                        window_size, time_threshold)
+                self.assertEqual(result, (len(breaches), longest_breach(breaches).total_seconds()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+from cwtune.sparse import sparse_series, SparseSeries
+from cwtune.timeseries import get_breaches, zero_pad
+from cwtune.api import tune
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import random
+import unittest
+
+class SparseTest(unittest.TestCase):
+
+    START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def random_points(seed, count, period, density=0.3):
+        rng = random.Random(seed)
+        return [(SparseTest.START + timedelta(minutes=period * i), rng.choice([0, 5, 20, 20, 50]))
+                for i in range(count) if rng.random() < density]
+
+    def spans(breaches):
+        return [(breach['start'], breach['end']) for breach in breaches]
+
+    def test_runs(self):
+        points = [(SparseTest.START + timedelta(minutes=i), 7) for i in (2, 3, 4, 8)]
+        series = sparse_series(points, 1, SparseTest.START, SparseTest.START + timedelta(minutes=9))
+
+        self.assertEqual(series.runs, [[0, 2, None], [2, 3, 7], [5, 3, None], [8, 1, 7], [9, 1, None]])
+        self.assertEqual(series.value_counts(), [(7, 3), (7, 1)])
+        self.assertEqual(series.to_dense(), zero_pad(points, 1, SparseTest.START, SparseTest.START + timedelta(minutes=9)))
+
+    def test_matches_dense_breaches(self):
+        for seed in range(50):
+            period = [1, 5][seed % 2]
+            points = SparseTest.random_points(seed, 300, period)
+            end = SparseTest.START + timedelta(minutes=period * 299)
+            for mode, fill in (('notBreaching', 0), ('missing', 0), ('breaching', 1000)):
+                series = sparse_series(points, period, SparseTest.START, end, mode)
+                for window_size, datapoints in ((1, 1), (5, 3), (15, 2), (30, 4)):
+                    self.assertEqual(
+                        SparseTest.spans(series.breaches(10, AlarmType.GREATER_THAN, window_size, datapoints)),
+                        SparseTest.spans(get_breaches(series.to_dense(fill), 10, AlarmType.GREATER_THAN, window_size, datapoints)))
+
+    def test_missing_data_is_not_zero(self):
+        # A less than alarm on a zero padded series would breach in every gap
+        points = [(SparseTest.START + timedelta(minutes=i), 100) for i in range(0, 600, 60)]
+        end = SparseTest.START + timedelta(minutes=599)
+
+        self.assertGreater(len(get_breaches(zero_pad(points, 1, SparseTest.START, end), 10, AlarmType.LESS_THAN, 5, 3)), 0)
+        self.assertEqual(sparse_series(points, 1, SparseTest.START, end, 'missing').breaches(10, AlarmType.LESS_THAN, 5, 3), [])
+        self.assertEqual(len(sparse_series(points, 1, SparseTest.START, end, 'breaching').breaches(10, AlarmType.LESS_THAN, 5, 3)), 1)
+
+    def test_ignore_holds_the_state(self):
+        points = [(SparseTest.START + timedelta(minutes=i), value) for i, value in ((0, 50), (1, 50), (2, 50), (20, 0), (21, 0))]
+        series = sparse_series(points, 1, SparseTest.START, SparseTest.START + timedelta(minutes=30), 'ignore')
+
+        breaches = series.breaches(10, AlarmType.GREATER_THAN, 3, 2)
+        self.assertEqual(SparseTest.spans(breaches), [(SparseTest.START + timedelta(minutes=1), SparseTest.START + timedelta(minutes=20))])
+        self.assertEqual(breaches[0]['values'], [50, 50])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            SparseSeries(SparseTest.START, 1, 0, [], 'zero')
+
+    def test_tune_sparse(self):
+        client = mock.Mock()
+        points = SparseTest.random_points(1, 20160, 1, density=0.005)
+        client.get_metric_data.return_value = {
+            'MetricDataResults': [{'Timestamps': [t for t, v in points], 'Values': [v for t, v in points]}]
+        }
+        metric = {'Namespace': 'AWS/Lambda', 'MetricName': 'Errors', 'Dimensions': []}
+
+        result = tune(metric, 'gt', period=1, client=client, start=SparseTest.START,
+                      end=SparseTest.START + timedelta(minutes=20159), treat_missing_data='notBreaching')
+
+        self.assertLessEqual(len(result.breaches), 11)
+        self.assertEqual(result.start, SparseTest.START)
+        self.assertTrue(result.alerts_curve)
+
+        # Only datapoints outside the range leave nothing to tune on
+        client.get_metric_data.return_value = {
+            'MetricDataResults': [{'Timestamps': [SparseTest.START - timedelta(days=1)], 'Values': [5]}]
+        }
+        self.assertIsNone(tune(metric, 'gt', period=1, client=client, start=SparseTest.START,
+                               end=SparseTest.START + timedelta(minutes=60), treat_missing_data='missing'))
+
+if __name__ == '__main__':
+    unittest.main()
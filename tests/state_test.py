@@ -0,0 +1,93 @@
+from cwtune.state import MetricState, retune
+from cwtune.timeseries import BreachTracker, get_breaches
+from cwtune.cli import AlarmType
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+import random
+import tempfile
+import unittest
+
+class StateTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': [{'Name': 'InstanceId', 'Value': 'i-1'}]}
+
+    def example_timeseries(start, count):
+        rng = random.Random(count)
+        return [(start + timedelta(minutes=i), 100 if rng.random() > 0.9 else 0) for i in range(count)]
+
+    def test_tracker_matches_get_breaches(self):
+        data = StateTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 500)
+        tracker = BreachTracker(10, AlarmType.GREATER_THAN, 3, 2)
+        breaches = []
+        for chunk in range(0, len(data), 37):
+            for timestamp, value in data[chunk:chunk + 37]:
+                breach = tracker.update(timestamp, value)
+                if breach:
+                    breaches.append(breach)
+        if tracker.open_breach:
+            breaches.append(tracker.close())
+
+        self.assertEqual(breaches, get_breaches(data, 10, AlarmType.GREATER_THAN, 3, 2))
+
+    def test_advance_resumes_after_reload(self):
+        data = StateTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 2000)
+        full = MetricState(StateTest.METRIC, 'Sum', 1, 'gt', 10, 3)
+        full.advance(data)
+
+        with tempfile.TemporaryDirectory() as directory:
+            state = MetricState(StateTest.METRIC, 'Sum', 1, 'gt', 10, 3)
+            state.advance(data[:1234])
+            state.save(directory)
+            state = MetricState.load(directory, StateTest.METRIC, 'Sum', 1, AlarmType.GREATER_THAN)
+            state.advance(data[1000:])
+
+        self.assertEqual(state.report(), full.report())
+        self.assertEqual(state.report()['alerts'], len(get_breaches(data, 10, AlarmType.GREATER_THAN, 3, 2)))
+
+    def test_retention(self):
+        state = MetricState(StateTest.METRIC, 'Sum', 60, 'gt', 10, 1, baseline=300)
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        state.advance([(start, 100), (start + timedelta(hours=1), 0)])
+        state.advance([(start + timedelta(days=20), 5)])
+        report = state.report()
+        self.assertEqual(report['alerts'], 0)
+        self.assertEqual(report['datapoints'], 1)
+        # The bound was 50 + 5 * 50 when the threshold was fitted and is now 5
+        self.assertEqual(report['drift'], -295)
+        # A greater than alarm is never suggested a negative threshold
+        self.assertEqual(report['suggested_threshold'], 0)
+
+        state = MetricState(StateTest.METRIC, 'Sum', 60, 'lt', 10, 1, baseline=300)
+        state.advance([(start, 5)])
+        self.assertEqual(state.report()['suggested_threshold'], 1)
+
+    def test_no_drift_on_fitted_data(self):
+        data = StateTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 2000)
+        client = mock.Mock()
+        client.get_metric_data.return_value = {'MetricDataResults': [{'Timestamps': [t for t, v in data], 'Values': [v for t, v in data]}]}
+
+        with tempfile.TemporaryDirectory() as directory:
+            report = retune(StateTest.METRIC, directory, client, period=1, end=data[-1][0])
+
+        self.assertEqual(report['drift'], 0)
+        self.assertEqual(report['suggested_threshold'], report['threshold'])
+
+    def test_retune_fetches_only_new_data(self):
+        end = datetime(2020, 1, 15, tzinfo=timezone.utc)
+        client = mock.Mock()
+        client.get_metric_data.side_effect = [
+            {'MetricDataResults': [{'Timestamps': [end - timedelta(hours=1)], 'Values': [3]}]},
+            # The datapoint at end + 2 hours has not been published yet
+            {'MetricDataResults': [{'Timestamps': [end + timedelta(hours=1)], 'Values': [4]}]},
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            retune(StateTest.METRIC, directory, client, period=60, threshold=10, end=end)
+            report = retune(StateTest.METRIC, directory, client, period=60, end=end + timedelta(hours=2))
+
+        first, second = client.get_metric_data.call_args_list
+        self.assertEqual(first.kwargs['StartTime'], end - timedelta(days=14))
+        self.assertEqual(second.kwargs['StartTime'], end)
+        self.assertEqual(report['last_timestamp'], end + timedelta(hours=1))
+        self.assertEqual(report['threshold'], 10)
@@ -0,0 +1,95 @@
+from cwtune.throttle import TokenBucket, RateLimiter, ThrottledClient
+from cwtune.backend import SyntheticClient, throttling_error
+from cwtune.aws import list_metrics, get_metric_data, session_client
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+
+import unittest
+
+class Clock:
+    """A manual clock, advanced by the sleeps of the code under test."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class ThrottleTest(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = Clock()
+        bucket = TokenBucket(2, clock)
+
+        self.assertEqual([bucket.acquire() for _ in range(2)], [0, 0])
+        self.assertEqual(bucket.acquire(), 0.5)
+        self.assertEqual(bucket.acquire(), 1.0)
+
+        clock.sleep(10)
+        self.assertEqual(bucket.acquire(), 0)
+
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+        for _ in range(100):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 2)
+
+    def test_retries_throttled_calls(self):
+        clock = Clock()
+        client = mock.Mock()
+        client.describe_alarms.side_effect = [throttling_error('DescribeAlarms'), throttling_error('DescribeAlarms'), {'MetricAlarms': []}]
+        throttled = ThrottledClient(client, RateLimiter(clock=clock), sleep=clock.sleep, seed=1)
+
+        self.assertEqual(throttled.describe_alarms(), {'MetricAlarms': []})
+        stats = throttled.limiter.stats()['describe_alarms']
+        self.assertEqual((stats['requests'], stats['throttles'], stats['retries'], stats['failures']), (3, 2, 2, 0))
+        self.assertGreater(clock.now, 0)
+
+    def test_gives_up_after_max_retries(self):
+        clock = Clock()
+        client = mock.Mock()
+        client.get_metric_data.side_effect = throttling_error('GetMetricData')
+        throttled = ThrottledClient(client, RateLimiter(clock=clock), max_retries=3, sleep=clock.sleep)
+
+        # A throttled fetch is an error, not a metric without data
+        with self.assertRaises(ClientError):
+            get_metric_data(datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2020, 1, 2, tzinfo=timezone.utc),
+                            'CPUUtilization', 'AWS/EC2', [], 5, 'Sum', throttled)
+        self.assertEqual(client.get_metric_data.call_count, 4)
+        self.assertEqual(throttled.limiter.totals()['failures'], 1)
+
+    def test_other_errors_are_not_retried(self):
+        client = mock.Mock()
+        client.put_metric_alarm.side_effect = ClientError({'Error': {'Code': 'ValidationError'}}, 'PutMetricAlarm')
+        throttled = ThrottledClient(client, RateLimiter(), sleep=lambda seconds: None)
+
+        with self.assertRaises(ClientError):
+            throttled.put_metric_alarm(AlarmName='a')
+        self.assertEqual(client.put_metric_alarm.call_count, 1)
+
+    def test_boto_client_does_not_retry(self):
+        client = session_client(region='eu-west-1')
+        self.assertIsInstance(client, ThrottledClient)
+        self.assertEqual(client.client.meta.config.retries['total_max_attempts'], 1)
+
+    def test_concurrent_workers_share_the_limiter(self):
+        backend = SyntheticClient(num_metrics=2000, throttle_rate=0.3, page_size=100, seed=1)
+        limiter = RateLimiter(limits={'list_metrics': 1000})
+        clients = [ThrottledClient(backend, limiter, base_delay=0.001, seed=i) for i in range(8)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(list_metrics, clients))
+
+        self.assertTrue(all(len(metrics) == 2000 for metrics in results))
+        totals = limiter.totals()
+        self.assertGreater(totals['throttles'], 0)
+        self.assertEqual(totals['failures'], 0)
+        self.assertEqual(totals['requests'], backend.calls['list_metrics'])
+
+if __name__ == '__main__':
+    unittest.main()
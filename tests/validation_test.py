@@ -0,0 +1,107 @@
+from cwtune.validation import load_history, walk_forward_folds, fold_ranges, validate
+from cwtune.cli import AlarmType
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+import random
+import tempfile
+import unittest
+
+class SeriesClient:
+    """Answers get_metric_data from a fixed series, recording each requested range."""
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime):
+        self.ranges.append((StartTime, EndTime))
+        points = [(t, v) for t, v in self.data if StartTime <= t <= EndTime]
+        return {'MetricDataResults': [{'Timestamps': [t for t, v in points], 'Values': [v for t, v in points]}]}
+
+class ValidationTest(unittest.TestCase):
+
+    METRIC = {'Namespace': 'AWS/EC2', 'MetricName': 'CPUUtilization', 'Dimensions': [{'Name': 'InstanceId', 'Value': 'i-1'}]}
+
+    def example_timeseries(start, days, period=60):
+        rng = random.Random(days)
+        return [(start + timedelta(minutes=i * period), 1000 if rng.random() > 0.98 else rng.randint(0, 10))
+                for i in range(days * 24 * 60 // period)]
+
+    def test_walk_forward_folds(self):
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        folds = walk_forward_folds(start, start + timedelta(days=35))
+
+        self.assertEqual(len(folds), 3)
+        self.assertEqual(folds[0].test_start, start + timedelta(days=14))
+        self.assertEqual(folds[1].train_start, start + timedelta(days=7))
+        self.assertEqual(folds[-1].test_end, start + timedelta(days=35))
+
+    def test_validate(self):
+        data = ValidationTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 42)
+
+        with ThreadPoolExecutor() as executor:
+            report = validate(data, AlarmType.GREATER_THAN, window_size=60, max_alerts=5, executor=executor)
+
+        self.assertEqual(len(report.results), 3)
+        for result in report.results:
+            self.assertLess(result.fold.train_start, result.fold.test_start)
+            self.assertLessEqual(result.train_alerts, 5)
+        self.assertEqual(report.max_test_alerts, max(result.test_alerts for result in report.results))
+        self.assertEqual(report.stable, report.variation <= 0.1)
+
+    def test_process_pool_reads_shared_series(self):
+        data = ValidationTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 28)
+
+        with ThreadPoolExecutor() as executor:
+            expected = validate(data, AlarmType.GREATER_THAN, window_size=60, max_alerts=5, executor=executor)
+        report = validate(data, AlarmType.GREATER_THAN, window_size=60, max_alerts=5, max_workers=2)
+
+        self.assertEqual(report, expected)
+
+    def test_validate_without_enough_history(self):
+        data = ValidationTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 10)
+        self.assertIsNone(validate(data, AlarmType.GREATER_THAN, executor=ThreadPoolExecutor()))
+        self.assertIsNone(validate([], AlarmType.GREATER_THAN))
+
+    def test_short_history_uses_shorter_ranges(self):
+        self.assertEqual(fold_ranges(timedelta(days=63)), (timedelta(days=14), timedelta(days=7)))
+        self.assertIsNone(fold_ranges(timedelta(days=10)))
+
+        # The 15 days CloudWatch keeps at a 1 minute period
+        data = ValidationTest.example_timeseries(datetime(2020, 1, 1, tzinfo=timezone.utc), 15, period=1)
+        report = validate(data, AlarmType.GREATER_THAN, window_size=60, max_alerts=5, executor=ThreadPoolExecutor())
+        self.assertEqual(len(report.results), 2)
+
+    def test_load_history_only_fetches_new_data(self):
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        data = ValidationTest.example_timeseries(now - timedelta(days=20), 21)
+        client = SeriesClient(data)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first, start, end = load_history(ValidationTest.METRIC, 'Sum', 60, client, days=14, cache_dir=cache_dir)
+            second, _, _ = load_history(ValidationTest.METRIC, 'Sum', 60, client, days=14, cache_dir=cache_dir)
+
+        # The second load is served from the cache, or only fetches what came after it
+        self.assertEqual(client.ranges[0][0], start)
+        for fetch_start, fetch_end in client.ranges[1:]:
+            self.assertGreater(fetch_start, first[-1][0])
+        self.assertEqual(first, second)
+
+    def test_load_history_picks_up_late_datapoints(self):
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        data = ValidationTest.example_timeseries(now - timedelta(days=20), 20)
+        late = {t: v + 1 for t, v in data if t > now - timedelta(hours=3)}
+        client = SeriesClient([(t, v) for t, v in data if t not in late])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first, _, _ = load_history(ValidationTest.METRIC, 'Sum', 60, client, days=14, cache_dir=cache_dir)
+            # The last datapoints are published after the first load
+            client.data = [(t, late.get(t, v)) for t, v in data]
+            second, _, _ = load_history(ValidationTest.METRIC, 'Sum', 60, client, days=14, cache_dir=cache_dir)
+
+        self.assertEqual({t: v for t, v in first if t in late}, {t: 0 for t in late})
+        self.assertEqual({t: v for t, v in second if t in late}, late)
+
+if __name__ == '__main__':
+    unittest.main()